@@ -1,4 +1,3 @@
-
 # coding: utf-8
 
 # In[1]:
@@ -7,329 +6,143 @@
 import pandas as pd
 import numpy as np
 import datetime
+import os
+import time
 #import reverse_geocode
 import plotly
 import plotly.graph_objs as go
 
+from covid19 import (CountryDimension, GroupIndex, JHU_BASE_URL, Panel, Pipeline, Snapshots, align_metrics, compact, 
+                     load_table, map_rows, page, plan_update, publish_plotlyjs, read_jhu, render_variants, 
+                     rollup_provinces, save_table, save_update, us_panel, write_files)
+from covid19.derivation import AVERAGED, WINDOWS, derive_columns
+from covid19.panel import days_since, first_reached, milestone_names, window_offsets
+
 #pd.set_option('display.max_columns', 500)
 #plotly.offline.init_notebook_mode(connected=True)
 
+# Every step below is a named stage. Stage outputs are cached in 
+# ../data_cache/stages/ and a stage only runs again when its code, parameters 
+# or inputs changed (see covid19/pipeline.py). Nothing runs before the last cell
+pipeline = Pipeline('../data_cache/stages/')
+
+# Worker processes for the charts and the US counties: COVID19_PROCESSES 
+# (default: one per core, 1 runs everything in this process)
+processes = int(os.environ.get('COVID19_PROCESSES', '0')) or None
+
 
 # In[2]:
 
 
 # Load data
-df_confirmed = pd.read_csv('https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv')
-df_deaths = pd.read_csv('https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv')
+# Files are cached in ../data_cache/ and only downloaded again when they change
+# upstream. COVID19_OFFLINE=1 reads the cached files only, COVID19_DATA_URL 
+# points the download to another server (e.g. a local mirror). COVID19_RECOVERED=1
+# also reads the recovered cases (and derives the active cases)
+cache_dir = '../data_cache/'
+offline = os.environ.get('COVID19_OFFLINE', '0') == '1'
+base_url = os.environ.get('COVID19_DATA_URL', JHU_BASE_URL)
+metrics = ['confirmed', 'deaths']
+if os.environ.get('COVID19_RECOVERED', '0') == '1':
+    metrics.append('recovered')
+
+@pipeline.stage('ingest', cache = False, params = {'metrics': metrics})
+def ingest(metrics):
+    return {m: read_jhu(m+'_global', cache_dir, base_url = base_url, offline = offline) for m in metrics}
+
+# Incremental update (COVID19_INCREMENTAL=1): only process the dates published 
+# since the previous run plus the trailing days the derived columns depend on.
+# Falls back to a full rebuild when upstream revised the history, or when the
+# code or parameters of the stages up to the final table changed
+state_dir = '../data_cache/'
+incremental = os.environ.get('COVID19_INCREMENTAL', '0') == '1'
+# Lengths of the centered moving averages (days): 'growth' (5) for the growth,
+# 'newcases' (3) for the new cases. They also set how many trailing days an
+# incremental update recomputes
+windows = dict(WINDOWS)
+
+@pipeline.stage('plan', inputs = ['ingest'], cache = False)
+def plan(tables):
+    config = pipeline.signature(['table'], given = ['ingest', 'plan'])
+    return plan_update(state_dir, tables, incremental = incremental, config = config, windows = windows)
 
 
 # In[3]:
 
 
-# Convert table
-def converttable(df):
-    cols=df.columns.tolist()
-    pd_list=[]
-    for i in range(5,df.shape[1]):
-        temp_cols=cols[:4]
-        temp_cols.append(cols[i])
-    # print(temp_cols)
-        temp_pd=df[temp_cols].copy()
-        temp_pd['dt']=cols[i]
-        temp_pd.rename(columns={cols[i]:'value'},inplace=True)
-        pd_list.append(temp_pd)
-    df_new=pd.concat(pd_list,axis=0,ignore_index=True)
-    return df_new
-
-df_confirmed_new = converttable(df_confirmed)
-df_deaths_new = converttable(df_deaths)
+@pipeline.stage('reshape', inputs = ['ingest', 'plan'], params = {'metrics': metrics})
+def reshape(tables, plan, metrics):
+    # Convert tables (wide, one column per date -> long, one row per date)
+    # The files list the same places in the same order: their values are put
+    # side by side as columns, no merge (places are checked, see align_metrics)
+    df_merged = align_metrics({m: plan.narrow(tables[m]) for m in metrics}, metrics)
+    return df_merged[['Province/State', 'Country/Region', 'Lat', 'Long', 'dt'] + metrics]
 
 
 # In[4]:
 
 
-# Change dates format
-df_confirmed_new['dt']=pd.to_datetime(df_confirmed_new['dt'])
-df_deaths_new['dt']=pd.to_datetime(df_deaths_new['dt'])
-
-
-# In[5]:
-
-
-# Rename cols
-df_confirmed_new.rename(columns = {'value': 'confirmed'}, inplace = True)
-df_deaths_new.rename(columns = {'value': 'deaths'}, inplace = True)
-
-
-# In[6]:
-
-
-# Merge two tables
-df_merged = df_confirmed_new.merge(df_deaths_new[['Province/State', 'Country/Region', 'dt', 'deaths']], 
-                                   on = ['Province/State', 'Country/Region', 'dt'], 
-                                   how = 'inner')
-df_merged = df_merged[['Province/State', 'Country/Region', 'Lat', 'Long', 'dt', 'confirmed', 'deaths']]
-#df_merged.head()
-
-
-# In[7]:
-
-
 # Extract and aggregate data for countries with provinces
 
-# US
-#df_us = df_merged[df_merged['Country/Region'] == 'US'].copy()
-#df_merged.drop(index = df_us.index, inplace = True)
-#us_agg = df_us.groupby(by = 'dt').sum().copy()
-#us_agg.reset_index(inplace = True)
-#us_agg['Lat'] = 37.0902
-#us_agg['Long'] = -95.7129
-#us_agg['Province/State'] = np.nan
-#us_agg['Country/Region'] = 'US'
-#df_merged = pd.concat([df_merged, us_agg], sort = False, ignore_index = True)
-
-# China
-df_china = df_merged[df_merged['Country/Region'] == 'China'].copy()
-df_merged.drop(index = df_china.index, inplace = True)
-china_agg = df_china.groupby(by = 'dt').sum()
-china_agg.reset_index(inplace = True)
-china_agg['Lat'] = 35.8617
-china_agg['Long'] = 104.1954
-china_agg['Province/State'] = np.nan
-china_agg['Country/Region'] = 'China'
-df_merged = pd.concat([df_merged, china_agg], sort = False, ignore_index = True)
-
-# Canada
-df_canada = df_merged[df_merged['Country/Region'] == 'Canada'].copy()
-df_merged.drop(index = df_canada.index, inplace = True)
-canada_agg = df_canada.groupby(by = 'dt').sum()
-canada_agg.reset_index(inplace = True)
-canada_agg['Lat'] = 56.1304
-canada_agg['Long'] = -106.3468
-canada_agg['Province/State'] = np.nan
-canada_agg['Country/Region'] = 'Canada'
-df_merged = pd.concat([df_merged, canada_agg], sort = False, ignore_index = True)
-
-# Australia
-df_aus = df_merged[df_merged['Country/Region'] == 'Australia'].copy()
-df_merged.drop(index = df_aus.index, inplace = True)
-aus_agg = df_aus.groupby(by = 'dt').sum()
-aus_agg.reset_index(inplace = True)
-aus_agg['Lat'] = -25.2744
-aus_agg['Long'] = 133.7751
-aus_agg['Province/State'] = np.nan
-aus_agg['Country/Region'] = 'Australia'
-df_merged = pd.concat([df_merged, aus_agg], sort = False, ignore_index = True)
-
-# France
-df_fra = df_merged[df_merged['Country/Region'] == 'France'].copy()
-df_merged.drop(index = df_fra.index, inplace = True)
-fra_agg = df_fra.groupby(by = 'dt').sum()
-fra_agg.reset_index(inplace = True)
-fra_agg['Lat'] = 46.2276
-fra_agg['Long'] = 2.2137
-fra_agg['Province/State'] = np.nan
-fra_agg['Country/Region'] = 'France'
-df_merged = pd.concat([df_merged, fra_agg], sort = False, ignore_index = True)
-
-# Denmark
-df_den = df_merged[df_merged['Country/Region'] == 'Denmark'].copy()
-df_merged.drop(index = df_den.index, inplace = True)
-den_agg = df_den.groupby(by = 'dt').sum()
-den_agg.reset_index(inplace = True)
-den_agg['Lat'] = 56.2639
-den_agg['Long'] = 9.5018
-den_agg['Province/State'] = np.nan
-den_agg['Country/Region'] = 'Denmark'
-df_merged = pd.concat([df_merged, den_agg], sort = False, ignore_index = True)
-
-# United Kingdom
-df_uk = df_merged[df_merged['Country/Region'] == 'United Kingdom'].copy()
-df_merged.drop(index = df_uk.index, inplace = True)
-uk_agg = df_uk.groupby(by = 'dt').sum()
-uk_agg.reset_index(inplace = True)
-uk_agg['Lat'] = 56.2639
-uk_agg['Long'] = 9.5018
-uk_agg['Province/State'] = np.nan
-uk_agg['Country/Region'] = 'United Kingdom'
-df_merged = pd.concat([df_merged, uk_agg], sort = False, ignore_index = True)
-
-# Netherlands
-df_net = df_merged[df_merged['Country/Region'] == 'Netherlands'].copy()
-df_merged.drop(index = df_net.index, inplace = True)
-net_agg = df_net.groupby(by = 'dt').sum()
-net_agg.reset_index(inplace = True)
-net_agg['Lat'] = 52.1326
-net_agg['Long'] = 5.2913
-net_agg['Province/State'] = np.nan
-net_agg['Country/Region'] = 'Netherlands'
-df_merged = pd.concat([df_merged, net_agg], sort = False, ignore_index = True)
-
-# Drop column province
-df_merged.drop(columns = ['Province/State'], inplace = True)
+# Countries to aggregate and their centroids (China, Canada, Australia, France, 
+# Denmark, United Kingdom, Netherlands); add a row to roll up another country,
+# e.g. 'US,37.0902,-95.7129'
+df_centroids = pd.read_csv('../data_tables/country_centroids.csv')
+
+@pipeline.stage('rollup', inputs = ['reshape'], params = {'centroids': df_centroids})
+def rollup(df_merged, centroids):
+    # A country reported by province in one file and as a whole in another 
+    # (e.g. Canada in the recovered cases) gets NaN, not 0, from its provinces
+    df_merged = rollup_provinces(df_merged, centroids)
+    # Active cases, once the countries are whole
+    if 'recovered' in df_merged:
+        df_merged['active'] = df_merged['confirmed'] - df_merged['deaths'] - df_merged['recovered']
+    # Drop column province
+    return df_merged.drop(columns = ['Province/State'])
+
+# From here on every metric is a country x day array (see covid19/panel.py):
+# daily changes, windows and ratios are computed along the dates, without 
+# sorting or grouping the long table
+@pipeline.stage('panel', inputs = ['rollup'])
+def panel(df_merged):
+    return Panel.from_long(df_merged, attributes = ['Lat', 'Long'])
 
 
-# In[8]:
+# In[5]:
 
 
 # Days since
 
-# Sort dataset by date ascending
-df_merged.sort_values(by = 'dt', ascending = True, inplace = True)
-
-# List of countries
-country_list = df_merged['Country/Region'].unique().tolist()
-
-# Locate day first case for each country
-first_confirmed = []
-first_50confirmed = []
-first_10deaths = []
-    
-for c in country_list:
-    tmp = df_merged[df_merged['Country/Region'] == c].copy()
-    if (c == 'China'):
-        first_confirmed.append(pd.to_datetime('2019/12/31'))
-    else:
-        first_confirmed.append(tmp.loc[tmp.confirmed.ne(0).idxmax(), 'dt'])
-        
-    first_50confirmed.append(tmp.loc[(tmp.confirmed >= 50).idxmax(), 'dt'])
-    first_10deaths.append(tmp.loc[(tmp.deaths >= 10).idxmax(), 'dt'])
-        
-
-df_first = pd.DataFrame(data = {'Country/Region': country_list, 
-                                'first_confirmed': first_confirmed,
-                                'first_50confirmed': first_50confirmed,
-                                'first_10deaths': first_10deaths,
-                               } 
-                       )
-
-# Convert to datetime
-df_first['first_confirmed'] = pd.to_datetime(df_first['first_confirmed'])
-df_first['first_50confirmed'] = pd.to_datetime(df_first['first_50confirmed'])
-df_first['first_10deaths'] = pd.to_datetime(df_first['first_10deaths'])
-#df_first.head()
-
-# Merge firsts with main table
-df_merged = df_merged.merge(df_first, on = 'Country/Region', how = 'left')
-
-# Convert data type
-df_merged['dt'] = pd.to_datetime(df_merged['dt'])
-
-# Calculate days since
-df_merged['days_since_1st_conf'] = df_merged['dt'] - df_merged['first_confirmed']
-df_merged['days_since_50th_conf'] = df_merged['dt'] - df_merged['first_50confirmed']
-df_merged['days_since_10th_deaths'] = df_merged['dt'] - df_merged['first_10deaths']
-
-# Transform date units
-df_merged['days_since_1st_conf'] = df_merged['days_since_1st_conf'].dt.days
-df_merged['days_since_50th_conf'] = df_merged['days_since_50th_conf'].dt.days
-df_merged['days_since_10th_deaths'] = df_merged['days_since_10th_deaths'].dt.days
-
-# Drop intermediate columns
-#df_merged.drop(columns = ['first_confirmed', 'first_50confirmed', 'first_10deaths'], inplace = True)
+# Locate day first case, 50th case and 10th death for each country and
+# calculate days since (NaN for countries that have not reached it yet)
+# The first case is the first nonzero count (a negative correction too)
+milestone_spec = [('confirmed', ('!=', 0), 'first_confirmed', 'days_since_1st_conf'),
+                  ('confirmed', 50, 'first_50confirmed', 'days_since_50th_conf'),
+                  ('deaths', 10, 'first_10deaths', 'days_since_10th_deaths'),
+                 ]
+# First case in China happened before the data starts
+milestone_overrides = {'first_confirmed': {'China': '2019/12/31'}}
+
+@pipeline.stage('milestones', inputs = ['panel'], 
+                params = {'spec': milestone_spec, 'overrides': milestone_overrides})
+def add_milestones(panel, spec, overrides):
+    panel = panel.copy()
+    panel.add_milestones(spec, overrides = overrides)
+    return panel
 
 # Check
 #df_merged[df_merged['Country/Region'] == 'Germany'][['dt', 'confirmed', 'deaths', 'days_since_1st_conf',
 #                                                     'days_since_50th_conf', 'days_since_10th_deaths']]
 
 
-# In[9]:
-
-
-# Daily new cases (confirmed and deaths)
-
-# Sort values
-df_merged.sort_values(by = ['Country/Region', 'dt'], ascending = True, inplace = True)
-# Differences
-df_merged['confirmed_newcases'] = df_merged.groupby(by = ['Country/Region']).confirmed.diff()
-df_merged['deaths_newcases'] = df_merged.groupby(by = ['Country/Region']).deaths.diff()
-#df_merged[df_merged['Country/Region'] == 'Germany'][['dt', 'confirmed', 'confirmed_diff']]
-
-# Moving average
-
-# Create columns
-df_merged['confirmed_newcases_movavg'] = np.nan
-df_merged['deaths_newcases_movavg'] = np.nan
-# Number of days
-days_num = df_merged['dt'].unique().shape[0]
-
-for c in country_list:
-    
-    tmp = df_merged[df_merged['Country/Region'] == c].copy()
-    tmp = tmp.sort_values(by = 'dt').reset_index()
-    
-    for i in range(1, days_num-1):
-        
-        df_merged.loc[tmp.loc[i,'index'], 'confirmed_newcases_movavg'] = ((
-            tmp.loc[i-1, 'confirmed_newcases'] +
-            tmp.loc[i, 'confirmed_newcases'] +
-            tmp.loc[i+1, 'confirmed_newcases'] )/3) 
-        
-        df_merged.loc[tmp.loc[i,'index'], 'deaths_newcases_movavg'] = ((
-            tmp.loc[i-1, 'deaths_newcases'] +
-            tmp.loc[i, 'deaths_newcases'] +
-            tmp.loc[i+1, 'deaths_newcases'] )/3)    
-        
-
-# Check
-#df_merged[df_merged['Country/Region'] == 'Germany'][['dt', 'confirmed', 'confirmed_newcases', 
-#                                                     'confirmed_newcases_growth', 
-#                                                     'confirmed_newcases_growth_movavg']]
-
-
-# In[10]:
+# In[6]:
 
 
-# New cases growth (new cases today divided by new cases yesterday)
-
-# Create columns
-df_merged['confirmed_newcases_growth'] = np.nan
-df_merged['deaths_newcases_growth'] = np.nan
-
-for c in country_list:
-    
-    tmp = df_merged[df_merged['Country/Region'] == c]
-    tmp = tmp.sort_values(by = 'dt').reset_index()
-    
-    for i in range(1, days_num):
-        if (tmp.loc[i-1, 'confirmed_newcases'] != 0):
-            df_merged.loc[tmp.loc[i,'index'] , 'confirmed_newcases_growth'] = (
-                tmp.loc[i, 'confirmed_newcases']/tmp.loc[i-1, 'confirmed_newcases'])
-        else:
-            df_merged.loc[tmp.loc[i,'index'] , 'confirmed_newcases_growth'] = np.nan
-        if (tmp.loc[i-1, 'deaths_newcases'] != 0):
-            df_merged.loc[tmp.loc[i,'index'] , 'deaths_newcases_growth'] = (
-                tmp.loc[i, 'deaths_newcases']/tmp.loc[i-1, 'deaths_newcases'])
-        else:
-            df_merged.loc[tmp.loc[i,'index'] , 'deaths_newcases_growth'] = np.nan
-        
-#df_merged[df_merged['Country/Region'] == 'Germany'][['dt', 'confirmed', 'confirmed_newcases', 
-#                                                     'confirmed_newcases_growth']]
-
-# New cases growth moving average
-
-df_merged['confirmed_newcases_growth_movavg'] = np.nan
-#df_merged['deaths_newcases_growth_movavg'] = np.nan
-
-for c in country_list:
-    
-    tmp = df_merged[df_merged['Country/Region'] == c].copy()
-    tmp = tmp.sort_values(by = 'dt').reset_index()
-    
-    for i in range(2, days_num-2):
-        
-        df_merged.loc[tmp.loc[i,'index'], 'confirmed_newcases_growth_movavg'] = ((
-            tmp.loc[i-2, 'confirmed_newcases_growth'] +
-            tmp.loc[i-1, 'confirmed_newcases_growth'] +
-            tmp.loc[i, 'confirmed_newcases_growth'] +
-            tmp.loc[i+1, 'confirmed_newcases_growth'] +
-            tmp.loc[i+2, 'confirmed_newcases_growth'] )/5) 
-        
-        #df_merged.loc[tmp.loc[i,'index'], 'deaths_newcases_growth_movavg'] = ((
-        #    tmp.loc[i-1, 'deaths_newcases_growth'] +
-        #    tmp.loc[i, 'deaths_newcases_growth'] +
-        #    tmp.loc[i+1, 'deaths_newcases_growth'] )/3)    
-        
+# Daily new cases (confirmed and deaths), their growth (new cases today 
+# divided by new cases yesterday) and its moving average, cases by 100.000 
+# hab., mortality rate and the moving averages of the new cases: the same 
+# steps as for the US counties below (see covid19/derivation.py), computed by
+# the 'columns' stage below
 
 # Check
 #df_merged[df_merged['Country/Region'] == 'Germany'][['dt', 'confirmed', 'confirmed_newcases', 
@@ -337,67 +150,124 @@ for c in country_list:
 #                                                     'confirmed_newcases_growth_movavg']]
 
 
-# In[11]:
+# In[7]:
 
 
-# Open population table
+# Open population table: countries by ISO code, found by their World Bank 
+# name or one of their other names (JHU names in ../data_tables/country_aliases.csv)
 df_pop = pd.read_csv('../data_tables/world_pop_by_country.csv')
-df_pop.rename(columns = {'Country Name': 'Country/Region', '2018': 'population_2018'}, inplace = True)
-
-# Merge population table
-df_merged = df_merged.merge(df_pop, on = 'Country/Region', how = 'left')
-
-#df_merged.sort_values('dt').head()
-
-
-# In[12]:
+df_pop.rename(columns = {'2018': 'population_2018'}, inplace = True)
+country_dim = CountryDimension(df_pop, pd.read_csv('../data_tables/country_aliases.csv'))
 
 
-# Cases by 100.000 hab.
-df_merged['confirmed_by100000pop'] = df_merged['confirmed']*100000/df_merged['population_2018']
-df_merged['deaths_by100000pop'] = df_merged['deaths']*100000/df_merged['population_2018']
-
-# Drop intermediate columns
-#df_merged.drop(columns = ['Country Code', 'population_2018'], inplace = True)
-df_merged.drop(columns = ['Country Code'], inplace = True)
-
-
-# In[13]:
-
-
-# Mortality rate
-df_merged['MortalityRate'] = df_merged['deaths']/df_merged['confirmed']
+# In[8]:
 
 
-# In[14]:
+@pipeline.stage('columns', inputs = ['milestones'], params = {'country_dim': country_dim, 'windows': windows})
+def columns(panel, country_dim, windows):
+    panel = panel.copy()
 
+    # Population of every country
+    values, unmatched = country_dim.take(panel.entities, ['population_2018'])
+    if unmatched:
+        print('No population for: ' + ', '.join(unmatched))
 
-# New cases by population
+    for name, v in derive_columns(panel['confirmed'], panel['deaths'], values['population_2018'], 
+                                  windows = windows, population_name = 'population_2018'):
+        panel[name] = v
+    return panel
 
-# Sort values
-df_merged.sort_values(by = ['Country/Region', 'dt'], ascending = True, inplace = True)
 
-# Differences
-df_merged['confirmed_newcases_by100000pop'] = df_merged.groupby(by = ['Country/Region']).confirmed_by100000pop.diff()
+# In[9]:
 
-# Moving average
-# New cases moving average
-df_merged['confirmed_newcases_by100000pop_movavg'] = np.nan
 
-for c in country_list:
-    
-    tmp = df_merged[df_merged['Country/Region'] == c].copy()
-    tmp = tmp.sort_values(by = 'dt').reset_index()
-    
-    for i in range(1, days_num-1):
-        
-        df_merged.loc[tmp.loc[i,'index'], 'confirmed_newcases_by100000pop_movavg'] = ((
-            tmp.loc[i-1, 'confirmed_newcases_by100000pop'] +
-            tmp.loc[i, 'confirmed_newcases_by100000pop'] +
-            tmp.loc[i+1, 'confirmed_newcases_by100000pop'] )/3) 
+# Backend of the derivation (the long table, one row per country and date)
+# COVID19_BACKEND=pandas (default): the stages above
+# COVID19_BACKEND=polars: the same steps as one lazy Polars query (see 
+# covid19/lazy.py). Polars is an optional dependency: 1.21 or later, listed
+# in covid19.yml (pip install 'polars>=1.21'). COVID19_VALIDATE=1 also runs 
+# the pandas stages and stops when the two tables differ
+backend = os.environ.get('COVID19_BACKEND', 'pandas')
+validate = os.environ.get('COVID19_VALIDATE', '0') == '1'
+if backend not in ('pandas', 'polars'):
+    raise ValueError('COVID19_BACKEND must be pandas or polars, not {!r}'.format(backend))
+
+if backend == 'pandas':
+    @pipeline.stage('derived', inputs = ['columns'])
+    def derived(panel):
+        # Back to the long table
+        return panel.to_long()
+else:
+    import polars as pl
+    from covid19 import lazy
+
+    @pipeline.stage('derived', inputs = ['ingest', 'plan'], 
+                    params = {'metrics': metrics, 'centroids': df_centroids, 'spec': milestone_spec, 
+                              'overrides': milestone_overrides, 'country_dim': country_dim, 'windows': windows})
+    def derived(tables, plan, metrics, centroids, spec, overrides, country_dim, windows):
+        # Reshape and rollup of the provinces
+        lf = lazy.long_frame({m: plan.narrow(tables[m]) for m in metrics}, metrics)
+        lf = lazy.rollup(lf, centroids, metrics).drop('Province/State')
+        if 'recovered' in metrics:
+            lf = lf.with_columns((pl.col('confirmed') - pl.col('deaths') - pl.col('recovered')).alias('active'))
+        lf = lazy.ordered(lf)
+
+        # Days since
+        lf = lf.with_columns(lazy.milestones(spec, overrides = overrides))
+
+        # Daily new cases, growth and its moving average
+        lf = lf.with_columns([lazy.diff('confirmed').alias('confirmed_newcases'), 
+                              lazy.diff('deaths').alias('deaths_newcases')])
+        lf = lf.with_columns(lazy.growth('confirmed_newcases', on_zero = 'nan').alias('confirmed_newcases_growth'))
+        lf = lf.with_columns([lazy.window_mean('confirmed_newcases_growth', window = windows['growth'], center = True)
+                                  .alias('confirmed_newcases_growth_movavg'), 
+                              lazy.growth('deaths_newcases', on_zero = 'nan').alias('deaths_newcases_growth')])
+
+        # Population, cases by 100.000 hab. and mortality rate
+        lf = lazy.attributes(lf, country_dim, ['population_2018'])
+        lf = lf.with_columns([(pl.col('confirmed')*100000/pl.col('population_2018')).alias('confirmed_by100000pop'), 
+                              (pl.col('deaths')*100000/pl.col('population_2018')).alias('deaths_by100000pop'), 
+                              (pl.col('deaths')/pl.col('confirmed')).alias('MortalityRate')])
+        lf = lf.with_columns(lazy.diff('confirmed_by100000pop').alias('confirmed_newcases_by100000pop'))
+
+        # New cases centered moving average
+        lf = lf.with_columns([lazy.window_mean(c, window = windows['newcases'], center = True, edge = 'nan')
+                                  .alias(c+'_movavg') for c in AVERAGED])
+
+        df_merged = lazy.collect(lf)
+        unmatched = sorted(df_merged.loc[df_merged['population_2018'].isna(), 'Country/Region'].unique())
+        if unmatched:
+            print('No population for: ' + ', '.join(unmatched))
+        return df_merged
+
+    if validate:
+        @pipeline.stage('validate', inputs = ['derived', 'columns'], cache = False)
+        def validate_backend(df_merged, panel):
+            problems = lazy.compare(df_merged, panel.to_long())
+            if problems:
+                raise ValueError('the polars and pandas tables differ:\n' + '\n'.join(problems))
+            print('Polars and pandas tables match ({:,} rows)'.format(len(df_merged)))
+            return len(df_merged)
+
+
+# Final table, saved for the next run and for the charts 
+# (../data_cache/df_merged.parquet). Always runs, saving is its job
+table_path = '../data_cache/df_merged.parquet'
+
+@pipeline.stage('table', inputs = ['derived', 'plan', 'ingest'], cache = False)
+def table(df_merged, plan, tables):
+    # Incremental update: splice the new days into the previous table
+    df_merged = plan.combine(df_merged, milestone_spec).reset_index(drop = True)
+
+    # Compact dtypes: categorical countries, integer counts, float32 rates
+    df_merged, (before, after) = compact(df_merged)
+    print('df_merged: {:,} rows, {:.1f} MB -> {:.1f} MB'.format(len(df_merged), before/1e6, after/1e6))
+
+    save_update(state_dir, tables, df_merged, config = plan.config)
+    return df_merged
 
 
-# In[15]:
+# In[10]:
 
 
 # Plotting colors
@@ -438,219 +308,189 @@ margin_l = 50
 tick_lenght = 12
 tick_col = '#eee'
 
+# plotly.js bundle loaded by every page (published once per plotly version)
+plotlyjs = publish_plotlyjs('../visuals/js/')
+
+# Plotly options of every chart
+plot_config = dict(showLink = False,
+                   modeBarButtonsToRemove = ['sendDataToCloud'],
+                   displaylogo = False,
+                   responsive = True)
+
 
 # ## <span style="color:orange">New cases</span>
 # <hr style="border: 1px solid #D3D3D3" >
 
-# In[16]:
+# In[11]:
 
 
 # Select data for plotting
 
-# Data for the top 10 countries in number of confirmed cases
-last_date = df_merged['dt'].max()
-top10 = df_merged[df_merged['dt'] == last_date].sort_values(by = 'deaths', ascending = False).iloc[0:10, :] 
-top10_country = top10['Country/Region'].values
-
-
-# In[17]:
+# Rows of each date, with their maximum, ... for the summary charts
+# Not cached: rebuilding it is cheaper than loading it
+@pipeline.stage('snapshots', inputs = ['table'], cache = False)
+def index_dates(df_merged):
+    return Snapshots(df_merged, order = 'dt')
 
+@pipeline.stage('top10', inputs = ['snapshots'])
+def select_top10(snapshots):
+    # Data for the top 10 countries in number of confirmed cases
+    return snapshots.latest().table.sort_values(by = 'deaths', ascending = False).iloc[0:10, :] 
 
-# Plot new cases top 10 countries
-data = []
-
-for i, c in enumerate(top10_country):
-    nc = df_merged[df_merged['Country/Region'] == c].confirmed_newcases_movavg
-    data.append(go.Scatter(x = df_merged[df_merged['Country/Region'] == c].dt,
-                           y = nc,
-                           name = c+'  ',
-                           marker = dict(color = top10_col[i]),
-                           line = dict(width = line_width),
-                           hoverinfo = 'text',
-                           hovertext = [c+':<br>{:.0f}'.format(i) for i in nc],
-                           hoverlabel = dict(bordercolor = top10_col[i], 
-                                             bgcolor = 'white',
-                                             font = dict(color = top10_col[i])),
-                           showlegend = True
-                          )
-               )
-    
-    
-lay = go.Layout(width = width_px, 
-                height = height_px, 
-                xaxis = dict(ticks = 'inside',
-                             ticklen = tick_lenght,
-                             tickcolor = tick_col,
-                             rangemode = 'nonnegative',
-                             zeroline = False,
-                             showgrid = False,
-                            ),
-                yaxis = dict(title='Confirmed new cases',
-                             type = 'linear',
-                            ),
-                hovermode = 'closest',
-                font = dict(size = label_size,
-                            family = label_font,
-                            color = label_col,
-                           ),
-                legend = dict(x = 0.0, 
-                              y = -0.20,
-                              orientation = 'h',
-                             ),
-                margin=dict(l = margin_l, r = margin_r, b = margin_b, t = margin_t, pad=0),
-                annotations=[dict(x = 0.0,
-                                  y = -0.20,
-                                  showarrow = False,
-                                  text = 'Click any country below to hide/show from the graph:',
-                                  xref = 'paper',
-                                  yref = 'paper',
-                                  font=dict(
-                                      family = label_font,
-                                      size = label_size,
-                                      color = 'silver',),
-                                 ),
-                            ],
-               )
-
-fig = dict(data=data, layout=lay)
-#plotly.offline.iplot(fig)
-
-# Save JS
-plot = plotly.offline.plot({'data':data,
-                            'layout':lay},
-                           include_plotlyjs = False,
-                           output_type = 'div',
-                           config = dict(showLink = False,
-                                         modeBarButtonsToRemove = ['sendDataToCloud'],
-                                         displaylogo = False,
-                                         responsive = True)
-                          )
-path = '../visuals/new_cases/'
-out_file = open(path+'timeline_newcases_date_all_720.html', 'w')
-out_file.write('<!DOCTYPE html><html><head><script src="https://cdn.plot.ly/plotly-latest.min.js"></script></head><body>')
-out_file.write(plot)
-out_file.write('</body><html>')
-out_file.close()
+# Rows of each country, sorted once for all the charts
+# Not cached: rebuilding it is cheaper than loading it
+@pipeline.stage('countries', inputs = ['table'], cache = False)
+def index_countries(df_merged):
+    return GroupIndex(df_merged, by = 'Country/Region')
 
 
-# In[18]:
+# In[12]:
 
 
-# Plot new cases top 10 countries 360px
-data = []
+# Plot new cases top 10 countries, 720px and 360px wide
+@pipeline.stage('timeline', inputs = ['countries', 'top10'])
+def plot_timeline(countries, top10):
+    top10_country = top10['Country/Region'].values
+    data = []
 
-for i, c in enumerate(top10_country):
-    nc = df_merged[df_merged['Country/Region'] == c].confirmed_newcases_movavg
-    data.append(go.Scatter(x = df_merged[df_merged['Country/Region'] == c].dt,
-                           y = nc,
-                           name = c+'  ',
-                           marker = dict(color = top10_col[i]),
-                           line = dict(width = 1.5),
-                           hoverinfo = 'text',
-                           hovertext = [c+':<br>{:.0f}'.format(i) for i in nc],
-                           hoverlabel = dict(bordercolor = top10_col[i], 
-                                             bgcolor = 'white',
-                                             font = dict(color = top10_col[i])),
-                           showlegend = True
-                          )
-               )
-    
-    
-lay = go.Layout(width = 360, 
-                height = 275, 
-                #bargap = 0.2,
-                xaxis = dict(#nticks = 10,
-                             ticks = 'inside',
-                             ticklen = 6,
-                             tickcolor = '#eee',
-                             rangemode = 'nonnegative',
-                             zeroline = False,
-                             showgrid = False,
-                            ),
-                yaxis = dict(title='Confirmed new cases',
-                             type = 'linear',
-                            ),
-                hovermode = 'closest',
-                font = dict(size = label_size_small,
-                            family = label_font,
-                            color = label_col,
-                           ),
-                legend = dict(x = -0.05, 
-                              y = -0.22,
-                              orientation = 'h',
-                             ),
-                margin=dict(l=30, r=10, b=0, t=10, pad=0),
-                annotations=[dict(x = -0.03,
-                                  y = -0.25,
-                                  showarrow = False,
-                                  text = 'Click any country below to hide/show from the graph:',
-                                  xref = 'paper',
-                                  yref = 'paper',
-                                  font=dict(
-                                      family = label_font,
-                                      size = label_size_small,
-                                      color = 'silver',),
-                                 ),
-                            ],
-               )
+    for i, c in enumerate(top10_country):
+        df_c = countries[c]
+        nc = df_c.confirmed_newcases_movavg
+        data.append(go.Scatter(x = df_c.dt,
+                               y = nc,
+                               name = c+'  ',
+                               marker = dict(color = top10_col[i]),
+                               line = dict(width = line_width),
+                               hovertemplate = c+':<br>%{y:.0f}<extra></extra>',
+                               hoverlabel = dict(bordercolor = top10_col[i], 
+                                                 bgcolor = 'white',
+                                                 font = dict(color = top10_col[i])),
+                               showlegend = True
+                              )
+                   )
+
+
+    lay_720 = go.Layout(width = width_px, 
+                        height = height_px, 
+                        xaxis = dict(ticks = 'inside',
+                                     ticklen = tick_lenght,
+                                     tickcolor = tick_col,
+                                     rangemode = 'nonnegative',
+                                     zeroline = False,
+                                     showgrid = False,
+                                    ),
+                        yaxis = dict(title='Confirmed new cases',
+                                     type = 'linear',
+                                    ),
+                        hovermode = 'closest',
+                        font = dict(size = label_size,
+                                    family = label_font,
+                                    color = label_col,
+                                   ),
+                        legend = dict(x = 0.0, 
+                                      y = -0.20,
+                                      orientation = 'h',
+                                     ),
+                        margin=dict(l = margin_l, r = margin_r, b = margin_b, t = margin_t, pad=0),
+                        annotations=[dict(x = 0.0,
+                                          y = -0.20,
+                                          showarrow = False,
+                                          text = 'Click any country below to hide/show from the graph:',
+                                          xref = 'paper',
+                                          yref = 'paper',
+                                          font=dict(
+                                              family = label_font,
+                                              size = label_size,
+                                              color = 'silver',),
+                                         ),
+                                    ],
+                       )
 
-fig = dict(data=data, layout=lay)
-#plotly.offline.iplot(fig)
+    lay_360 = go.Layout(width = 360, 
+                        height = 275, 
+                        #bargap = 0.2,
+                        xaxis = dict(#nticks = 10,
+                                     ticks = 'inside',
+                                     ticklen = 6,
+                                     tickcolor = '#eee',
+                                     rangemode = 'nonnegative',
+                                     zeroline = False,
+                                     showgrid = False,
+                                    ),
+                        yaxis = dict(title='Confirmed new cases',
+                                     type = 'linear',
+                                    ),
+                        hovermode = 'closest',
+                        font = dict(size = label_size_small,
+                                    family = label_font,
+                                    color = label_col,
+                                   ),
+                        legend = dict(x = -0.05, 
+                                      y = -0.22,
+                                      orientation = 'h',
+                                     ),
+                        margin=dict(l=30, r=10, b=0, t=10, pad=0),
+                        annotations=[dict(x = -0.03,
+                                          y = -0.25,
+                                          showarrow = False,
+                                          text = 'Click any country below to hide/show from the graph:',
+                                          xref = 'paper',
+                                          yref = 'paper',
+                                          font=dict(
+                                              family = label_font,
+                                              size = label_size_small,
+                                              color = 'silver',),
+                                         ),
+                                    ],
+                       )
 
-# Save JS
-plot = plotly.offline.plot({'data':data,
-                            'layout':lay},
-                           include_plotlyjs = False,
-                           output_type = 'div',
-                           config = dict(showLink = False,
-                                         modeBarButtonsToRemove = ['sendDataToCloud'],
-                                         displaylogo = False,
-                                         responsive = True)
-                          )
-path = '../visuals/new_cases/'
-out_file = open(path+'timeline_newcases_date_all_360.html', 'w')
-out_file.write('<!DOCTYPE html><html><head><script src="https://cdn.plot.ly/plotly-latest.min.js"></script></head><body>')
-out_file.write(plot)
-out_file.write('</body><html>')
-out_file.close()
+    fig = dict(data=data, layout=lay_720)
+    #plotly.offline.iplot(fig)
 
+    # Save JS
+    divs = render_variants(data, {'720': dict(layout = lay_720),
+                                  '360': dict(layout = lay_360, style = {'line': {'width': 1.5}})},
+                           config = plot_config)
+    path = '../visuals/new_cases/'
+    files = [path+'timeline_newcases_date_all_'+size+'.html' for size in divs]
+    return {f: page(f, divs[size], plotlyjs) for f, size in zip(files, divs)}
 
-# In[19]:
 
+# In[14]:
 
-# Plot
 
-for i, c in enumerate(top10_country):
+# Plot, one stage per country so that they can be rendered in parallel
+def plot_country_timeline(countries, top10, i):
+    c = top10['Country/Region'].values[i]
+    df_c = countries[c]
     data = []
-    nc = df_merged[df_merged['Country/Region'] == c].confirmed_newcases_movavg
-    ncp = df_merged[df_merged['Country/Region'] == c].confirmed_newcases_by100000pop_movavg
-    
-    data.append(go.Scatter(x = df_merged[df_merged['Country/Region'] == c].dt,
+    nc = df_c.confirmed_newcases_movavg
+    ncp = df_c.confirmed_newcases_by100000pop_movavg
+
+    data.append(go.Scatter(x = df_c.dt,
                            y = nc,
                            name = '5-day moving average',
                            marker = dict(color = '#FF9E1B'),
                            hoverinfo = 'skip',
-                           hovertext = ['{:.0f}'.format(i) for i in nc],
                            hoverlabel = dict(bordercolor = 'gray',
                                              bgcolor = 'white',
                                              font = dict(color = 'gray'),
                                              )
                            )
                 ),
-    data.append(go.Bar(x = df_merged[df_merged['Country/Region'] == c].dt,
-                       y = df_merged[df_merged['Country/Region'] == c].confirmed_newcases,
+    data.append(go.Bar(x = df_c.dt,
+                       y = df_c.confirmed_newcases,
                        name = 'Actual data',
                        opacity = 0.3,
                        marker = dict(color = '#FF9E1B'),
-                       hoverinfo = 'y',
-                       hovertext = c,
+                       hovertemplate = '%{y}<extra></extra>',
                        hoverlabel = dict(bordercolor = 'gray',
                                          bgcolor = 'white',
                                          font = dict(color = 'gray'),
                                          ),
                        )
                 )
-    
+
     lay = go.Layout(width = 600,
                     height = 500,
                     xaxis = dict(#nticks = 10,
@@ -677,61 +517,54 @@ for i, c in enumerate(top10_country):
                                  ),
                     margin=dict(l=50, r=20, b=100, t=30, pad=0),
                )
-          
-                
+
+
     fig = dict(data=data, layout=lay)
-    plot = plotly.offline.plot({'data':data,
-                               'layout':lay},
-                               include_plotlyjs = False,
-                               output_type = 'div',
-                               config = dict(showLink = False,
-                                             modeBarButtonsToRemove = ['sendDataToCloud'],
-                                             displaylogo = False,
-                                             responsive = True)
-                               )
+    #plotly.offline.iplot(fig)
+
     # Save JS
+    plot = render_variants(data, {'600': dict(layout = lay)}, config = plot_config)['600']
     path = '../visuals/new_cases/'
-    out_file = open(path+'timeline_newcases_date_'+str(i)+'.html', 'w')
-    out_file.write('<!DOCTYPE html><html><head><script src="https://cdn.plot.ly/plotly-latest.min.js"></script></head><body>')
-    out_file.write(plot)
-    out_file.write('</body><html>')
-    out_file.close()
-    
-#plotly.offline.iplot(fig)
+    f = path+'timeline_newcases_date_'+str(i)+'.html'
+    return {f: page(f, plot, plotlyjs)}
 
+country_timelines = ['country_timeline_'+str(i) for i in range(10)]
+for i, name in enumerate(country_timelines):
+    pipeline.add(name, plot_country_timeline, inputs = ['countries', 'top10'], params = {'i': i})
 
-# In[20]:
+
+# In[15]:
 
 
 # Data to JSON
-most_recent_day = df_merged.sort_values('dt').dt.unique()[-3]
-tmp = df_merged[ (df_merged['dt'] == most_recent_day) & (df_merged['Country/Region'].isin(top10_country))].copy()
-
-def up_or_down(x):
-    if (x>=1):
-        return 'up'
-    else:
-        return 'down'
-
-tmp['trend'] = tmp.apply(lambda x: up_or_down(x['confirmed_newcases_growth_movavg']), axis=1)
-trend = tmp[['Country/Region', 'trend']].copy()
-
-most_recent_day = df_merged.sort_values('dt').dt.unique()[-1]
-tmp = df_merged[ (df_merged['dt'] == most_recent_day) & (df_merged['Country/Region'].isin(top10_country))].copy()
-tmp.sort_values(by = 'deaths', ascending = False, inplace = True)
-tmp = tmp[['Country/Region', 'days_since_1st_conf', 'first_confirmed', 
-           'confirmed', 'deaths']]
-tmp = tmp.merge(trend, on = 'Country/Region')
-tmp['graph_number'] = np.arange(10)
-tmp['last_update'] = pd.Timestamp.now(tz='US/Eastern')
-tmp.set_index('Country/Region', inplace = True)
-tmp.rename(columns={'Country/Region': 'country',
-                    'first_confirmed': 'date_first_confirmed',
-                   }, inplace = True)
-path = '../visuals/new_cases/'
-tmp.to_json(path+'country_info.json', orient = 'columns')
-
-#tmp
+# Not cached: last_update is the time of the run
+@pipeline.stage('country_info', inputs = ['snapshots', 'top10'], params = {'windows': windows}, cache = False)
+def country_info(snapshots, top10, windows):
+    top10_country = top10['Country/Region'].values
+    # The last complete (centered) average of the growth
+    df_day = snapshots.latest(window_offsets(windows['growth'])[-1]).table
+    tmp = df_day[df_day['Country/Region'].isin(top10_country)].copy()
+
+    # 'up' when new cases grow (NaN counts as 'down')
+    tmp['trend'] = np.where(tmp['confirmed_newcases_growth_movavg'] >= 1, 'up', 'down')
+    trend = tmp[['Country/Region', 'trend']].copy()
+
+    df_day = snapshots.latest().table
+    tmp = df_day[df_day['Country/Region'].isin(top10_country)].copy()
+    tmp.sort_values(by = 'deaths', ascending = False, inplace = True)
+    tmp = tmp[['Country/Region', 'days_since_1st_conf', 'first_confirmed', 
+               'confirmed', 'deaths']]
+    tmp = tmp.merge(trend, on = 'Country/Region')
+    tmp['graph_number'] = np.arange(10)
+    tmp['last_update'] = pd.Timestamp.now(tz='US/Eastern')
+    tmp.set_index('Country/Region', inplace = True)
+    tmp.rename(columns={'Country/Region': 'country',
+                        'first_confirmed': 'date_first_confirmed',
+                       }, inplace = True)
+    path = '../visuals/new_cases/'
+    return {path+'country_info.json': tmp.to_json(orient = 'columns')}
+
+    #tmp
 
 
 # ## <span style="color:orange">Mortality rates</span>
@@ -739,1174 +572,753 @@ tmp.to_json(path+'country_info.json', orient = 'columns')
 # 
 # 
 
-# In[21]:
+# In[16]:
 
 
 # Plot mortality ratio
+@pipeline.stage('mortality_top10', inputs = ['top10'])
+def plot_mortality_top10(top10):
+    # Assign color to top10
+    top10 = top10.assign(color = top10_col)
+    bar_width = 0.6
+    bar_opacity = 0.6
+
+    # Plot
+
+    text_a = ['{:.1f}'.format(x)+'%' for x in top10.sort_values(by = 'MortalityRate')['MortalityRate']*100]
+    text_b = ['{:.2f}'.format(x) for x in top10.sort_values(by = 'deaths_by100000pop')['deaths_by100000pop']]
+    #text_a[-1] = f'Mortality: {text_a[-1]}'
+    #text_b[-1] = f'Mortality: {text_b[-1]}'
+    text_a[-1] = 'Mortality: '+text_a[-1]
+    text_b[-1] = 'Mortality: '+text_b[-1]
+
+    data = [go.Bar(x = top10.sort_values(by = 'MortalityRate')['MortalityRate']*100,
+                   y = top10.sort_values(by = 'MortalityRate')['Country/Region'],
+                   orientation = 'h',
+                   name = 'mort_conf',
+                   opacity = bar_opacity,
+                   marker = dict(color = '#FF9E1B'),
+                   hoverinfo = 'skip',
+                   hoverlabel = dict(bordercolor = top10.sort_values(by = 'MortalityRate')['color'], 
+                                     bgcolor = 'white', 
+                                     font = dict(color = top10.sort_values(by = 'MortalityRate')['color'])),
+                   text = text_a,
+                   textfont=dict(
+                        color='black'
+                   ),
+                   textposition = 'auto',
+                   width = bar_width
+                  ),
+            go.Bar(x = top10.sort_values(by = 'deaths_by100000pop')['deaths_by100000pop'],
+                   y = top10.sort_values(by = 'deaths_by100000pop')['Country/Region'],
+                   orientation = 'h',
+                   name = 'mort_pop',
+                   opacity = bar_opacity,
+                   marker = dict(color = '#FF9E1B'),
+                   hoverinfo = 'skip',
+                   hoverlabel = dict(bordercolor = top10.sort_values(by = 'deaths_by100000pop')['color'], 
+                                     bgcolor = 'white', 
+                                     font = dict(color = top10.sort_values(by = 'deaths_by100000pop')['color'])),
+                   text = text_b,
+                   textfont=dict(
+                        color='black'
+                   ),
+                   textposition = 'auto',
+                   width = bar_width,
+                   visible = False,
+                  )
+           ]
+
+    # Sizes of the 720px and 320px wide versions
+    sizes = {'720': dict(width = width_px, height = height_px, margin_t = 80, note_size = label_size,
+                         direction = 'left', pad_t = 10, menu_y = 1.2),
+             '320': dict(width = wide_px_small, height = height_px_small+80, margin_t = 100, note_size = label_size_small,
+                         direction = 'down', pad_t = 0, menu_y = 1.35),
+            }
+    variants = {}
+    for size, s in sizes.items():
+        lay = go.Layout(width = s['width'], 
+                        height = s['height'],
+                        margin=dict(l=100, r=50, b=50, t=s['margin_t'], pad=4),
+                        plot_bgcolor='white',
+                        #bargap = 0.2,
+                        xaxis = dict(title='Mortality: Observed case-fatality ratio',
+                                     nticks = 10,
+                                     rangemode = 'nonnegative',
+                                     zeroline = False,
+                                     showgrid = True,
+                                     gridcolor = 'lightgray',
+                                     ticksuffix="%",
+                                    ),
+                        yaxis = dict(title='',
+                                     showgrid = False,
+                                    ),
+                        hovermode = 'closest',
+                        font = dict(size = label_size,
+                                    family = label_font,
+                                    color = label_col,
+                                   ),
+                        legend = dict(x = 1.03, 
+                                      y = 0.7),
+                        annotations=[dict(x = 0.02,
+                                          y = 1.2,
+                                          showarrow = False,
+                                          text = '', #Mortality ratios for the most affected countries
+                                          xref = 'paper',
+                                          yref = 'paper',
+                                          font=dict(
+                                              family = title_font,
+                                              size = title_size,
+                                              color = title_col,),
+                                         ),
+                                     dict(x = 0.02,
+                                          y = 1.1,
+                                          showarrow = False,
+                                          text = '',
+                                          xref = 'paper',
+                                          yref = 'paper',
+                                          font=dict(
+                                              family = subtitle_font,
+                                              size = subtitle_size,
+                                              color = subtitle_col,),
+                                         ),
+                                     dict(x = 1.40,
+                                          y = 0.95,
+                                          showarrow = False,
+                                          text = '',
+                                          xref = 'paper',
+                                          yref = 'paper',
+                                          font=dict(
+                                              family = label_font,
+                                              size = s['note_size'],
+                                              color = label_col,),
+
+                                     )
+                                    ],
+                        updatemenus=[dict(
+                                            type = "buttons",
+                                            direction = s['direction'],
+                                            buttons=list([
+                                                dict(args = [{'visible': [True, False]},
+                                                             {'xaxis' : dict(title='Mortality: Observed case-fatality ratio',
+                                                                 nticks = 10,
+                                                                 rangemode = 'nonnegative',
+                                                                 zeroline = False,
+                                                                 showgrid = True,
+                                                                 gridcolor = 'lightgray',
+                                                                 ticksuffix="%",
+                                                                )}],
+                                                             label = 'Observed case-fatality ratio',
+                                                             #method = 'restyle'
+                                                             method = 'update'
+                                                            ),
+                                                dict(args = [{'visible': [False, True]},
+                                                             {'xaxis' : dict(title='Mortality: Deaths per 100,000 population',
+                                                                 nticks = 10,
+                                                                 rangemode = 'nonnegative',
+                                                                 zeroline = False,
+                                                                 showgrid = True,
+                                                                 gridcolor = 'lightgray',
+                                                                 ticksuffix="",
+                                                                )}],
+                                                             label = 'Deaths per 100,000 population',
+                                                             #method = 'restyle'
+                                                             method = 'update'
+                                                            )
+                                                       ]),
+                                          pad = {"r": 10, "t": s['pad_t']},
+                                          showactive = True,
+                                          x=0,
+                                          xanchor="left",
+                                          y=s['menu_y'],
+                                          yanchor="top",
+                                          bordercolor = 'lightgray'
+                                         ),
+                                    ]
+                       )
+        variants[size] = dict(layout = lay)
 
-# Assign color to top10
-top10['color'] = top10_col
-bar_width = 0.6
-bar_opacity = 0.6
-
-# Plot
-
-text_a = ['{:.1f}'.format(x)+'%' for x in top10.sort_values(by = 'MortalityRate')['MortalityRate']*100]
-text_b = ['{:.2f}'.format(x) for x in top10.sort_values(by = 'deaths_by100000pop')['deaths_by100000pop']]
-#text_a[-1] = f'Mortality: {text_a[-1]}'
-#text_b[-1] = f'Mortality: {text_b[-1]}'
-text_a[-1] = 'Mortality: '+text_a[-1]
-text_b[-1] = 'Mortality: '+text_b[-1]
-
-data = [go.Bar(x = top10.sort_values(by = 'MortalityRate')['MortalityRate']*100,
-               y = top10.sort_values(by = 'MortalityRate')['Country/Region'],
-               orientation = 'h',
-               name = 'mort_conf',
-               opacity = bar_opacity,
-               marker = dict(color = '#FF9E1B'),
-               hoverinfo = 'skip',
-               hovertext = ['Mortality:<br>'+'{:.1f}'+'%'.format(x) for x in top10.sort_values(by = 'MortalityRate')['MortalityRate']*100],
-               hoverlabel = dict(bordercolor = top10.sort_values(by = 'MortalityRate')['color'], 
-                                 bgcolor = 'white', 
-                                 font = dict(color = top10.sort_values(by = 'MortalityRate')['color'])),
-               text = text_a,
-               textfont=dict(
-                    color='black'
-               ),
-               textposition = 'auto',
-               width = bar_width
-              ),
-        go.Bar(x = top10.sort_values(by = 'deaths_by100000pop')['deaths_by100000pop'],
-               y = top10.sort_values(by = 'deaths_by100000pop')['Country/Region'],
-               orientation = 'h',
-               name = 'mort_pop',
-               opacity = bar_opacity,
-               marker = dict(color = '#FF9E1B'),
-               hoverinfo = 'skip',
-               hovertext = ['Mortality:<br>'+'{:.2f}'.format(x) for x in top10.sort_values(by = 'deaths_by100000pop')['deaths_by100000pop']],
-               hoverlabel = dict(bordercolor = top10.sort_values(by = 'deaths_by100000pop')['color'], 
-                                 bgcolor = 'white', 
-                                 font = dict(color = top10.sort_values(by = 'deaths_by100000pop')['color'])),
-               text = text_b,
-               textfont=dict(
-                    color='black'
-               ),
-               textposition = 'auto',
-               width = bar_width,
-               visible = False,
-              )
-       ]
-
-lay = go.Layout(width = width_px, 
-                height = height_px,
-                margin=dict(l=100, r=50, b=50, t=80, pad=4),
-                plot_bgcolor='white',
-                #bargap = 0.2,
-                xaxis = dict(title='Mortality: Observed case-fatality ratio',
-                             nticks = 10,
-                             rangemode = 'nonnegative',
-                             zeroline = False,
-                             showgrid = True,
-                             gridcolor = 'lightgray',
-                             ticksuffix="%",
-                            ),
-                yaxis = dict(title='',
-                             showgrid = False,
-                            ),
-                hovermode = 'closest',
-                font = dict(size = label_size,
-                            family = label_font,
-                            color = label_col,
-                           ),
-                legend = dict(x = 1.03, 
-                              y = 0.7),
-                annotations=[dict(x = 0.02,
-                                  y = 1.2,
-                                  showarrow = False,
-                                  text = '', #Mortality ratios for the most affected countries
-                                  xref = 'paper',
-                                  yref = 'paper',
-                                  font=dict(
-                                      family = title_font,
-                                      size = title_size,
-                                      color = title_col,),
-                                 ),
-                             dict(x = 0.02,
-                                  y = 1.1,
-                                  showarrow = False,
-                                  text = '',
-                                  xref = 'paper',
-                                  yref = 'paper',
-                                  font=dict(
-                                      family = subtitle_font,
-                                      size = subtitle_size,
-                                      color = subtitle_col,),
-                                 ),
-                             dict(x = 1.40,
-                                  y = 0.95,
-                                  showarrow = False,
-                                  text = '',
-                                  xref = 'paper',
-                                  yref = 'paper',
-                                  font=dict(
-                                      family = label_font,
-                                      size = label_size,
-                                      color = label_col,),
-                             
-                             )
-                            ],
-                updatemenus=[dict(
-                                    type = "buttons",
-                                    direction = "left",
-                                    buttons=list([
-                                        dict(args = [{'visible': [True, False]},
-                                                     {'xaxis' : dict(title='Mortality: Observed case-fatality ratio',
-                                                         nticks = 10,
-                                                         rangemode = 'nonnegative',
-                                                         zeroline = False,
-                                                         showgrid = True,
-                                                         gridcolor = 'lightgray',
-                                                         ticksuffix="%",
-                                                        )}],
-                                                     label = 'Observed case-fatality ratio',
-                                                     #method = 'restyle'
-                                                     method = 'update'
-                                                    ),
-                                        dict(args = [{'visible': [False, True]},
-                                                     {'xaxis' : dict(title='Mortality: Deaths per 100,000 population',
-                                                         nticks = 10,
-                                                         rangemode = 'nonnegative',
-                                                         zeroline = False,
-                                                         showgrid = True,
-                                                         gridcolor = 'lightgray',
-                                                         ticksuffix="",
-                                                        )}],
-                                                     label = 'Deaths per 100,000 population',
-                                                     #method = 'restyle'
-                                                     method = 'update'
-                                                    )
-                                               ]),
-                                  pad = {"r": 10, "t": 10},
-                                  showactive = True,
-                                  x=0,
-                                  xanchor="left",
-                                  y=1.2,
-                                  yanchor="top",
-                                  bordercolor = 'lightgray'
-                                 ),
-                            ]
-               )
 
+    fig = dict(data=data, layout=variants['720']['layout'])
+    #plotly.offline.iplot(fig)
 
-fig = dict(data=data, layout=lay)
-#plotly.offline.iplot(fig)
-
-# Save JS
-plot = plotly.offline.plot({'data':data,
-                            'layout':lay},
-                           include_plotlyjs = False,
-                           output_type = 'div',
-                           config = dict(showLink = False,
-                                         modeBarButtonsToRemove = ['sendDataToCloud'],
-                                         displaylogo = False,
-                                         responsive = True)
-                          )
-    
-path = '../visuals/mortality/'
-out_file = open(path+'mortality_top10_720.html', 'w')
-out_file.write('<!DOCTYPE html><html><head><script src="https://cdn.plot.ly/plotly-latest.min.js"></script></head><body>')
-out_file.write(plot)
-out_file.write('</body><html>')
-out_file.close()
+    # Save JS
+    divs = render_variants(data, variants, config = plot_config)
+    path = '../visuals/mortality/'
+    files = [path+'mortality_top10_'+size+'.html' for size in divs]
+    return {f: page(f, divs[size], plotlyjs) for f, size in zip(files, divs)}
 
 
-# In[22]:
+# In[18]:
 
 
-# Plot mortality ratio (mobile size)
-
-# Assign color to top10
-top10['color'] = top10_col
-bar_width = 0.6
-bar_opacity = 0.6
-
-# Plot
-
-text_a = ['{:.1f}'.format(x)+'%' for x in top10.sort_values(by = 'MortalityRate')['MortalityRate']*100]
-text_b = ['{:.2f}'.format(x) for x in top10.sort_values(by = 'deaths_by100000pop')['deaths_by100000pop']]
-#text_a[-1] = f'Mortality: {text_a[-1]}'
-#text_b[-1] = f'Mortality: {text_b[-1]}'
-text_a[-1] = 'Mortality: '+text_a[-1]
-text_b[-1] = 'Mortality: '+text_b[-1]
-
-data = [go.Bar(x = top10.sort_values(by = 'MortalityRate')['MortalityRate']*100,
-               y = top10.sort_values(by = 'MortalityRate')['Country/Region'],
-               orientation = 'h',
-               name = 'mort_conf',
-               opacity = bar_opacity,
-               marker = dict(color = '#FF9E1B'),
-               hoverinfo = 'skip',
-               hovertext = ['Mortality:<br>'+'{:.1f}'+'%'.format(x) for x in top10.sort_values(by = 'MortalityRate')['MortalityRate']*100],
-               hoverlabel = dict(bordercolor = top10.sort_values(by = 'MortalityRate')['color'], 
-                                 bgcolor = 'white', 
-                                 font = dict(color = top10.sort_values(by = 'MortalityRate')['color'])),
-               text = text_a,
-               textfont=dict(color='black',
-                            ),
-               textposition = 'auto',
-               width = bar_width
-              ),
-        go.Bar(x = top10.sort_values(by = 'deaths_by100000pop')['deaths_by100000pop'],
-               y = top10.sort_values(by = 'deaths_by100000pop')['Country/Region'],
-               orientation = 'h',
-               name = 'mort_pop',
-               opacity = bar_opacity,
-               marker = dict(color = '#FF9E1B'),
-               hoverinfo = 'skip',
-               hovertext = ['Mortality:<br>'+'{:.2f}'.format(x) for x in top10.sort_values(by = 'deaths_by100000pop')['deaths_by100000pop']],
-               hoverlabel = dict(bordercolor = top10.sort_values(by = 'deaths_by100000pop')['color'], 
-                                 bgcolor = 'white', 
-                                 font = dict(color = top10.sort_values(by = 'deaths_by100000pop')['color'])),
-               text = text_b,
-               textfont=dict(
-                    color='black'
-               ),
-               textposition = 'auto',
-               width = bar_width,
-               visible = False,
-              )
-       ]
-
-lay = go.Layout(width = wide_px_small, 
-                height = height_px_small+80,
-                margin=dict(l=100, r=50, b=50, t=100, pad=4),
-                plot_bgcolor='white',
-                #bargap = 0.2,
-                xaxis = dict(title='Mortality: Observed case-fatality ratio',
-                             nticks = 10,
-                             rangemode = 'nonnegative',
-                             zeroline = False,
-                             showgrid = True,
-                             gridcolor = 'lightgray',
-                             ticksuffix="%",
-                            ),
-                yaxis = dict(title='',
-                             showgrid = False,
-                            ),
-                hovermode = 'closest',
-                font = dict(size = label_size,
-                            family = label_font,
-                            color = label_col,
-                           ),
-                legend = dict(x = 1.03, 
-                              y = 0.7),
-                annotations=[dict(x = 0.02,
-                                  y = 1.2,
-                                  showarrow = False,
-                                  text = '', #Mortality ratios for the most affected countries
-                                  xref = 'paper',
-                                  yref = 'paper',
-                                  font=dict(
-                                      family = title_font,
-                                      size = title_size,
-                                      color = title_col,),
-                                 ),
-                             dict(x = 0.02,
-                                  y = 1.1,
-                                  showarrow = False,
-                                  text = '',
-                                  xref = 'paper',
-                                  yref = 'paper',
-                                  font=dict(
-                                      family = subtitle_font,
-                                      size = subtitle_size,
-                                      color = subtitle_col,),
-                                 ),
-                             dict(x = 1.40,
-                                  y = 0.95,
-                                  showarrow = False,
-                                  text = '',
-                                  xref = 'paper',
-                                  yref = 'paper',
-                                  font=dict(
-                                      family = label_font,
-                                      size = label_size_small,
-                                      color = label_col,),
-                             
-                             )
-                            ],
-                updatemenus=[dict(
-                                    type = "buttons",
-                                    direction = "down",
-                                    buttons=list([
-                                        dict(args = [{'visible': [True, False]},
-                                                     {'xaxis' : dict(title='Mortality: Observed case-fatality ratio',
-                                                         nticks = 10,
-                                                         rangemode = 'nonnegative',
-                                                         zeroline = False,
-                                                         showgrid = True,
-                                                         gridcolor = 'lightgray',
-                                                         ticksuffix="%",
-                                                        )}],
-                                                     label = 'Observed case-fatality ratio',
-                                                     #method = 'restyle'
-                                                     method = 'update'
-                                                    ),
-                                        dict(args = [{'visible': [False, True]},
-                                                     {'xaxis' : dict(title='Mortality: Deaths per 100,000 population',
-                                                         nticks = 10,
-                                                         rangemode = 'nonnegative',
-                                                         zeroline = False,
-                                                         showgrid = True,
-                                                         gridcolor = 'lightgray',
-                                                         ticksuffix="",
-                                                        )}],
-                                                     label = 'Deaths per 100,000 population',
-                                                     #method = 'restyle'
-                                                     method = 'update'
-                                                    )
-                                               ]),
-                                  pad = {"r": 10, "t": 0},
-                                  showactive = True,
-                                  x=0,
-                                  xanchor="left",
-                                  y=1.35,
-                                  yanchor="top",
-                                  bordercolor = 'lightgray'
-                                 ),
-                            ]
-               )
+# Plot mortality rates
+@pipeline.stage('mortality_all', inputs = ['snapshots', 'top10'])
+def plot_mortality_all(snapshots, top10):
+    top10_country = top10['Country/Region'].values
+    latest = snapshots.latest()
+
+    df_latest = latest.table[latest.table['deaths'] > 2]
+    pattern = '|'.join(top10_country)
+    top10_df_merged = df_latest[df_latest['Country/Region'].str.contains(pattern)]
+
+    # Plot
+    data = [go.Scatter(x = df_latest['confirmed'],
+                       y = df_latest['deaths'],
+                       marker = dict(color = 'orange', size = 6),
+                       mode = 'markers',
+                       text = df_latest['Country/Region'],
+                       customdata = df_latest['MortalityRate'].round(5),
+                       hovertemplate = '%{text}:<br>%{customdata:.1%}<extra></extra>',
+                       hoverlabel = dict(bordercolor = 'gray',
+                                         bgcolor = 'white',
+                                         font = dict(color = 'gray')),
+                       textposition = "top center"
+                  ),
+            go.Scatter(x = top10_df_merged['confirmed'],
+                       y = top10_df_merged['deaths'],
+                       marker = dict(color = 'orange', 
+                                     size = 6,
+                                     opacity = 1,
+                                    line=dict(
+                                        color = 'black',
+                                        width = 1,
+                                    )),
+                       mode = 'markers',
+                       text = top10_df_merged['Country/Region'],
+                       customdata = top10_df_merged['MortalityRate'].round(5),
+                       hovertemplate = '%{text}:<br>%{customdata:.1%}<extra></extra>',
+                       hoverlabel = dict(bordercolor = 'gray',
+                                         bgcolor = 'white',
+                                         font = dict(color = 'gray')),
+                  ),
+            go.Scatter(x = [0, 1.3*latest.max('confirmed')],
+                       y = [0, 0.1*1.3*latest.max('confirmed')],
+                       marker = dict(color = 'gray'),
+                       line = dict(width = 0.3),
+                       mode = 'lines',
+                       hoverinfo = 'skip',
+                  ),
+            go.Scatter(x = [0, 1.3*latest.max('confirmed')],
+                       y = [0, 0.05*1.3*latest.max('confirmed')],
+                       marker = dict(color = 'gray'),
+                       line = dict(width = 0.3),
+                       mode = 'lines',
+                       hoverinfo = 'skip',
+                  ),
+            go.Scatter(x = [0, 1.3*latest.max('confirmed')],
+                       y = [0, 0.02*1.3*latest.max('confirmed')],
+                       marker = dict(color = 'gray'),
+                       line = dict(width = 0.3),
+                       mode = 'lines',
+                       hoverinfo = 'skip',
+                  ),
+            go.Scatter(x = [0, 1.3*latest.max('confirmed')],
+                       y = [0, 0.01*1.3*latest.max('confirmed')],
+                       marker = dict(color = 'gray'),
+                       line = dict(width = 0.3),
+                       mode = 'lines',
+                       hoverinfo = 'skip',
+                  ),
+            go.Scatter(x = [0, 1.3*latest.max('confirmed')],
+                       y = [0, 0.005*1.3*latest.max('confirmed')],
+                       marker = dict(color = 'gray'),
+                       line = dict(width = 0.3),
+                       mode = 'lines',
+                       hoverinfo = 'skip',
+                  ),
+            go.Scatter(x = df_latest['population_2018'],
+                       y = df_latest['deaths'],
+                       marker = dict(color = 'orange', size = 6),
+                       mode = 'markers',
+                       text = df_latest['Country/Region'],
+                       customdata = df_latest['deaths_by100000pop'].round(4),
+                       hovertemplate = '%{text}:<br>%{customdata:.2f}<extra></extra>',
+                       hoverlabel = dict(bordercolor = 'gray',
+                                         bgcolor = 'white',
+                                         font = dict(color = 'gray')),
+                       visible = False,
+                      ),
+            go.Scatter(x = top10_df_merged['population_2018'],
+                       y = top10_df_merged['deaths'],
+                       marker = dict(color = 'orange', 
+                                     size = 6,
+                                     opacity = 1,
+                                    line=dict(
+                                        color = 'black',
+                                        width = 1,
+                                    )),
+                       mode = 'markers',
+                       text = top10_df_merged['Country/Region'],
+                       customdata = top10_df_merged['deaths_by100000pop'].round(4),
+                       hovertemplate = '%{text}:<br>%{customdata:.2f}<extra></extra>',
+                       hoverlabel = dict(bordercolor = 'gray',
+                                         bgcolor = 'white',
+                                         font = dict(color = 'gray')),
+                       visible = False,
+                      ),
+            go.Scatter(x = [0, latest.max('population_2018')],
+                       y = [0, 100*latest.max('population_2018')/100000],
+                       marker = dict(color = 'gray'),
+                       line = dict(width = 0.3),
+                       mode = 'lines',
+                       visible = False,
+                       hoverinfo = 'skip',
+                  ),
 
+            go.Scatter(x = [0, latest.max('population_2018')],
+                       y = [0, 10*latest.max('population_2018')/100000],
+                       marker = dict(color = 'gray'),
+                       line = dict(width = 0.3),
+                       mode = 'lines',
+                       visible = False,
+                       hoverinfo = 'skip',
+                  ),
+            go.Scatter(x = [0, latest.max('population_2018')],
+                       y = [0, 1*latest.max('population_2018')/100000],
+                       marker = dict(color = 'gray'),
+                       line = dict(width = 0.3),
+                       mode = 'lines',
+                       visible = False,
+                       hoverinfo = 'skip',
+                  ),
+            go.Scatter(x = [0, latest.max('population_2018')],
+                       y = [0, 0.1*latest.max('population_2018')/100000],
+                       marker = dict(color = 'gray'),
+                       line = dict(width = 0.3),
+                       mode = 'lines',
+                       visible = False,
+                       hoverinfo = 'skip',
+                  ),
+            go.Scatter(x = [0, latest.max('population_2018')],
+                       y = [0, 0.01*latest.max('population_2018')/100000],
+                       marker = dict(color = 'gray'),
+                       line = dict(width = 0.3),
+                       mode = 'lines',
+                       visible = False,
+                       hoverinfo = 'skip',
+                  ),
+           ]
+
+    annotations_titles = [dict(x = 0.02,
+                               y = 1.2,
+                               showarrow = False,
+                               text = '', #Mortality ratios worldwide
+                               xref = 'paper',
+                               yref = 'paper',
+                               font=dict(family = title_font,
+                                         size = title_size,
+                                         color = title_col,),
+                              ),
+                          dict(x = 0.02,
+                               y = 1.1,
+                               showarrow = False,
+                               text = '',
+                               xref = 'paper',
+                               yref = 'paper',
+                               font=dict(family = subtitle_font,
+                                         size = subtitle_size,
+                                         color = subtitle_col,),
+                              ),
+                          dict(x = 1.32,
+                               y = 0.95,
+                               showarrow = False,
+                               text = '',
+                               xref = 'paper',
+                               yref = 'paper',
+                               font=dict(family = label_font,
+                                         size = label_size,
+                                         color = label_col,),
+                              )
+                         ]
+
+    # Reference lines: 10%, 5%, 2%, 1% and 0.5% case-fatality
+    rate_notes = [
+        dict(x = np.log10(1.3*latest.max('confirmed')),
+             y = np.log10(0.1*1.3*latest.max('confirmed')),
+             showarrow = False,
+             valign = 'top',
+             height = 30,
+             textangle = -30,
+             text = '10%',
+             xref = 'x',
+             yref = 'y',
+             font=dict(family = label_font,
+                       size = label_size,
+                       color = label_col,),
+            ),
+        dict(x = np.log10(1.3*latest.max('confirmed')),
+             y = np.log10(0.05*1.3*latest.max('confirmed')),
+             showarrow = False,
+             valign = 'top',
+             height = 30,
+             textangle = -30,
+             text = '5%',
+             xref = 'x',
+             yref = 'y',
+             font=dict(family = label_font,
+                       size = label_size,
+                       color = label_col,),
+            ),
+        dict(x = np.log10(1.3*latest.max('confirmed')),
+             y = np.log10(0.02*1.3*latest.max('confirmed')),
+             showarrow = False,
+             valign = 'top',
+             height = 30,
+             textangle = -30,
+             text = '2%',
+             xref = 'x',
+             yref = 'y',
+             font=dict(family = label_font,
+                       size = label_size,
+                       color = label_col,),
+            ),
+        dict(x = np.log10(1.3*latest.max('confirmed')),
+             y = np.log10(0.01*1.3*latest.max('confirmed')),
+             showarrow = False,
+             valign = 'top',
+             height = 30,
+             textangle = -30,
+             text = '1%',
+             xref = 'x',
+             yref = 'y',
+             font=dict(family = label_font,
+                       size = label_size,
+                       color = label_col,),
+            ),
+        dict(x = np.log10(1.3*latest.max('confirmed')),
+             y = np.log10(0.005*1.3*latest.max('confirmed')),
+             showarrow = False,
+             valign = 'top',
+             height = 30,
+             textangle = -30,
+             text = '0.5%',
+             xref = 'x',
+             yref = 'y',
+             font=dict(family = label_font,
+                       size = label_size,
+                       color = label_col,),
+            )]
+
+    # Reference lines: 100, 10, 1, 0.1 and 0.01 deaths per 100k population
+    pop_notes = [
+        dict(x = np.log10(latest.max('population_2018')),
+             y = np.log10(100*latest.max('population_2018')/100000),
+             showarrow = False,
+             valign = 'top',
+             halign='right',
+             height = 30,
+             textangle = -21,
+             text = ('100'+'<br>'+'per 100k population'),
+             xref = 'x',
+             yref = 'y',
+             font=dict(family = label_font,
+                       size = label_size,
+                       color = label_col,),
+            ),
+        dict(x = np.log10(latest.max('population_2018')),
+             y = np.log10(10*latest.max('population_2018')/100000),
+             showarrow = False,
+             valign = 'top',
+             height = 30,
+             textangle = -21,
+             text = '10',
+             xref = 'x',
+             yref = 'y',
+             font=dict(family = label_font,
+                       size = label_size,
+                       color = label_col,),
+            ),
+        dict(x = np.log10(latest.max('population_2018')),
+             y = np.log10(1*latest.max('population_2018')/100000),
+             showarrow = False,
+             valign = 'top',
+             height = 30,
+             textangle = -21,
+             text = '1',
+             xref = 'x',
+             yref = 'y',
+             font=dict(family = label_font,
+                       size = label_size,
+                       color = label_col,),
+            ),
+        dict(x = np.log10(latest.max('population_2018')),
+             y = np.log10(0.1*latest.max('population_2018')/100000),
+             showarrow = False,
+             valign = 'top',
+             height = 30,
+             textangle = -21,
+             text = '0.1',
+             xref = 'x',
+             yref = 'y',
+             font=dict(family = label_font,
+                       size = label_size,
+                       color = label_col,),
+            ),
+        dict(x = np.log10(latest.max('population_2018')),
+             y = np.log10(0.01*latest.max('population_2018')/100000),
+             showarrow = False,
+             valign = 'top',
+             height = 30,
+             textangle = -21,
+             text = '0.01',
+             xref = 'x',
+             yref = 'y',
+             font=dict(family = label_font,
+                       size = label_size,
+                       color = label_col,),
+            )
+    ]
+
+    # Sizes of the 720px and 320px wide versions; the small one only shows
+    # every other case-fatality reference line
+    sizes = {'720': dict(width = width_px, height = height_px, margin_t = 80, 
+                         direction = 'left', pad_t = 10, menu_y = 1.2,
+                         traces = list(range(14)),
+                         annotations_a = annotations_titles + rate_notes,
+                         annotations_b = annotations_titles + pop_notes),
+             '320': dict(width = wide_px_small, height = height_px_small, margin_t = 100, 
+                         direction = 'down', pad_t = 0, menu_y = 1.6,
+                         traces = [0, 1, 2, 4, 6] + list(range(7, 14)),
+                         annotations_a = annotations_titles + rate_notes[::2],
+                         annotations_b = annotations_titles + [dict(pop_notes[0], text = '100/100k pop')] + pop_notes[1:]),
+            }
+    variants = {}
+    for size, s in sizes.items():
+        annotations_a = s['annotations_a']
+        annotations_b = s['annotations_b']
+        visibility_a = [i < 7 for i in s['traces']]
+        visibility_b = [i >= 7 for i in s['traces']]
+
+        lay = go.Layout(width = s['width'], 
+                        height = s['height'],
+                        margin=dict(l=60, r=50, b=50, t=s['margin_t'], pad=4),
+                        plot_bgcolor='white',
+                        xaxis = dict(title='Confirmed cases',
+                                     type = 'log',
+                                     dtick = 1,
+                                     ticks = 'outside',
+                                     ticklen = tick_lenght/2,
+                                     tickcolor = label_col,
+                                     rangemode = 'nonnegative',
+                                     zeroline = False,
+                                     showline=True,
+                                     linecolor = label_col,
+                                     showgrid = False,
+                                    ),
+                        yaxis = dict(title='Deaths',
+                                     type = 'log',
+                                     dtick = 1,
+                                     ticks = 'outside',
+                                     ticklen = tick_lenght/2,
+                                     tickcolor = label_col,
+                                     showgrid = False,
+                                     showline=True,
+                                     linecolor = label_col,
+                                    ),
+                        hovermode = 'closest',
+                        font = dict(size = label_size,
+                                    family = label_font,
+                                    color = label_col,
+                                   ),
+                        legend = dict(x = 1.03, 
+                                      y = 0.7),
+                        showlegend = False,
+                        annotations= annotations_a,
+                        updatemenus=[dict(type = "buttons",
+                                          direction = s['direction'],
+                                          buttons=list([dict(args = [{'visible': visibility_a},
+                                                                     {'xaxis.title': 'Confirmed cases',
+                                                                      'annotations': annotations_a,
+                                                                     }],
+                                                             label = 'Observed case-fatality ratio',
+                                                             method = 'update'
+                                                            ),
+                                                        dict(args = [{'visible': visibility_b},
+                                                                     {'xaxis.title': 'Population',
+                                                                      'annotations': annotations_b,
+                                                                     }
+                                                                    ],
+                                                             label = 'Deaths per 100,000 population',
+                                                             method = 'update'
+                                                            ),
+                                                       ]),
+                                          pad = {"r": 10, "t": s['pad_t']},
+                                          showactive = True,
+                                          x=0,
+                                          xanchor="left",
+                                          y=s['menu_y'],
+                                          yanchor="top",
+                                          bordercolor = 'lightgray',
+                                         ),
+                                    ]
+                       )
+        variants[size] = dict(layout = lay, traces = s['traces'])
 
-fig = dict(data=data, layout=lay)
-#plotly.offline.iplot(fig)
-
-# Save JS
-plot = plotly.offline.plot({'data':data,
-                            'layout':lay},
-                           include_plotlyjs = False,
-                           output_type = 'div',
-                           config = dict(showLink = False,
-                                         modeBarButtonsToRemove = ['sendDataToCloud'],
-                                         displaylogo = False,
-                                         responsive = True)
-                          )
-    
-path = '../visuals/mortality/'
-out_file = open(path+'mortality_top10_320.html', 'w')
-out_file.write('<!DOCTYPE html><html><head><script src="https://cdn.plot.ly/plotly-latest.min.js"></script></head><body>')
-out_file.write(plot)
-out_file.write('</body><html>')
-out_file.close()
 
+    fig = dict(data=data, layout=variants['720']['layout'])
+    #plotly.offline.iplot(fig)
 
-# In[23]:
+    # Save JS
+    divs = render_variants(data, variants, config = plot_config)
+    path = '../visuals/mortality/'
+    files = [path+'mortality_all_'+size+'.html' for size in divs]
+    return {f: page(f, divs[size], plotlyjs) for f, size in zip(files, divs)}
 
+    #df_latest['Lat'][69]
+    #coordinates = (df_latest['Lat'][69], df_latest['Long'][69]), (df_latest['Lat'][69], df_latest['Long'][69])
+    #reverse_geocode.search(coordinates)
 
-# Plot mortality rates
 
-most_recent_day = df_merged.sort_values('dt').dt.unique()[-1]
-
-filt = ((df_merged['dt'] == most_recent_day) & (df_merged['deaths'] > 2))
-pattern = '|'.join(top10_country)
-top10_df_merged = df_merged[(df_merged['Country/Region'].str.contains(pattern) & filt)]
-
-# Plot
-data = [go.Scatter(x = df_merged[filt]['confirmed'],
-                   y = df_merged[filt]['deaths'],
-                   marker = dict(color = 'orange', size = 6),
-                   mode = 'markers',
-                   hoverinfo = 'text',
-                   hovertext = [y+':<br>'+'{:.1f}%'.format(x*100) for x,y in zip(df_merged[filt]['MortalityRate'], 
-                                                                          df_merged[filt]['Country/Region'])],
-                   hoverlabel = dict(bordercolor = 'gray',
-                                     bgcolor = 'white',
-                                     font = dict(color = 'gray')),
-                   text = df_merged[filt]['Country/Region'],
-                   textposition = "top center"
-              ),
-        go.Scatter(x = top10_df_merged['confirmed'],
-                   y = top10_df_merged['deaths'],
-                   marker = dict(color = 'orange', 
-                                 size = 6,
-                                 opacity = 1,
-                                line=dict(
-                                    color = 'black',
-                                    width = 1,
-                                )),
-                   mode = 'markers',
-                   hoverinfo = 'text',
-                   hovertext = [y+':<br>'+'{:.1f}%'.format(x*100) for x,y in zip(top10_df_merged['MortalityRate'], 
-                                                                          top10_df_merged['Country/Region'])],
-                   hoverlabel = dict(bordercolor = 'gray',
-                                     bgcolor = 'white',
-                                     font = dict(color = 'gray')),
-              ),
-        go.Scatter(x = [0, 1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()],
-                   y = [0, 0.1*1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()],
-                   marker = dict(color = 'gray'),
-                   line = dict(width = 0.3),
-                   mode = 'lines',
-                   hoverinfo = 'skip',
-              ),
-        go.Scatter(x = [0, 1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()],
-                   y = [0, 0.05*1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()],
-                   marker = dict(color = 'gray'),
-                   line = dict(width = 0.3),
-                   mode = 'lines',
-                   hoverinfo = 'skip',
-              ),
-        go.Scatter(x = [0, 1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()],
-                   y = [0, 0.02*1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()],
-                   marker = dict(color = 'gray'),
-                   line = dict(width = 0.3),
-                   mode = 'lines',
-                   hoverinfo = 'skip',
-              ),
-        go.Scatter(x = [0, 1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()],
-                   y = [0, 0.01*1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()],
-                   marker = dict(color = 'gray'),
-                   line = dict(width = 0.3),
-                   mode = 'lines',
-                   hoverinfo = 'skip',
-              ),
-        go.Scatter(x = [0, 1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()],
-                   y = [0, 0.005*1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()],
-                   marker = dict(color = 'gray'),
-                   line = dict(width = 0.3),
-                   mode = 'lines',
-                   hoverinfo = 'skip',
-              ),
-        go.Scatter(x = df_merged[filt]['population_2018'],
-                   y = df_merged[filt]['deaths'],
-                   marker = dict(color = 'orange', size = 6),
-                   mode = 'markers',
-                   hoverinfo = 'text',
-                   hovertext = [y+':<br>'+'{:.2f}'.format(x) for x,y in zip(df_merged[filt]['deaths_by100000pop'], 
-                                                                          df_merged[filt]['Country/Region'])],
-                   hoverlabel = dict(bordercolor = 'gray',
-                                     bgcolor = 'white',
-                                     font = dict(color = 'gray')),
-                   visible = False,
-                  ),
-        go.Scatter(x = top10_df_merged['population_2018'],
-                   y = top10_df_merged['deaths'],
-                   marker = dict(color = 'orange', 
-                                 size = 6,
-                                 opacity = 1,
-                                line=dict(
-                                    color = 'black',
-                                    width = 1,
-                                )),
-                   mode = 'markers',
-                   hoverinfo = 'text',
-                   hovertext = [y+':<br>'+'{:.2f}'.format(x) for x,y in zip(top10_df_merged['deaths_by100000pop'], 
-                                                                          top10_df_merged['Country/Region'])],
-                   hoverlabel = dict(bordercolor = 'gray',
-                                     bgcolor = 'white',
-                                     font = dict(color = 'gray')),
-                   visible = False,
-                  ),
-        go.Scatter(x = [0, df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()],
-                   y = [0, 100*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000],
-                   marker = dict(color = 'gray'),
-                   line = dict(width = 0.3),
-                   mode = 'lines',
-                   visible = False,
-                   hoverinfo = 'skip',
-              ),
-        
-        go.Scatter(x = [0, df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()],
-                   y = [0, 10*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000],
-                   marker = dict(color = 'gray'),
-                   line = dict(width = 0.3),
-                   mode = 'lines',
-                   visible = False,
-                   hoverinfo = 'skip',
-              ),
-        go.Scatter(x = [0, df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()],
-                   y = [0, 1*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000],
-                   marker = dict(color = 'gray'),
-                   line = dict(width = 0.3),
-                   mode = 'lines',
-                   visible = False,
-                   hoverinfo = 'skip',
-              ),
-        go.Scatter(x = [0, df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()],
-                   y = [0, 0.1*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000],
-                   marker = dict(color = 'gray'),
-                   line = dict(width = 0.3),
-                   mode = 'lines',
-                   visible = False,
-                   hoverinfo = 'skip',
-              ),
-        go.Scatter(x = [0, df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()],
-                   y = [0, 0.01*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000],
-                   marker = dict(color = 'gray'),
-                   line = dict(width = 0.3),
-                   mode = 'lines',
-                   visible = False,
-                   hoverinfo = 'skip',
-              ),
-       ]
-
-annotations_titles = [dict(x = 0.02,
-                           y = 1.2,
-                           showarrow = False,
-                           text = '', #Mortality ratios worldwide
-                           xref = 'paper',
-                           yref = 'paper',
-                           font=dict(family = title_font,
-                                     size = title_size,
-                                     color = title_col,),
-                          ),
-                      dict(x = 0.02,
-                           y = 1.1,
-                           showarrow = False,
-                           text = '',
-                           xref = 'paper',
-                           yref = 'paper',
-                           font=dict(family = subtitle_font,
-                                     size = subtitle_size,
-                                     color = subtitle_col,),
-                          ),
-                      dict(x = 1.32,
-                           y = 0.95,
-                           showarrow = False,
-                           text = '',
-                           xref = 'paper',
-                           yref = 'paper',
-                           font=dict(family = label_font,
-                                     size = label_size,
-                                     color = label_col,),
-                          )
-                     ]
-
-annotations_a = annotations_titles + [
-    dict(x = np.log10(1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()),
-         y = np.log10(0.1*1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()),
-         showarrow = False,
-         valign = 'top',
-         height = 30,
-         textangle = -30,
-         text = '10%',
-         xref = 'x',
-         yref = 'y',
-         font=dict(family = label_font,
-                   size = label_size,
-                   color = label_col,),
-        ),
-    dict(x = np.log10(1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()),
-         y = np.log10(0.05*1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()),
-         showarrow = False,
-         valign = 'top',
-         height = 30,
-         textangle = -30,
-         text = '5%',
-         xref = 'x',
-         yref = 'y',
-         font=dict(family = label_font,
-                   size = label_size,
-                   color = label_col,),
-        ),
-    dict(x = np.log10(1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()),
-         y = np.log10(0.02*1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()),
-         showarrow = False,
-         valign = 'top',
-         height = 30,
-         textangle = -30,
-         text = '2%',
-         xref = 'x',
-         yref = 'y',
-         font=dict(family = label_font,
-                   size = label_size,
-                   color = label_col,),
-        ),
-    dict(x = np.log10(1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()),
-         y = np.log10(0.01*1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()),
-         showarrow = False,
-         valign = 'top',
-         height = 30,
-         textangle = -30,
-         text = '1%',
-         xref = 'x',
-         yref = 'y',
-         font=dict(family = label_font,
-                   size = label_size,
-                   color = label_col,),
-        ),
-    dict(x = np.log10(1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()),
-         y = np.log10(0.005*1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()),
-         showarrow = False,
-         valign = 'top',
-         height = 30,
-         textangle = -30,
-         text = '0.5%',
-         xref = 'x',
-         yref = 'y',
-         font=dict(family = label_font,
-                   size = label_size,
-                   color = label_col,),
-        )]
-
-annotations_b = annotations_titles + [
-    dict(x = np.log10(df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()),
-         y = np.log10(100*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000),
-         showarrow = False,
-         valign = 'top',
-         halign='right',
-         height = 30,
-         textangle = -21,
-         text = ('100'+'<br>'+'per 100k population'),
-         xref = 'x',
-         yref = 'y',
-         font=dict(family = label_font,
-                   size = label_size,
-                   color = label_col,),
-        ),
-    dict(x = np.log10(df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()),
-         y = np.log10(10*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000),
-         showarrow = False,
-         valign = 'top',
-         height = 30,
-         textangle = -21,
-         text = '10',
-         xref = 'x',
-         yref = 'y',
-         font=dict(family = label_font,
-                   size = label_size,
-                   color = label_col,),
-        ),
-    dict(x = np.log10(df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()),
-         y = np.log10(1*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000),
-         showarrow = False,
-         valign = 'top',
-         height = 30,
-         textangle = -21,
-         text = '1',
-         xref = 'x',
-         yref = 'y',
-         font=dict(family = label_font,
-                   size = label_size,
-                   color = label_col,),
-        ),
-    dict(x = np.log10(df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()),
-         y = np.log10(0.1*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000),
-         showarrow = False,
-         valign = 'top',
-         height = 30,
-         textangle = -21,
-         text = '0.1',
-         xref = 'x',
-         yref = 'y',
-         font=dict(family = label_font,
-                   size = label_size,
-                   color = label_col,),
-        ),
-    dict(x = np.log10(df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()),
-         y = np.log10(0.01*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000),
-         showarrow = False,
-         valign = 'top',
-         height = 30,
-         textangle = -21,
-         text = '0.01',
-         xref = 'x',
-         yref = 'y',
-         font=dict(family = label_font,
-                   size = label_size,
-                   color = label_col,),
-        )
-]
-
-visibility_a = [True, True, True, True, True, True, True, False, False, False, False, False, False, False]
-visibility_b = [False, False, False, False, False, False, False, True, True, True, True, True, True, True]
-
-lay = go.Layout(width = width_px, 
-                height = height_px,
-                margin=dict(l=60, r=50, b=50, t=80, pad=4),
-                plot_bgcolor='white',
-                xaxis = dict(title='Confirmed cases',
-                             type = 'log',
-                             dtick = 1,
-                             ticks = 'outside',
-                             ticklen = tick_lenght/2,
-                             tickcolor = label_col,
-                             rangemode = 'nonnegative',
-                             zeroline = False,
-                             showline=True,
-                             linecolor = label_col,
-                             showgrid = False,
-                            ),
-                yaxis = dict(title='Deaths',
-                             type = 'log',
-                             dtick = 1,
-                             ticks = 'outside',
-                             ticklen = tick_lenght/2,
-                             tickcolor = label_col,
-                             showgrid = False,
-                             showline=True,
-                             linecolor = label_col,
-                            ),
-                hovermode = 'closest',
-                font = dict(size = label_size,
-                            family = label_font,
-                            color = label_col,
-                           ),
-                legend = dict(x = 1.03, 
-                              y = 0.7),
-                showlegend = False,
-                annotations= annotations_a,
-                updatemenus=[dict(type = "buttons",
-                                  direction = "left",
-                                  buttons=list([dict(args = [{'visible': visibility_a},
-                                                             {'xaxis.title': 'Confirmed cases',
-                                                              'annotations': annotations_a,
-                                                             }],
-                                                     label = 'Observed case-fatality ratio',
-                                                     method = 'update'
-                                                    ),
-                                                dict(args = [{'visible': visibility_b},
-                                                             {'xaxis.title': 'Population',
-                                                              'annotations': annotations_b,
-                                                             }
-                                                            ],
-                                                     label = 'Deaths per 100,000 population',
-                                                     method = 'update'
-                                                    ),
-                                               ]),
-                                  pad = {"r": 10, "t": 10},
-                                  showactive = True,
-                                  x=0,
-                                  xanchor="left",
-                                  y=1.2,
-                                  yanchor="top",
-                                  bordercolor = 'lightgray',
-                                 ),
-                            ]
-               )
+# In[20]:
 
 
-fig = dict(data=data, layout=lay)
-#plotly.offline.iplot(fig)
-
-# Save JS
-plot = plotly.offline.plot({'data':data,
-                            'layout':lay},
-                           include_plotlyjs = False,
-                           output_type = 'div',
-                           config = dict(showLink = False,
-                                         modeBarButtonsToRemove = ['sendDataToCloud'],
-                                         displaylogo = False,
-                                         responsive = True)
-                          )
-    
-path = '../visuals/mortality/'
-out_file = open(path+'mortality_all_720.html', 'w')
-out_file.write('<!DOCTYPE html><html><head><script src="https://cdn.plot.ly/plotly-latest.min.js"></script></head><body>')
-out_file.write(plot)
-out_file.write('</body><html>')
-out_file.close()
-
-#df_merged[filt]['Lat'][69]
-#coordinates = (df_merged[filt]['Lat'][69], df_merged[filt]['Long'][69]), (df_merged[filt]['Lat'][69], df_merged[filt]['Long'][69])
-#reverse_geocode.search(coordinates)
+# Table with data
+@pipeline.stage('mortality_table', inputs = ['snapshots'])
+def mortality_table(snapshots):
+    df_day = snapshots.latest().table
+    tmp = df_day[df_day['deaths']>2].sort_values('deaths', ascending = False).copy()
+    tmp = tmp[['Country/Region', 'confirmed', 'deaths', 'MortalityRate', 'deaths_by100000pop']]
+    tmp.rename(columns={'Country/Region': 'Country',
+                        'confirmed': 'Confirmed',
+                        'deaths': 'Deaths',
+                        'MortalityRate': 'Case-Fatality',
+                        'deaths_by100000pop': 'Deaths/100k pop.',
+                       }, inplace = True)
+
+    tmp.sort_values('Deaths', ascending = False, inplace=True)
+    tmp['Case-Fatality'] = ['{:.1f}%'.format(x) for x in tmp['Case-Fatality']*100]
+    tmp['Deaths/100k pop.'] = ['{:.2f}'.format(x) for x in tmp['Deaths/100k pop.']]
+    tmp['Confirmed'] = ['{:,}'.format(x) for x in tmp['Confirmed']]
+    tmp['Deaths'] = ['{:,}'.format(x) for x in tmp['Deaths']]
+
+    tmp.reset_index(drop=True, inplace = True)
+
+    path = '../visuals/mortality/'
+    return {path+'table.json': tmp.to_json(orient = 'columns')}
+    #tmp.head()
+    #tmp.shape[0]
+
+
+# ## <span style="color:orange">US counties</span>
+# <hr style="border: 1px solid #D3D3D3" >
 
+# In[21]:
 
-# In[24]:
 
+# US counties, states and the country (COVID19_US=1)
+# The same steps as above run on the three levels at once, one panel row per
+# 'key' (the JHU Combined_Key: 'Autauga, Alabama, US', 'Alabama, US', 'US').
+# The rows are split into blocks computed by COVID19_PROCESSES worker
+# processes (see covid19/partition.py).
+# Throughput target for the whole US pipeline: 1,000,000 county rows/s
+# COVID19_US_SINCE=2020-06-01 only reads the dates from then on; the table
+# then has no first_*/days_since_* columns, which need the whole history
+us_counties = os.environ.get('COVID19_US', '0') == '1'
+us_since = os.environ.get('COVID19_US_SINCE') or None
+if us_since is not None:
+    print('US: dates from {} on, without the milestone columns'.format(us_since))
+us_table_path = '../data_cache/us.parquet'
+# Only the key columns the hierarchy needs (no codes, no coordinates)
+us_columns = ['UID', 'Admin2', 'Province_State', 'Country_Region', 'Combined_Key', 'Population']
+
+@pipeline.stage('us_ingest', cache = False)
+def us_ingest():
+    return {metric: read_jhu(metric+'_US', cache_dir, base_url = base_url, offline = offline, 
+                             columns = us_columns, dates = (us_since, None))
+            for metric in ['confirmed', 'deaths']}
 
-# Plot mortality rates
 
-most_recent_day = df_merged.sort_values('dt').dt.unique()[-1]
-
-filt = ((df_merged['dt'] == most_recent_day) & (df_merged['deaths'] > 2))
-pattern = '|'.join(top10_country)
-top10_df_merged = df_merged[(df_merged['Country/Region'].str.contains(pattern) & filt)]
-
-# Plot
-data = [go.Scatter(x = df_merged[filt]['confirmed'],
-                   y = df_merged[filt]['deaths'],
-                   marker = dict(color = 'orange', size = 6),
-                   mode = 'markers',
-                   hoverinfo = 'text',
-                   hovertext = [y+':<br>'+'{:.1f}%'.format(x*100) for x,y in zip(df_merged[filt]['MortalityRate'], 
-                                                                          df_merged[filt]['Country/Region'])],
-                   hoverlabel = dict(bordercolor = 'gray',
-                                     bgcolor = 'white',
-                                     font = dict(color = 'gray')),
-                   text = df_merged[filt]['Country/Region'],
-                   textposition = "top center"
-              ),
-        go.Scatter(x = top10_df_merged['confirmed'],
-                   y = top10_df_merged['deaths'],
-                   marker = dict(color = 'orange', 
-                                 size = 6,
-                                 opacity = 1,
-                                line=dict(
-                                    color = 'black',
-                                    width = 1,
-                                )),
-                   mode = 'markers',
-                   hoverinfo = 'text',
-                   hovertext = [y+':<br>'+'{:.1f}%'.format(x*100) for x,y in zip(top10_df_merged['MortalityRate'], 
-                                                                          top10_df_merged['Country/Region'])],
-                   hoverlabel = dict(bordercolor = 'gray',
-                                     bgcolor = 'white',
-                                     font = dict(color = 'gray')),
-              ),
-        go.Scatter(x = [0, 1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()],
-                   y = [0, 0.1*1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()],
-                   marker = dict(color = 'gray'),
-                   line = dict(width = 0.3),
-                   mode = 'lines',
-                   hoverinfo = 'skip',
-              ),
-        go.Scatter(x = [0, 1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()],
-                   y = [0, 0.02*1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()],
-                   marker = dict(color = 'gray'),
-                   line = dict(width = 0.3),
-                   mode = 'lines',
-                   hoverinfo = 'skip',
-              ),
-        go.Scatter(x = [0, 1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()],
-                   y = [0, 0.005*1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()],
-                   marker = dict(color = 'gray'),
-                   line = dict(width = 0.3),
-                   mode = 'lines',
-                   hoverinfo = 'skip',
-              ),
-        go.Scatter(x = df_merged[filt]['population_2018'],
-                   y = df_merged[filt]['deaths'],
-                   marker = dict(color = 'orange', size = 6),
-                   mode = 'markers',
-                   hoverinfo = 'text',
-                   hovertext = [y+':<br>'+'{:.2f}'.format(x) for x,y in zip(df_merged[filt]['deaths_by100000pop'], 
-                                                                          df_merged[filt]['Country/Region'])],
-                   hoverlabel = dict(bordercolor = 'gray',
-                                     bgcolor = 'white',
-                                     font = dict(color = 'gray')),
-                   visible = False,
-                  ),
-        go.Scatter(x = top10_df_merged['population_2018'],
-                   y = top10_df_merged['deaths'],
-                   marker = dict(color = 'orange', 
-                                 size = 6,
-                                 opacity = 1,
-                                line=dict(
-                                    color = 'black',
-                                    width = 1,
-                                )),
-                   mode = 'markers',
-                   hoverinfo = 'text',
-                   hovertext = [y+':<br>'+'{:.2f}'.format(x) for x,y in zip(top10_df_merged['deaths_by100000pop'], 
-                                                                          top10_df_merged['Country/Region'])],
-                   hoverlabel = dict(bordercolor = 'gray',
-                                     bgcolor = 'white',
-                                     font = dict(color = 'gray')),
-                   visible = False,
-                  ),
-        go.Scatter(x = [0, df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()],
-                   y = [0, 100*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000],
-                   marker = dict(color = 'gray'),
-                   line = dict(width = 0.3),
-                   mode = 'lines',
-                   visible = False,
-                   hoverinfo = 'skip',
-              ),
-        
-        go.Scatter(x = [0, df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()],
-                   y = [0, 10*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000],
-                   marker = dict(color = 'gray'),
-                   line = dict(width = 0.3),
-                   mode = 'lines',
-                   visible = False,
-                   hoverinfo = 'skip',
-              ),
-        go.Scatter(x = [0, df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()],
-                   y = [0, 1*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000],
-                   marker = dict(color = 'gray'),
-                   line = dict(width = 0.3),
-                   mode = 'lines',
-                   visible = False,
-                   hoverinfo = 'skip',
-              ),
-        go.Scatter(x = [0, df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()],
-                   y = [0, 0.1*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000],
-                   marker = dict(color = 'gray'),
-                   line = dict(width = 0.3),
-                   mode = 'lines',
-                   visible = False,
-                   hoverinfo = 'skip',
-              ),
-        go.Scatter(x = [0, df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()],
-                   y = [0, 0.01*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000],
-                   marker = dict(color = 'gray'),
-                   line = dict(width = 0.3),
-                   mode = 'lines',
-                   visible = False,
-                   hoverinfo = 'skip',
-              ),
-       ]
-
-annotations_titles = [dict(x = 0.02,
-                           y = 1.2,
-                           showarrow = False,
-                           text = '', #Mortality ratios worldwide
-                           xref = 'paper',
-                           yref = 'paper',
-                           font=dict(family = title_font,
-                                     size = title_size,
-                                     color = title_col,),
-                          ),
-                      dict(x = 0.02,
-                           y = 1.1,
-                           showarrow = False,
-                           text = '',
-                           xref = 'paper',
-                           yref = 'paper',
-                           font=dict(family = subtitle_font,
-                                     size = subtitle_size,
-                                     color = subtitle_col,),
-                          ),
-                      dict(x = 1.32,
-                           y = 0.95,
-                           showarrow = False,
-                           text = '',
-                           xref = 'paper',
-                           yref = 'paper',
-                           font=dict(family = label_font,
-                                     size = label_size,
-                                     color = label_col,),
-                          )
-                     ]
-
-annotations_a = annotations_titles + [
-    dict(x = np.log10(1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()),
-         y = np.log10(0.1*1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()),
-         showarrow = False,
-         valign = 'top',
-         height = 30,
-         textangle = -30,
-         text = '10%',
-         xref = 'x',
-         yref = 'y',
-         font=dict(family = label_font,
-                   size = label_size,
-                   color = label_col,),
-        ),
-    dict(x = np.log10(1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()),
-         y = np.log10(0.02*1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()),
-         showarrow = False,
-         valign = 'top',
-         height = 30,
-         textangle = -30,
-         text = '2%',
-         xref = 'x',
-         yref = 'y',
-         font=dict(family = label_font,
-                   size = label_size,
-                   color = label_col,),
-        ),
-    dict(x = np.log10(1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()),
-         y = np.log10(0.005*1.3*df_merged[df_merged['dt'] == most_recent_day]['confirmed'].max()),
-         showarrow = False,
-         valign = 'top',
-         height = 30,
-         textangle = -30,
-         text = '0.5%',
-         xref = 'x',
-         yref = 'y',
-         font=dict(family = label_font,
-                   size = label_size,
-                   color = label_col,),
-        )]
-
-annotations_b = annotations_titles + [
-    dict(x = np.log10(df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()),
-         y = np.log10(100*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000),
-         showarrow = False,
-         valign = 'top',
-         halign='right',
-         height = 30,
-         textangle = -21,
-         text = ('100/100k pop'),
-         xref = 'x',
-         yref = 'y',
-         font=dict(family = label_font,
-                   size = label_size,
-                   color = label_col,),
-        ),
-    dict(x = np.log10(df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()),
-         y = np.log10(10*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000),
-         showarrow = False,
-         valign = 'top',
-         height = 30,
-         textangle = -21,
-         text = '10',
-         xref = 'x',
-         yref = 'y',
-         font=dict(family = label_font,
-                   size = label_size,
-                   color = label_col,),
-        ),
-    dict(x = np.log10(df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()),
-         y = np.log10(1*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000),
-         showarrow = False,
-         valign = 'top',
-         height = 30,
-         textangle = -21,
-         text = '1',
-         xref = 'x',
-         yref = 'y',
-         font=dict(family = label_font,
-                   size = label_size,
-                   color = label_col,),
-        ),
-    dict(x = np.log10(df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()),
-         y = np.log10(0.1*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000),
-         showarrow = False,
-         valign = 'top',
-         height = 30,
-         textangle = -21,
-         text = '0.1',
-         xref = 'x',
-         yref = 'y',
-         font=dict(family = label_font,
-                   size = label_size,
-                   color = label_col,),
-        ),
-    dict(x = np.log10(df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()),
-         y = np.log10(0.01*df_merged[df_merged['dt'] == most_recent_day]['population_2018'].max()/100000),
-         showarrow = False,
-         valign = 'top',
-         height = 30,
-         textangle = -21,
-         text = '0.01',
-         xref = 'x',
-         yref = 'y',
-         font=dict(family = label_font,
-                   size = label_size,
-                   color = label_col,),
-        )
-]
-
-visibility_a = [True, True, True, True, True, False, False, False, False, False, False, False]
-visibility_b = [False, False, False, False, False, True, True, True, True, True, True, True]
-
-lay = go.Layout(width = wide_px_small, 
-                height = height_px_small,
-                margin=dict(l=60, r=50, b=50, t=100, pad=4),
-                plot_bgcolor='white',
-                xaxis = dict(title='Confirmed cases',
-                             type = 'log',
-                             dtick = 1,
-                             ticks = 'outside',
-                             ticklen = tick_lenght/2,
-                             tickcolor = label_col,
-                             rangemode = 'nonnegative',
-                             zeroline = False,
-                             showline=True,
-                             linecolor = label_col,
-                             showgrid = False,
-                            ),
-                yaxis = dict(title='Deaths',
-                             type = 'log',
-                             dtick = 1,
-                             ticks = 'outside',
-                             ticklen = tick_lenght/2,
-                             tickcolor = label_col,
-                             showgrid = False,
-                             showline=True,
-                             linecolor = label_col,
-                            ),
-                hovermode = 'closest',
-                font = dict(size = label_size,
-                            family = label_font,
-                            color = label_col,
-                           ),
-                legend = dict(x = 1.03, 
-                              y = 0.7),
-                showlegend = False,
-                annotations= annotations_a,
-                updatemenus=[dict(type = "buttons",
-                                  direction = "down",
-                                  buttons=list([dict(args = [{'visible': visibility_a},
-                                                             {'xaxis.title': 'Confirmed cases',
-                                                              'annotations': annotations_a,
-                                                             }],
-                                                     label = 'Observed case-fatality ratio',
-                                                     method = 'update'
-                                                    ),
-                                                dict(args = [{'visible': visibility_b},
-                                                             {'xaxis.title': 'Population',
-                                                              'annotations': annotations_b,
-                                                             }
-                                                            ],
-                                                     label = 'Deaths per 100,000 population',
-                                                     method = 'update'
-                                                    ),
-                                               ]),
-                                  pad = {"r": 10, "t": 0},
-                                  showactive = True,
-                                  x=0,
-                                  xanchor="left",
-                                  y=1.6,
-                                  yanchor="top",
-                                  bordercolor = 'lightgray',
-                                 ),
-                            ]
-               )
+# In[22]:
 
 
-fig = dict(data=data, layout=lay)
-#plotly.offline.iplot(fig)
+@pipeline.stage('us_table', inputs = ['us_ingest'], 
+                params = {'spec': milestone_spec if us_since is None else [], 'windows': windows})
+def us_table(tables, spec, windows):
+    start = time.time()
+    panel = us_panel(tables['confirmed'], tables['deaths'])
+
+    def derive(rows):
+        # Derived columns of a block of keys, in the order of the table: the 
+        # same as for the countries (NaN by population without a population, 
+        # e.g. 'Unassigned'), then the days since the milestones
+        columns = derive_columns(rows['confirmed'], rows['deaths'], rows['Population'], windows = windows)
+        for t in spec:
+            first = first_reached(rows[t[0]], t[1], panel.dates)
+            columns += list(zip(milestone_names(t), [first, days_since(first, panel.dates)]))
+        return columns
+
+    inputs = {'confirmed': panel['confirmed'], 'deaths': panel['deaths'], 'Population': panel['Population']}
+    for name, values in map_rows(derive, inputs, processes = processes):
+        panel[name] = values
+    df_us, (before, after) = compact(panel.to_long())
+    print('df_us: {:,} rows, {:.1f} MB -> {:.1f} MB'.format(len(df_us), before/1e6, after/1e6))
+
+    # Throughput, without the download and the parquet file
+    county_rows = int((df_us['level'] == 'county').sum())
+    seconds = time.time() - start
+    print('US: {:,} county rows in {:.1f} s, {:,.0f} rows/s (target 1,000,000)'.format(
+        county_rows, seconds, county_rows/seconds))
+    save_table(df_us, us_table_path)
+    return df_us
 
-# Save JS
-plot = plotly.offline.plot({'data':data,
-                            'layout':lay},
-                           include_plotlyjs = False,
-                           output_type = 'div',
-                           config = dict(showLink = False,
-                                         modeBarButtonsToRemove = ['sendDataToCloud'],
-                                         displaylogo = False,
-                                         responsive = True)
-                          )
-    
-path = '../visuals/mortality/'
-out_file = open(path+'mortality_all_320.html', 'w')
-out_file.write('<!DOCTYPE html><html><head><script src="https://cdn.plot.ly/plotly-latest.min.js"></script></head><body>')
-out_file.write(plot)
-out_file.write('</body><html>')
-out_file.close()
 
-#df_merged[filt]['Lat'][69]
-#coordinates = (df_merged[filt]['Lat'][69], df_merged[filt]['Long'][69]), (df_merged[filt]['Lat'][69], df_merged[filt]['Long'][69])
-#reverse_geocode.search(coordinates)
+# In[23]:
 
 
-# In[25]:
+# Latest numbers of every state to JSON
+@pipeline.stage('us_snapshots', inputs = ['us_table'], cache = False)
+def us_index_dates(df_us):
+    return Snapshots(df_us, order = 'dt')
+
+@pipeline.stage('us_state_info', inputs = ['us_snapshots'], params = {'windows': windows})
+def us_state_info(us_snapshots, windows):
+    df_day = us_snapshots.latest().table
+    tmp = df_day[df_day['level'] == 'state']
+    tmp = tmp[['Province_State', 'confirmed', 'deaths', 'confirmed_newcases_movavg', 
+               'deaths_by100000pop', 'MortalityRate']].set_index('Province_State')
+    # The average is centered, so NaN on the latest dates: use the last 
+    # complete one
+    df_day = us_snapshots.latest(window_offsets(windows['newcases'])[-1]).table
+    movavg = df_day[df_day['level'] == 'state'].set_index('Province_State')['confirmed_newcases_movavg']
+    tmp['confirmed_newcases_movavg'] = movavg.reindex(tmp.index).values
+    rates = ['confirmed_newcases_movavg', 'deaths_by100000pop', 'MortalityRate']
+    tmp[rates] = tmp[rates].astype('float64').round(4)
+    path = '../visuals/us/'
+    return {path+'state_info.json': tmp.to_json(orient = 'index')}
 
 
-# Table with data
-most_recent_day = df_merged.sort_values('dt').dt.unique()[-1]
-tmp = df_merged[(df_merged['dt'] == most_recent_day) & (df_merged['deaths']>2)].sort_values('deaths', ascending = False).copy()
-tmp = tmp[['Country/Region', 'confirmed', 'deaths', 'MortalityRate', 'deaths_by100000pop']]
-tmp.rename(columns={'Country/Region': 'Country',
-                    'confirmed': 'Confirmed',
-                    'deaths': 'Deaths',
-                    'MortalityRate': 'Case-Fatality',
-                    'deaths_by100000pop': 'Deaths/100k pop.',
-                   }, inplace = True)
-
-tmp.sort_values('Deaths', ascending = False, inplace=True)
-tmp['Case-Fatality'] = ['{:.1f}%'.format(x) for x in tmp['Case-Fatality']*100]
-tmp['Deaths/100k pop.'] = ['{:.2f}'.format(x) for x in tmp['Deaths/100k pop.']]
-tmp['Confirmed'] = ['{:,}'.format(x) for x in tmp['Confirmed']]
-tmp['Deaths'] = ['{:,}'.format(x) for x in tmp['Deaths']]
-
-tmp.reset_index(drop=True, inplace = True)
-
-path = '../visuals/mortality/'
-tmp.to_json(path+'table.json', orient = 'columns')
-#tmp.head()
-#tmp.shape[0]
+# In[24]:
+
+
+# Run the pipeline and write the charts
+# COVID19_RENDER_ONLY=1 renders the charts from the saved table 
+# (../data_cache/df_merged.parquet) without downloading and deriving again.
+# The charts are rendered in a pool of COVID19_PROCESSES worker processes 
+# (default: one per core, 1 renders them one after the other)
+# The run report (../data_cache/run_report.json) has the time, CPU time, memory
+# and rows of every stage and the size of every file written. COVID19_PROFILE=<stage>
+# also profiles one stage (COVID19_PROFILER=cprofile or pyinstrument) into 
+# ../data_cache/profile-<stage>.prof (.html)
+render_only = os.environ.get('COVID19_RENDER_ONLY', '0') == '1'
+profile_stage = os.environ.get('COVID19_PROFILE')
+pipeline.profile(profile_stage, '../data_cache/profile-{}'.format(profile_stage), 
+                 tool = os.environ.get('COVID19_PROFILER', 'cprofile'))
+charts = ['timeline'] + country_timelines + ['country_info', 'mortality_top10', 'mortality_all', 'mortality_table']
+if us_counties:
+    charts += ['us_state_info']
+
+if render_only:
+    given = {'table': load_table(table_path)}
+    if us_counties:
+        given['us_table'] = load_table(us_table_path)
+    results = pipeline.run(charts, given = given, parallel = charts, processes = processes)
+else:
+    checks = ['validate'] if backend == 'polars' and validate else []
+    results = pipeline.run(['table'] + checks + charts, parallel = charts, processes = processes)
+
+written = {name: write_files(results[name]) for name in charts}
+pipeline.write_report('../data_cache/run_report.json', files = written)
+print('Run: {:.1f} s ({:.1f} s CPU), peak memory {:.0f} MB'.format(
+    pipeline.summary['seconds'], pipeline.summary['cpu_seconds'], pipeline.summary['peak_rss_mb'] or 0))
+df_merged = results['table']
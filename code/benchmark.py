@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmark every stage of Covid-19_v1.py on synthetic data
+#
+# The notebook runs once, offline, in a scratch copy of the repository layout
+# whose data cache holds JHU-shaped tables of the requested size (see
+# covid19/synthetic.py). Every stage it ran (reshape and alignment of the
+# metrics, the province rollup, milestones, growth, the population join, moving
+# averages, each chart) is then timed again on the same inputs, best of
+# `repeat`, and run once more under tracemalloc for its peak memory (NumPy and
+# Python allocations; Arrow buffers are not seen).
+#
+# The results are JSON files that can be compared:
+#
+#   python benchmark.py --countries 190 --days 300 --provinces 10
+#   python benchmark.py --countries 190 --days 300 --against ../data_cache/benchmarks/<previous>.json
+#   python benchmark.py --compare old.json new.json
+#   python benchmark.py --backend polars     (derivation as a lazy Polars query)
+#   python benchmark.py --us                 (and the US counties: 52 x 64 rows)
+#
+# --against and --compare exit with status 1 when a stage got slower or
+# bigger than the tolerance allows.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import plotly
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from covid19 import converttable
+from covid19.synthetic import make_tables, make_us_tables
+
+
+NOTEBOOK = os.path.join(HERE, 'Covid-19_v1.py')
+DATA_TABLES = os.path.join(HERE, '..', 'data_tables')
+OUT_DIR = os.path.join(HERE, '..', 'data_cache', 'benchmarks')
+
+# A stage regresses when it is `tolerance` slower (or bigger) and the
+# difference is above the noise floor
+TOLERANCE = 0.2
+SECONDS_FLOOR = 0.005
+MB_FLOOR = 1.0
+
+# Steps timed on their own besides the stages (the reshape stage is
+# converttable on the first table plus the aligned metrics)
+KERNELS = {'converttable': lambda tables: converttable(tables['confirmed'], value_name = 'confirmed')}
+
+
+def prepare(workdir, countries, days, provinces, seed, us = False):
+    """Lay out workdir like the repository (code/, data_tables/, data_cache/)
+    with synthetic JHU files in the cache (the US files too with `us`);
+    return the synthetic global tables."""
+    os.makedirs(os.path.join(workdir, 'code'))
+    shutil.copytree(DATA_TABLES, os.path.join(workdir, 'data_tables'))
+    population = pd.read_csv(os.path.join(DATA_TABLES, 'world_pop_by_country.csv'))
+    population.rename(columns = {'Country Name': 'Country/Region'}, inplace = True)
+    centroids = pd.read_csv(os.path.join(DATA_TABLES, 'country_centroids.csv'))
+
+    tables = make_tables(countries = countries, days = days, provinces = provinces,
+                         population = population, centroids = centroids, seed = seed)
+    cache_dir = os.path.join(workdir, 'data_cache')
+    os.makedirs(cache_dir)
+    for metric, df in tables.items():
+        df.to_csv(os.path.join(cache_dir, 'time_series_covid19_{}_global.csv'.format(metric)), index = False)
+    if us:
+        for metric, df in make_us_tables(days = days, seed = seed).items():
+            df.to_csv(os.path.join(cache_dir, 'time_series_covid19_{}_US.csv'.format(metric)), index = False)
+    return tables
+
+
+def run_notebook(workdir, backend = 'pandas', env = None):
+    """Run the notebook in workdir (offline, serial, full rebuild unless
+    `env` says otherwise) and return its globals.
+
+    env -- more COVID19_* variables, e.g. {'COVID19_INCREMENTAL': '1'}
+    """
+    defaults = {'COVID19_OFFLINE': '1', 'COVID19_PROCESSES': '1', 'COVID19_INCREMENTAL': '0',
+                'COVID19_RENDER_ONLY': '0', 'COVID19_US': '0', 'COVID19_BACKEND': backend,
+                'COVID19_VALIDATE': '0', 'COVID19_RECOVERED': '0'}
+    env = dict(defaults, **(env or {}))
+    saved_env = {k: os.environ.get(k) for k in env}
+    cwd = os.getcwd()
+    os.environ.update(env)
+    os.chdir(os.path.join(workdir, 'code'))
+    try:
+        return runpy.run_path(NOTEBOOK, run_name = '__benchmark__')
+    finally:
+        os.chdir(cwd)
+        for k, v in saved_env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+def measure(func, args = (), kwargs = None, repeat = 3):
+    """Best and median seconds of `repeat` calls, peak traced MB of one more
+    call and the rows of the output (when it is a table)."""
+    kwargs = kwargs or {}
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    result = {'seconds': min(times), 'median': float(np.median(times)), 'peak_mb': peak/1e6}
+    if isinstance(output, pd.DataFrame):
+        result['rows'] = len(output)
+    return result
+
+
+def benchmark(countries, days, provinces, repeat = 3, seed = 0, keep = False, backend = 'pandas',
+              us = False):
+    """Run the benchmark; return the result as a JSON-ready dict."""
+    workdir = tempfile.mkdtemp(prefix = 'covid19-bench-')
+    try:
+        tables = prepare(workdir, countries, days, provinces, seed, us = us)
+        g = run_notebook(workdir, backend = backend, env = {'COVID19_US': '1' if us else '0'})
+        pipeline, results = g['pipeline'], g['results']
+
+        stages = {}
+        cwd = os.getcwd()
+        os.chdir(os.path.join(workdir, 'code'))
+        try:
+            for name in pipeline.order(list(results)):
+                s = pipeline.stages[name]
+                stages[name] = measure(s.func, [results[i] for i in s.inputs], s.params, repeat = repeat)
+        finally:
+            os.chdir(cwd)
+        kernels = {name: measure(func, [tables], repeat = repeat) for name, func in sorted(KERNELS.items())}
+    finally:
+        if keep:
+            print('Kept', workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors = True)
+
+    return {'params': {'countries': countries, 'days': days, 'provinces': provinces,
+                       'rows': len(tables['confirmed']), 'repeat': repeat, 'seed': seed,
+                       'backend': backend, 'us': us},
+            'environment': environment(),
+            'stages': stages,
+            'kernels': kernels,
+           }
+
+
+def environment():
+    try:
+        rev = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd = HERE,
+                                      stderr = subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        rev = None
+    return {'date': datetime.datetime.now().replace(microsecond = 0).isoformat(),
+            'git': rev,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'plotly': plotly.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+           }
+
+
+def compare(old, new, tolerance = TOLERANCE):
+    """Print old vs new for every stage and kernel; return the names of the
+    ones that regressed."""
+    if old['params'] != new['params']:
+        print('Warning: different sizes {} vs {}'.format(old['params'], new['params']))
+    print('{:<24} {:>9} {:>9} {:>7} {:>9} {:>9}'.format('stage', 'old s', 'new s', 'ratio', 'old MB', 'new MB'))
+    regressed = []
+    for section in ('kernels', 'stages'):
+        a, b = old.get(section, {}), new.get(section, {})
+        for name in sorted(set(a) | set(b)):
+            if name not in a or name not in b:
+                print('{:<24} only in {}'.format(name, 'old' if name in a else 'new'))
+                continue
+            t0, t1 = a[name]['seconds'], b[name]['seconds']
+            m0, m1 = a[name]['peak_mb'], b[name]['peak_mb']
+            slower = t1 > t0*(1 + tolerance) and t1 - t0 > SECONDS_FLOOR
+            bigger = m1 > m0*(1 + tolerance) and m1 - m0 > MB_FLOOR
+            flag = ' '.join(f for f, on in (('SLOWER', slower), ('BIGGER', bigger)) if on)
+            print('{:<24} {:>9.4f} {:>9.4f} {:>7.2f} {:>9.1f} {:>9.1f} {}'.format(
+                name, t0, t1, t1/t0 if t0 else float('nan'), m0, m1, flag))
+            if flag:
+                regressed.append(name)
+    return regressed
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark the notebook stages on synthetic data')
+    parser.add_argument('--countries', type = int, default = 190)
+    parser.add_argument('--days', type = int, default = 300)
+    parser.add_argument('--provinces', type = int, default = 10,
+                        help = 'provinces of each country with a centroid (rolled up)')
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--backend', choices = ('pandas', 'polars'), default = 'pandas',
+                        help = 'backend of the derivation (COVID19_BACKEND)')
+    parser.add_argument('--us', action = 'store_true',
+                        help = 'also the US county files (COVID19_US), 52 states of 63 counties')
+    parser.add_argument('--out', help = 'result file (default: {}/<date>-<size>.json)'.format(OUT_DIR))
+    parser.add_argument('--against', metavar = 'OLD', help = 'compare the result with a previous one')
+    parser.add_argument('--compare', nargs = 2, metavar = ('OLD', 'NEW'), help = 'only compare two results')
+    parser.add_argument('--tolerance', type = float, default = TOLERANCE)
+    parser.add_argument('--keep', action = 'store_true', help = 'keep the scratch directory')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            old = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        return 1 if compare(old, new, args.tolerance) else 0
+
+    result = benchmark(args.countries, args.days, args.provinces, repeat = args.repeat,
+                       seed = args.seed, keep = args.keep, backend = args.backend, us = args.us)
+    out = args.out or os.path.join(OUT_DIR, '{:%Y%m%d-%H%M%S}-{}x{}x{}.json'.format(
+        datetime.datetime.now(), args.countries, args.days, args.provinces))
+    directory = os.path.dirname(out)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(out, 'w') as f:
+        json.dump(result, f, indent = 1, sort_keys = True)
+    print('Wrote', out)
+
+    if args.against:
+        with open(args.against) as f:
+            return 1 if compare(json.load(f), result, args.tolerance) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
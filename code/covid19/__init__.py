@@ -0,0 +1,16 @@
+# Helpers for the COVID-19 data analysis notebook (Covid-19_v1)
+
+from .groups import GroupIndex
+from .panel import Panel
+from .partition import map_rows
+from .countries import CountryDimension
+from .reshape import align_metrics, converttable, rollup_provinces
+from .fetch import JHU_BASE_URL, CacheMiss, read_jhu
+from .incremental import plan_update, save_update
+from .us import hierarchy, us_panel
+from .store import load_table, save_table
+from .schema import compact
+from .snapshot import Snapshots
+from .pipeline import Pipeline, write_files
+from .render import plot_div, render_variants, to_json
+from .page import page, publish_plotlyjs
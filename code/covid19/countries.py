@@ -0,0 +1,61 @@
+# Country dimension: per-country attributes keyed by ISO 3166 code
+#
+# The population table (World Bank) and the JHU tables do not always name a
+# country the same way ('Burma' / 'Myanmar', 'Syria' / 'Syrian Arab
+# Republic', ...). Countries are keyed by their ISO alpha-3 code instead; an
+# alias table maps every other name to a code. Attributes are taken for the
+# distinct country names (e.g. the entities of a Panel): one lookup per
+# country, then an array take per attribute, with no merge copying the whole
+# table.
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+
+class CountryDimension(object):
+    """Attributes of countries keyed by ISO code, found by any of their names.
+
+    table   -- one row per country: `code`, `name` and the attributes
+    aliases -- other names: columns 'Alias' and `code`
+    """
+
+    def __init__(self, table, aliases = None, code = 'Country Code', name = 'Country Name'):
+        if table[code].isna().any() or table[code].duplicated().any():
+            raise ValueError('every country needs one unique {!r}'.format(code))
+        self.table = table.set_index(code)
+        names = pd.Series(self.table.index, index = table[name].values)
+        if aliases is not None:
+            names = pd.concat([names, pd.Series(aliases[code].values, index = aliases['Alias'].values)])
+        unknown = set(names.values) - set(self.table.index)
+        if unknown:
+            raise ValueError('aliases of unknown codes: {}'.format(sorted(unknown)))
+        if names.index.duplicated().any():
+            raise ValueError('names with several codes: {}'.format(
+                sorted(set(names.index[names.index.duplicated()]))))
+        # Name -> position of the country in self.table
+        self.positions = pd.Series(self.table.index.get_indexer(names.values), index = names.index)
+
+    def lookup(self, names):
+        """Positions in self.table of the countries with these names (-1 for
+        unknown names)."""
+        return self.positions.reindex(names).fillna(-1).values.astype(np.intp)
+
+    def take(self, names, columns):
+        """The attributes in `columns` of the countries with these names, as
+        ({column: array}, sorted names without a country)."""
+        found = self.lookup(names)
+        values = {c: _take(self.table[c].values, found) for c in columns}
+        return values, sorted(pd.Index(names)[found < 0])
+
+    def cache_key(self):
+        hashed = pd.util.hash_pandas_object(self.table, index = True).values.tobytes()
+        hashed += pd.util.hash_pandas_object(self.positions, index = True).values.tobytes()
+        return hashlib.sha1(hashed).hexdigest()
+
+
+def _take(values, rows):
+    # values[rows], NaN where rows is -1
+    values = values.astype(object) if values.dtype.kind in 'OSU' else values.astype(float)
+    return np.append(values, np.nan)[rows]
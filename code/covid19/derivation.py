@@ -0,0 +1,77 @@
+# The derived columns of the table, on the rows of a Panel
+#
+# Daily new cases, their growth, the cases by population, the mortality rate
+# and the moving averages are the same steps for the countries of the global
+# files and for the US counties, states and country. derive_columns() is
+# their one implementation: it works on arrays of rows (entities x dates),
+# a whole Panel or a block of one (see partition.py). WINDOWS holds the
+# lengths of the moving averages, and reach() how many days around a date
+# its derived values read (what an incremental update recomputes, see
+# incremental.py).
+
+import numpy as np
+
+from .panel import diff, growth, window_mean, window_offsets
+
+
+# Centered moving averages, in days: of the growth of the confirmed new
+# cases and of the new cases
+WINDOWS = {'growth': 5, 'newcases': 3}
+
+# Columns that get a moving average of WINDOWS['newcases'] days
+AVERAGED = ('confirmed_newcases', 'deaths_newcases', 'confirmed_newcases_by100000pop')
+
+
+def derive_columns(confirmed, deaths, population, windows = WINDOWS, population_name = None):
+    """Derived columns of entity rows, as a list of (name, array) in the
+    order of the table.
+
+    confirmed, deaths -- cumulative counts (entities x dates)
+    population        -- one value per entity; NaN or 0 when unknown (the
+                         rates by population are NaN)
+    windows           -- lengths of the moving averages (see WINDOWS)
+    population_name   -- also return the population under this name, before
+                         the rates (for entities that have none yet)
+    """
+    # Daily new cases (confirmed and deaths)
+    confirmed_newcases = diff(confirmed)
+    deaths_newcases = diff(deaths)
+
+    # New cases growth (new cases today divided by new cases yesterday)
+    # Growth is NaN on the first day and when yesterday had no new cases
+    confirmed_newcases_growth = growth(confirmed_newcases, on_zero = 'nan')
+    columns = [('confirmed_newcases', confirmed_newcases),
+               ('deaths_newcases', deaths_newcases),
+               ('confirmed_newcases_growth', confirmed_newcases_growth),
+               ('confirmed_newcases_growth_movavg', window_mean(confirmed_newcases_growth,
+                                                                window = windows['growth'], center = True)),
+               ('deaths_newcases_growth', growth(deaths_newcases, on_zero = 'nan'))]
+    if population_name is not None:
+        columns.append((population_name, population))
+
+    # Cases by 100.000 hab. and mortality rate
+    known = np.where(population > 0, population, np.nan)[:, None]
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        confirmed_by100000pop = confirmed*100000/known
+        columns += [('confirmed_by100000pop', confirmed_by100000pop),
+                    ('deaths_by100000pop', deaths*100000/known),
+                    ('MortalityRate', deaths/confirmed)]
+    # New cases by population
+    columns.append(('confirmed_newcases_by100000pop', diff(confirmed_by100000pop)))
+
+    # New cases centered moving average
+    columns += [(c+'_movavg', window_mean(v, window = windows['newcases'], center = True, edge = 'nan'))
+                for c, v in columns if c in AVERAGED]
+    return columns
+
+
+def reach(windows = WINDOWS):
+    """(before, after): how many days of counts before a date and after it
+    the derived columns of that date read."""
+    growth_days = window_offsets(windows['growth'])
+    newcases_days = window_offsets(windows['newcases'])
+    # A growth ratio reads 2 days of new cases, i.e. 3 days of counts; new
+    # cases read 2 days of counts
+    before = max(2 - growth_days[0], 1 - newcases_days[0])
+    after = max(growth_days[-1], newcases_days[-1])
+    return before, after
@@ -0,0 +1,109 @@
+# Download the JHU CSSE time series through a local on-disk cache
+#
+# Every file is stored next to a small JSON file with its ETag/Last-Modified
+# headers. Later runs send a conditional request and only download the file
+# again when it changed upstream (HTTP 304 otherwise). In offline mode only
+# the cache is read.
+
+import json
+import os
+import urllib.error
+import urllib.request
+import warnings
+
+from .ingest import read_wide
+
+
+JHU_BASE_URL = ('https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/'
+                'csse_covid_19_data/csse_covid_19_time_series/')
+
+
+class CacheMiss(Exception):
+    """Raised in offline mode when a file has never been downloaded."""
+
+
+def _meta_path(path):
+    return path + '.meta.json'
+
+
+def _read_meta(path):
+    try:
+        with open(_meta_path(path)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def _write_atomic(path, data, mode = 'wb'):
+    tmp = path + '.tmp'
+    with open(tmp, mode) as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def fetch(url, cache_dir, offline = False, timeout = 60):
+    """Return the local path of `url` inside `cache_dir`, downloading it
+    only when it is missing or changed upstream.
+
+    offline -- never touch the network, raise CacheMiss if not cached
+    timeout -- seconds to wait for the server; if the request fails and a
+               cached copy exists, the cached copy is used (with a warning)
+    """
+    path = os.path.join(cache_dir, url.rstrip('/').split('/')[-1])
+    cached = os.path.exists(path)
+
+    if offline:
+        if not cached:
+            raise CacheMiss('{} is not in the cache ({})'.format(url, cache_dir))
+        return path
+
+    meta = _read_meta(path) if cached else {}
+    request = urllib.request.Request(url)
+    if meta.get('etag'):
+        request.add_header('If-None-Match', meta['etag'])
+    if meta.get('last_modified'):
+        request.add_header('If-Modified-Since', meta['last_modified'])
+
+    try:
+        response = urllib.request.urlopen(request, timeout = timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cached:
+            return path
+        if not cached:
+            raise
+        warnings.warn('Using cached {} ({})'.format(url, e))
+        return path
+    except (urllib.error.URLError, OSError) as e:
+        if not cached:
+            raise
+        warnings.warn('Using cached {} ({})'.format(url, e))
+        return path
+
+    with response:
+        data = response.read()
+        headers = response.headers
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    _write_atomic(path, data)
+    _write_atomic(_meta_path(path),
+                  json.dumps({'url': url,
+                              'etag': headers.get('ETag'),
+                              'last_modified': headers.get('Last-Modified'),
+                             }),
+                  mode = 'w')
+    return path
+
+
+def read_jhu(name, cache_dir, base_url = JHU_BASE_URL, offline = False,
+             columns = None, dates = None, engine = None):
+    """Read one JHU time series file (e.g. 'confirmed_global') through the
+    cache, with declared dtypes (see ingest.py).
+
+    columns -- key columns to keep (default: all of them)
+    dates   -- (first, last) dates to keep, both included (default: all)
+    engine  -- pd.read_csv engine (default: pyarrow if available)
+    """
+    url = base_url + 'time_series_covid19_{}.csv'.format(name)
+    return read_wide(fetch(url, cache_dir, offline = offline),
+                     columns = columns, dates = dates, engine = engine)
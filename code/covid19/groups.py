@@ -0,0 +1,49 @@
+# Per-country access to the long table
+#
+# Selecting a country with df[df['Country/Region'] == c] compares every row
+# of the table, for every country and every chart. GroupIndex sorts the table
+# by country once (stable, so rows keep their order within a country) and
+# keeps the start/stop offsets of each country, so a country's rows are a
+# slice of the sorted table.
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+
+class GroupIndex(object):
+    """Rows of each group of a table as contiguous slices.
+
+    index[c] returns the same rows (and index labels) as df[df[by] == c],
+    in the same order, or an empty frame for an unknown group.
+    """
+
+    def __init__(self, df, by = 'Country/Region'):
+        codes, keys = pd.factorize(df[by])
+        sorter = np.argsort(codes, kind = 'mergesort')
+        self.by = by
+        self.table = df.take(sorter)
+        # Rows without a group (code -1) sort first and are never returned
+        missing = np.count_nonzero(codes < 0)
+        counts = np.bincount(codes[codes >= 0], minlength = len(keys))
+        bounds = missing + np.concatenate([[0], np.cumsum(counts)])
+        self.slices = {k: (bounds[j], bounds[j + 1]) for j, k in enumerate(keys)}
+
+    def __getitem__(self, key):
+        start, stop = self.slices.get(key, (0, 0))
+        return self.table.iloc[start:stop]
+
+    def __contains__(self, key):
+        return key in self.slices
+
+    def __iter__(self):
+        return iter(self.slices)
+
+    def __len__(self):
+        return len(self.slices)
+
+    def cache_key(self):
+        # For the pipeline memoization: the index is defined by its table
+        hashed = pd.util.hash_pandas_object(self.table, index = True).values
+        return hashlib.sha1(self.by.encode('utf-8') + hashed.tobytes()).hexdigest()
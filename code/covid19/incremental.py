@@ -0,0 +1,156 @@
+# Incremental daily update of the long table
+#
+# JHU appends one date column a day. Instead of rebuilding every derived
+# column for the whole history, an update narrows the wide tables to the new
+# dates plus the few trailing days the derived columns depend on, runs the
+# usual steps on that narrow table and splices the result into the table
+# saved by the previous run (see store.py).
+#
+# The previous history must be unchanged upstream: a fingerprint of the raw
+# values of every processed date is saved with the table, and any difference
+# (revised counts, new rows) falls back to a full rebuild. So must the way
+# the table is derived: the signature of the code and parameters (centroids,
+# population, milestones, ...) is saved too, and any change rebuilds in full.
+
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from .derivation import WINDOWS, reach
+from .panel import milestone_names
+from .reshape import DATE_FORMAT, date_columns
+from .store import load_table, save_table
+
+
+def fingerprint(df, dates):
+    """Hash of the key columns and the values of the given date columns of a
+    wide table."""
+    id_cols, _, _ = date_columns(df)
+    hashed = pd.util.hash_pandas_object(df[id_cols + list(dates)], index = False)
+    return hashlib.sha1(hashed.values.tobytes()).hexdigest()
+
+
+def _paths(state_dir, name):
+    base = os.path.join(state_dir, name)
+    return base + '.parquet', base + '.state.json'
+
+
+class UpdatePlan(object):
+    """What a run has to compute: 'full' (everything) or 'incremental' (only
+    `dates`, the trailing window of the previous run plus the new dates)."""
+
+    def __init__(self, mode, dates, previous = None, start = None, reason = '', state = '', config = None):
+        self.mode = mode
+        self.dates = dates
+        self.previous = previous
+        self.start = start
+        self.reason = reason
+        self.state = state
+        self.config = config
+
+    def cache_key(self):
+        # The plan is fully described by the dates it covers, the saved state
+        # of the previous run and the signature of the derivation (for the
+        # pipeline memoization)
+        return repr((self.mode, self.dates, str(self.start), self.state, self.config))
+
+    def narrow(self, df):
+        """Keep only the key columns and the date columns this run needs."""
+        if self.mode == 'full':
+            return df
+        id_cols, _, _ = date_columns(df)
+        return df[id_cols + self.dates]
+
+    def combine(self, df_merged, thresholds, by = 'Country/Region', order = 'dt'):
+        """Splice the rows computed on the narrow tables (from `start` on)
+        into the previous table and fix the milestone columns, whose first
+        dates depend on the whole history.
+
+        thresholds -- the milestones, as passed to Panel.add_milestones()
+        """
+        if self.mode == 'full':
+            return df_merged
+
+        prev = self.previous
+        if list(df_merged.columns) != list(prev.columns):
+            raise ValueError('the columns changed since the previous run ({} now, {} saved); '
+                             'rebuild in full'.format(list(df_merged.columns), list(prev.columns)))
+        old = prev[prev[order] < self.start]
+        new = df_merged[df_merged[order] >= self.start]
+        df = pd.concat([old, new[prev.columns]], ignore_index = True)
+        df.sort_values(by = [by, order], inplace = True)
+        df.reset_index(drop = True, inplace = True)
+
+        # Milestones reached before, as saved; others as found in the new days
+        codes, countries = pd.factorize(df[by])
+        for first_name, days_name in map(milestone_names, thresholds):
+            first = prev.groupby(by = by)[first_name].first()
+            first = first.reindex(countries).fillna(
+                df_merged.groupby(by = by)[first_name].first().reindex(countries))
+            df[first_name] = first.values[codes]
+            df[days_name] = (df[order] - df[first_name]).dt.days
+        return df
+
+
+def plan_update(state_dir, tables, incremental = True, config = None, name = 'df_merged',
+                windows = WINDOWS):
+    """Decide how to process the wide `tables` ({metric: DataFrame}) given
+    what the previous run saved in `state_dir`.
+
+    config  -- signature of the derivation (see Pipeline.signature); the
+               previous table is only reused when it was saved with the same
+    windows -- the moving averages of the derivation (see derivation.py)
+    """
+    # Days of processed history whose derived values change when days are
+    # appended (the days after a date its centered windows read), and days
+    # of raw history needed before those to recompute them
+    context_days, affected_days = reach(windows)
+    _, all_dates, _ = date_columns(next(iter(tables.values())))
+
+    def full(reason):
+        return UpdatePlan('full', all_dates, reason = reason, config = config)
+
+    if not incremental:
+        return full('incremental mode is off')
+    table_path, state_path = _paths(state_dir, name)
+    if not (os.path.exists(table_path) and os.path.exists(state_path)):
+        return full('no previous run')
+
+    with open(state_path) as f:
+        text = f.read()
+    state = json.loads(text)
+    if state.get('config') != config:
+        return full('code or parameters of the derivation changed')
+    if sorted(state['fingerprints']) != sorted(tables):
+        return full('other metrics')
+    done = state['dates']
+    if len(done) <= affected_days + context_days or all_dates[:len(done)] != done:
+        return full('dates changed upstream')
+    for metric, df in tables.items():
+        if state['fingerprints'].get(metric) != fingerprint(df, done):
+            return full('history of {} revised upstream'.format(metric))
+
+    first = len(done) - affected_days - context_days
+    start = pd.to_datetime(done[len(done) - affected_days], format = DATE_FORMAT)
+    return UpdatePlan('incremental', all_dates[first:],
+                      previous = load_table(table_path), start = start,
+                      reason = '{} new date(s)'.format(len(all_dates) - len(done)),
+                      state = hashlib.sha1(text.encode('utf-8')).hexdigest(), config = config)
+
+
+def save_update(state_dir, tables, df_merged, config = None, name = 'df_merged'):
+    """Save the table, the fingerprints of the processed dates and the
+    signature of the derivation for the next run. Returns the path of the
+    saved table."""
+    _, dates, _ = date_columns(next(iter(tables.values())))
+    table_path, state_path = _paths(state_dir, name)
+    save_table(df_merged, table_path)
+    state = {'dates': dates,
+             'fingerprints': {m: fingerprint(df, dates) for m, df in tables.items()},
+             'config': config,
+             'columns': list(df_merged.columns)}
+    with open(state_path, 'w') as f:
+        json.dump(state, f)
+    return table_path
@@ -0,0 +1,107 @@
+# Typed, column-pruned parsing of the wide JHU CSSE tables
+#
+# Left to itself pd.read_csv infers the type of every column, hundreds of
+# date columns included, one more each day. Here the header is read first,
+# the columns a run needs are picked (key columns, a range of dates) and
+# the rest of the file is parsed with declared dtypes only: strings for the
+# names, floats for the coordinates and integers for the counts. pyarrow's
+# CSV reader is used when installed, the C engine of pd.read_csv otherwise.
+# Both return an integer column as int64, or as float64 (NaN) when a cell is
+# empty.
+
+import numpy as np
+import pandas as pd
+
+from .reshape import DATE_FORMAT, date_columns
+
+
+# Key columns of the global and US files -> dtype; other key columns are
+# inferred
+KEY_DTYPES = {'Province/State': str,
+              'Country/Region': str,
+              'Lat': 'float64',
+              'Long': 'float64',
+              'UID': 'int64',
+              'iso2': str,
+              'iso3': str,
+              'code3': 'float64',
+              'FIPS': 'float64',
+              'Admin2': str,
+              'Province_State': str,
+              'Country_Region': str,
+              'Long_': 'float64',
+              'Combined_Key': str,
+              'Population': 'Int64',
+             }
+# The cumulative counts of every date column (nullable: a cell may be empty)
+COUNT_DTYPE = 'Int64'
+
+# Tried in this order: pyarrow.csv (multithreaded, typed while parsing) or
+# the C engine of pd.read_csv
+ENGINES = ('pyarrow', 'c')
+
+
+def select_columns(header, columns = None, dates = None, date_format = DATE_FORMAT):
+    """Columns to read from a wide table with this header.
+
+    columns -- key columns to keep (default: all of them)
+    dates   -- (first, last) dates to keep, both included; either may be
+               None (default: all dates)
+    """
+    id_cols, date_cols, parsed = date_columns(pd.DataFrame(columns = header), date_format = date_format)
+    if columns is not None:
+        id_cols = [c for c in id_cols if c in columns]
+    if dates is not None:
+        first, last = dates
+        keep = np.ones(len(date_cols), dtype = bool)
+        if first is not None:
+            keep &= parsed >= pd.Timestamp(first)
+        if last is not None:
+            keep &= parsed <= pd.Timestamp(last)
+        date_cols = [c for c, k in zip(date_cols, keep) if k]
+    return id_cols, date_cols
+
+
+def read_wide(path, columns = None, dates = None, engine = None, date_format = DATE_FORMAT):
+    """Read a wide JHU table (one column per date) with declared dtypes,
+    keeping only the key columns in `columns` and the dates in `dates` (see
+    select_columns). The columns come out in the order of the file.
+
+    engine -- 'pyarrow' or 'c' (default: the first of ENGINES installed)
+    """
+    header = pd.read_csv(path, nrows = 0).columns.tolist()
+    id_cols, date_cols = select_columns(header, columns = columns, dates = dates, date_format = date_format)
+    dtype = {c: KEY_DTYPES[c] for c in id_cols if c in KEY_DTYPES}
+    dtype.update((c, COUNT_DTYPE) for c in date_cols)
+    usecols = [c for c in header if c in dtype or c in id_cols]
+
+    for e in ((engine,) if engine else ENGINES):
+        try:
+            df = _READERS[e](path, usecols, dtype)
+        except ImportError:
+            if engine or e == ENGINES[-1]:
+                raise
+            continue
+        return df[usecols]
+
+
+def _read_pyarrow(path, usecols, dtype):
+    import pyarrow as pa
+    import pyarrow.csv as csv
+    types = {c: pa.string() if t is str else pa.from_numpy_dtype(np.dtype(pd.api.types.pandas_dtype(t).type)) 
+             for c, t in dtype.items()}
+    options = csv.ConvertOptions(column_types = types, include_columns = usecols,
+                                 strings_can_be_null = True)
+    return csv.read_csv(path, convert_options = options).to_pandas()
+
+
+def _read_c(path, usecols, dtype):
+    df = pd.read_csv(path, usecols = usecols, dtype = dtype, engine = 'c')
+    # Nullable integers as pyarrow returns them
+    for c in df.columns:
+        if pd.api.types.is_extension_array_dtype(df[c]) and pd.api.types.is_integer_dtype(df[c]):
+            df[c] = df[c].astype('float64' if df[c].isna().any() else 'int64')
+    return df
+
+
+_READERS = {'pyarrow': _read_pyarrow, 'c': _read_c}
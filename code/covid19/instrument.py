@@ -0,0 +1,101 @@
+# Measures of the stages for the run report
+#
+# Every stage is wrapped in a Probe: wall and CPU seconds (a download waits,
+# a .loc loop burns CPU), the peak resident memory of the process after the
+# stage and how much the stage raised it, and the rows of its output. One
+# stage can also be run under a profiler (cProfile, or pyinstrument when
+# installed) to see where its time goes.
+
+import cProfile
+import os
+import sys
+import time
+
+import pandas as pd
+
+from .panel import Panel
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+PROFILERS = ('cprofile', 'pyinstrument')
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, in MB (None where the
+    platform does not tell)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kB elsewhere
+    return peak/1e6 if sys.platform == 'darwin' else peak/1e3
+
+
+def rows(output):
+    """Rows of a table output (of its long table for a panel), None for
+    other outputs."""
+    if isinstance(output, (pd.DataFrame, pd.Series, Panel)):
+        return len(output)
+    return None
+
+
+class Probe(object):
+    """Measures from its creation to stop()."""
+
+    def __init__(self):
+        self.wall = time.time()
+        self.cpu = time.process_time()
+        self.rss = peak_rss_mb()
+
+    def stop(self, output = None):
+        rss = peak_rss_mb()
+        return {'seconds': time.time() - self.wall,
+                'cpu_seconds': time.process_time() - self.cpu,
+                'peak_rss_mb': rss,
+                'rss_growth_mb': rss - self.rss if rss is not None else None,
+                'rows': rows(output),
+               }
+
+
+class Profile(object):
+    """Run one stage under a profiler and save what it found.
+
+    stage -- name of the stage
+    path  -- file to write, without extension: <path>.prof (cProfile stats,
+             e.g. for snakeviz or pstats) or <path>.html (pyinstrument)
+    tool  -- one of PROFILERS
+    """
+
+    def __init__(self, stage, path, tool = 'cprofile'):
+        if tool not in PROFILERS:
+            raise ValueError('tool must be one of {}'.format(PROFILERS))
+        self.stage = stage
+        self.tool = tool
+        self.path = path + ('.prof' if tool == 'cprofile' else '.html')
+
+    def call(self, func, args, kwargs):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        if self.tool == 'cprofile':
+            profiler = cProfile.Profile()
+            try:
+                return profiler.runcall(func, *args, **kwargs)
+            finally:
+                profiler.dump_stats(self.path)
+
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.stop()
+            with open(self.path, 'w') as f:
+                f.write(profiler.output_html())
+
+    def describe(self):
+        return {'stage': self.stage, 'tool': self.tool, 'path': self.path}
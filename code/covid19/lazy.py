@@ -0,0 +1,202 @@
+# Lazy (Polars) backend for the derivation of the long table
+#
+# The same steps as the pandas stages of the notebook (reshape, province
+# rollup, milestones, daily changes, growth, population, moving averages),
+# written as one Polars query plan: nothing runs until collect(), which lets
+# Polars prune the unused columns, fuse the per-country window expressions
+# and run them on all cores. Per-country expressions are evaluated over the
+# country (.over(by)) on rows sorted by country and date, so ordered() must
+# come before them.
+#
+# Polars is an optional dependency (1.21 or later, for unpivot and
+# nulls_equal; see covid19.yml); it is only imported by the functions of this
+# module. compare() checks a table derived here against the pandas one.
+
+import numpy as np
+import pandas as pd
+
+from .panel import COMPARISONS, EDGE_POLICIES, ZERO_POLICIES, milestone_names, window_offsets
+from .reshape import DATE_FORMAT, date_columns, warn_unlisted
+
+
+# Oldest Polars with the API used here
+POLARS_VERSION = (1, 21)
+
+
+def _polars():
+    try:
+        import polars
+    except ImportError:
+        raise ImportError("the lazy backend needs Polars (pip install 'polars>=1.21')")
+    if tuple(int(v) for v in polars.__version__.split('.')[:2]) < POLARS_VERSION:
+        raise ImportError('the lazy backend needs Polars 1.21 or later, not {}'.format(polars.__version__))
+    return polars
+
+
+def long_frame(tables, metrics, keys = ('Province/State', 'Country/Region'),
+               date_format = DATE_FORMAT):
+    """LazyFrame of several wide tables ({metric: table}): the key columns
+    of the first metric's table, 'dt' and one column per metric, in the
+    order of `metrics`. The other tables are joined on `keys` and the date
+    (a place or date missing from one of them gets null)."""
+    pl = _polars()
+    keys = list(keys)
+    id_cols = date_columns(tables[metrics[0]], date_format = date_format)[0]
+    lf = None
+    for m in metrics:
+        index = id_cols if lf is None else keys
+        _, date_cols, dates = date_columns(tables[m], date_format = date_format)
+        # Date headers ('1/22/20') to dates through a small lookup table
+        header = pl.DataFrame({'header': date_cols, 'dt': pl.Series(dates)}).lazy()
+        long = (pl.from_pandas(tables[m][index + date_cols]).lazy()
+                  .unpivot(on = date_cols, index = index, variable_name = 'header', value_name = m)
+                  .join(header, on = 'header', how = 'left')
+                  .drop('header'))
+        if lf is None:
+            lf = long
+        else:
+            lf = lf.join(long, on = keys + ['dt'], how = 'left', nulls_equal = True)
+    return lf.select(id_cols + ['dt'] + list(metrics))
+
+
+def rollup(lf, centroids, columns, by = 'Country/Region', order = 'dt',
+           province = 'Province/State'):
+    """rollup_provinces() as a query: the provinces of every country listed
+    in `centroids` summed into one row per date, with the centroid's Lat
+    and Long and a null province; `columns` are the columns to sum (null
+    when all the provinces are null). The other countries with several rows
+    per date are rolled up at the mean Lat/Long of their rows (collected
+    here, to warn about them)."""
+    pl = _polars()
+    listed = pl.col(by).is_in(pl.Series(centroids[by].tolist(), dtype = pl.String).implode())
+    several = (lf.filter(~listed)
+                 .group_by([by, order]).agg(pl.len())
+                 .filter(pl.col('len') > 1)
+                 .select(by).unique())
+    extra = (lf.join(several, on = by, how = 'semi')
+               .group_by(by).agg([pl.col('Lat').mean(), pl.col('Long').mean()])
+               .sort(by).collect().to_pandas())
+    if len(extra):
+        warn_unlisted(extra[by].tolist())
+        centroids = pd.concat([centroids[[by, 'Lat', 'Long']], extra], ignore_index = True)
+        listed = pl.col(by).is_in(pl.Series(centroids[by].tolist(), dtype = pl.String).implode())
+    coordinates = pl.from_pandas(centroids[[by, 'Lat', 'Long']]).lazy()
+    agg = (lf.filter(listed)
+             .group_by([by, order])
+             .agg([pl.when(pl.col(c).count() > 0).then(pl.col(c).sum()).alias(c) for c in columns])
+             .join(coordinates, on = by, how = 'left')
+             .with_columns(pl.lit(None, dtype = pl.String).alias(province)))
+    return pl.concat([lf.filter(~listed), agg], how = 'diagonal_relaxed')
+
+
+def ordered(lf, by = 'Country/Region', order = 'dt'):
+    """Rows sorted by country and date, as the per-country expressions
+    below expect."""
+    return lf.sort([by, order])
+
+
+def milestones(thresholds, overrides = None, by = 'Country/Region', order = 'dt'):
+    """Expressions of the milestone columns, as Panel.add_milestones() adds them: the
+    first date every country reaches each (column, threshold) and the days
+    since then."""
+    pl = _polars()
+    exprs = []
+    for t in thresholds:
+        first_name, days_name = milestone_names(t)
+        first = pl.col(order).filter(_reached(pl.col(t[0]), t[1])).min().over(by)
+        for country, date in (overrides or {}).get(first_name, {}).items():
+            date = pl.lit(pd.to_datetime(date).to_datetime64())
+            first = pl.when(pl.col(by) == country).then(date).otherwise(first)
+        exprs.append(first.alias(first_name))
+        exprs.append((pl.col(order) - first).dt.total_days().cast(pl.Float64).alias(days_name))
+    return exprs
+
+
+def _reached(column, threshold):
+    # panel.reached() as an expression (null reaches nothing)
+    op, value = threshold if isinstance(threshold, (tuple, list)) else ('>=', threshold)
+    if op not in COMPARISONS:
+        raise ValueError('a milestone comparison must be one of {}'.format(sorted(COMPARISONS)))
+    return {'>=': column >= value, '>': column > value, '!=': column != value}[op]
+
+
+def diff(column, by = 'Country/Region'):
+    """Change from the day before (null on the first day)."""
+    pl = _polars()
+    return pl.col(column).cast(pl.Float64).diff().over(by)
+
+
+def growth(column, on_zero = 'nan', clip = None, by = 'Country/Region'):
+    """Ratio to the day before; see panel.growth() for on_zero and clip."""
+    if on_zero not in ZERO_POLICIES:
+        raise ValueError('on_zero must be one of {}'.format(ZERO_POLICIES))
+    pl = _polars()
+    x = pl.col(column).cast(pl.Float64)
+    prev = x.shift(1).over(by)
+    ratio = x/prev
+    if on_zero == 'nan':
+        ratio = pl.when(prev == 0).then(float('nan')).otherwise(ratio)
+    if clip is not None:
+        ratio = ratio.clip(clip[0], clip[1])
+    return ratio
+
+
+def window_mean(column, window = 3, center = True, edge = 'nan', by = 'Country/Region'):
+    """`window`-day moving average; see panel.window_mean() for center and edge.
+    The days are added in the same order as the pandas and panel versions,
+    so the results are the same to the last bit."""
+    if edge not in EDGE_POLICIES:
+        raise ValueError('edge must be one of {}'.format(EDGE_POLICIES))
+    pl = _polars()
+    x = pl.col(column).cast(pl.Float64)
+    total, count = pl.lit(0.0), pl.lit(0)
+    for k in window_offsets(window, center = center):
+        v = x.shift(-k).over(by)
+        if edge == 'nan':
+            total = total + v
+        else:
+            v = v.fill_nan(None)
+            total = total + v.fill_null(0.0)
+            count = count + v.is_not_null().cast(pl.Int64)
+    if edge == 'nan':
+        return total/window
+    return pl.when(count > 0).then(total/count).otherwise(float('nan'))
+
+
+def attributes(lf, country_dim, columns, by = 'Country/Region'):
+    """Add the country attributes in `columns` (e.g. population) from a
+    CountryDimension, null for countries it does not know."""
+    pl = _polars()
+    names = country_dim.positions.index
+    values, _ = country_dim.take(names, columns)
+    table = pl.DataFrame(dict([(by, pl.Series(names.tolist(), dtype = pl.String))] +
+                              [(c, pl.Series(values[c])) for c in columns]))
+    return lf.join(table.lazy(), on = by, how = 'left', maintain_order = 'left')
+
+
+def collect(lf):
+    """Run the query; return the pandas table (NaN and NaT for nulls)."""
+    return lf.collect().to_pandas()
+
+
+def compare(a, b, rtol = 1e-12):
+    """Differences between two long tables (rows in the same order): a list
+    of messages, empty when they match."""
+    if list(a.columns) != list(b.columns):
+        return ['columns {} != {}'.format(list(a.columns), list(b.columns))]
+    if len(a) != len(b):
+        return ['{} rows != {}'.format(len(a), len(b))]
+    problems = []
+    for c in a.columns:
+        x, y = a[c], b[c]
+        if x.dtype != y.dtype:
+            problems.append('{}: dtype {} != {}'.format(c, x.dtype, y.dtype))
+        if x.dtype.kind in 'iufb' and y.dtype.kind in 'iufb':
+            x, y = x.values.astype(float), y.values.astype(float)
+            same = np.isclose(x, y, rtol = rtol, atol = 0, equal_nan = True) | (x == y)
+        else:
+            same = (x.values == y.values) | (pd.isna(x).values & pd.isna(y).values)
+        if not same.all():
+            problems.append('{}: {} rows differ, first at row {}'.format(c, int((~same).sum()),
+                                                                          int(np.flatnonzero(~same)[0])))
+    return problems
@@ -0,0 +1,50 @@
+# HTML pages for the charts
+#
+# Every page loads the same plotly.js bundle: the one shipped with the
+# installed plotly package (pinned in covid19.yml), published next to the
+# charts under a name with its content hash. The browser can cache it for
+# good; a new plotly version gets a new name.
+
+import hashlib
+import os
+
+import plotly
+
+
+PAGE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+{title}<script src="{plotlyjs}"></script>
+</head>
+<body>
+{body}
+</body>
+</html>
+'''
+
+
+def publish_plotlyjs(directory):
+    """Write the plotly.js bundle to `directory` (unless already there) as
+    plotly-<hash>.min.js and return its path."""
+    source = plotly.offline.get_plotlyjs().encode('utf-8')
+    name = 'plotly-{}.min.js'.format(hashlib.sha1(source).hexdigest()[:12])
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(source)
+        os.replace(tmp, path)
+    return path
+
+
+def page(path, divs, plotlyjs, title = None):
+    """HTML page to be written at `path` with one or more chart divs (see
+    render.py), loading plotly.js once from the bundle at `plotlyjs`."""
+    if isinstance(divs, str):
+        divs = [divs]
+    src = os.path.relpath(plotlyjs, os.path.dirname(path) or '.').replace(os.sep, '/')
+    return PAGE.format(title = '<title>{}</title>\n'.format(title) if title else '',
+                       plotlyjs = src, body = '\n'.join(divs))
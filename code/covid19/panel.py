@@ -0,0 +1,273 @@
+# Dense country x day arrays
+#
+# The long table (one row per country and date) has to be sorted and grouped
+# by country before every per-country step (daily differences, windows,
+# growth). A Panel holds each metric as a 2-D array instead, one row per
+# country and one column per date, with the country and date labels shared
+# by all metrics; values that do not change with the date (coordinates,
+# population, milestone dates) are 1-D arrays, one value per country. Every
+# step is then an array operation along the date axis, and to_long() gives
+# back the long table, sorted by country and date.
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from .reshape import expand
+
+
+EDGE_POLICIES = ('nan', 'shrink')
+ZERO_POLICIES = ('nan', 'inf')
+# Comparisons a milestone can be reached by, as (operator, value); a plain
+# threshold means '>='
+COMPARISONS = {'>=': np.greater_equal, '>': np.greater, '!=': np.not_equal}
+
+
+class Panel(object):
+    """Metrics by entity (country, county, ...) and date.
+
+    panel[name] is a 2-D array (entities x dates) for a metric or a 1-D
+    array (entities) for an attribute; assigning one adds it, after the
+    existing columns of the long table.
+    """
+
+    def __init__(self, entities, dates, by = 'Country/Region', order = 'dt'):
+        self.entities = pd.Index(entities)
+        self.dates = pd.DatetimeIndex(dates)
+        self.by = by
+        self.order = order
+        self.values = {}
+        self.attributes = {}
+        self.columns = [by, order]
+        # Cells with a row in the long table (None: all of them)
+        self.present = None
+
+    @property
+    def shape(self):
+        return len(self.entities), len(self.dates)
+
+    @classmethod
+    def from_long(cls, df, by = 'Country/Region', order = 'dt', attributes = ('Lat', 'Long')):
+        """Panel of a long table with at most one row per entity and date.
+        The columns in `attributes` are taken as constant over the dates."""
+        codes, entities = pd.factorize(df[by], sort = True)
+        days, dates = pd.factorize(df[order], sort = True)
+        panel = cls(entities, dates, by = by, order = order)
+        n, m = panel.shape
+        cells = codes.astype(np.int64)*m + days
+        rows = np.bincount(cells, minlength = n*m)
+        if len(df) and rows.max() > 1:
+            several = entities[np.unique(np.nonzero(rows > 1)[0]//m)]
+            raise ValueError('several rows for the same {} and {} (roll them up first): {}'.format(
+                by, order, ', '.join(map(str, several))))
+        if len(df) < n*m:
+            panel.present = np.zeros(n*m, dtype = bool)
+            panel.present[cells] = True
+            panel.present = panel.present.reshape(n, m)
+
+        for c in df.columns:
+            if c in (by, order):
+                continue
+            v = df[c].values
+            if c in attributes:
+                a = np.empty(n, dtype = v.dtype)
+                a[codes] = v
+                panel.attributes[c] = a
+            else:
+                a = np.empty(n*m, dtype = v.dtype) if panel.present is None else np.full(n*m, np.nan)
+                a[cells] = v
+                panel.values[c] = a.reshape(n, m)
+        panel.columns = list(df.columns)
+        return panel
+
+    def to_long(self):
+        """The long table: one row per entity and date (the present ones),
+        sorted by entity and date, columns in the order they were added."""
+        n, m = self.shape
+        data = {self.by: expand(self.entities.values, m),
+                self.order: np.tile(self.dates.values, n)}
+        for c in self.columns:
+            if c in self.attributes:
+                data[c] = expand(self.attributes[c], m)
+            elif c in self.values:
+                data[c] = self.values[c].ravel()
+        df = pd.DataFrame(data, columns = self.columns)
+        if self.present is not None:
+            df = df[self.present.ravel()].reset_index(drop = True)
+        return df
+
+    def copy(self):
+        """A new panel with the same arrays (not copied), for adding columns."""
+        panel = Panel(self.entities, self.dates, by = self.by, order = self.order)
+        panel.values = dict(self.values)
+        panel.attributes = dict(self.attributes)
+        panel.columns = list(self.columns)
+        panel.present = self.present
+        return panel
+
+    def __getitem__(self, name):
+        if name in self.values:
+            return self.values[name]
+        return self.attributes[name]
+
+    def __setitem__(self, name, values):
+        values = np.asarray(values)
+        self.values.pop(name, None)
+        self.attributes.pop(name, None)
+        if values.shape == self.shape:
+            self.values[name] = values
+        elif values.shape == self.shape[:1]:
+            self.attributes[name] = values
+        else:
+            raise ValueError('{} has shape {}, not {} or {}'.format(name, values.shape, self.shape, self.shape[:1]))
+        if name not in self.columns:
+            self.columns.append(name)
+
+    def __len__(self):
+        # Rows of the long table
+        n, m = self.shape
+        return n*m if self.present is None else int(self.present.sum())
+
+    def __contains__(self, name):
+        return name in self.values or name in self.attributes
+
+    def add_milestones(self, thresholds, overrides = None):
+        """Add, for every (column, threshold) in `thresholds`, the first date
+        each entity reaches `column >= threshold` and the days since then.
+
+        thresholds -- list of (column, threshold, first_name, days_name); the
+                      names may be left out (see milestone_names). A
+                      threshold may also be a comparison (see reached), e.g.
+                      ('!=', 0) for the first nonzero count
+        overrides  -- {first_name: {entity: date}} for milestones reached
+                      before the data starts (e.g. the first case in China)
+
+        Entities that never reach a threshold get NaT / NaN.
+        """
+        for t in thresholds:
+            first_name, days_name = milestone_names(t)
+            first = first_reached(self[t[0]], t[1], self.dates)
+            for entity, date in (overrides or {}).get(first_name, {}).items():
+                if entity in self.entities:
+                    first[self.entities.get_loc(entity)] = pd.to_datetime(date)
+            self[first_name] = first
+            self[days_name] = days_since(first, self.dates)
+
+    def cache_key(self):
+        h = hashlib.sha1(repr((self.by, self.order, self.columns)).encode('utf-8'))
+        h.update(pd.util.hash_array(np.asarray(self.entities, dtype = object)).tobytes())
+        h.update(self.dates.asi8.tobytes())
+        for name in self.columns:
+            if name in self:
+                h.update(pd.util.hash_array(np.asarray(self[name]).ravel()).tobytes())
+        if self.present is not None:
+            h.update(self.present.tobytes())
+        return h.hexdigest()
+
+
+def milestone_names(t):
+    """(first_name, days_name) of a milestone given as (column, threshold)
+    or (column, threshold, first_name, days_name)."""
+    if len(t) > 2:
+        return t[2], t[3]
+    return 'first_{}{}'.format(t[1], t[0]), 'days_since_{}_{}'.format(t[1], t[0])
+
+
+def window_offsets(window, center = True):
+    """Date offsets covered by a window: centered (-1, 0, 1 for 3 days) or
+    trailing (-2, -1, 0 for 3 days)."""
+    if window < 1:
+        raise ValueError('window must be a positive number of days')
+    if center:
+        return list(range(-(window // 2), window - window // 2))
+    return list(range(-(window - 1), 1))
+
+
+def shift(x, k):
+    """x[:, t + k] at every date t (NaN outside the dates)."""
+    out = np.full(x.shape, np.nan)
+    m = x.shape[1]
+    if abs(k) < m:
+        if k >= 0:
+            out[:, :m - k] = x[:, k:]
+        else:
+            out[:, -k:] = x[:, :m + k]
+    return out
+
+
+def diff(x):
+    """Change from the day before (NaN on the first day)."""
+    return x - shift(x, -1)
+
+
+def growth(x, on_zero = 'nan', clip = None):
+    """Ratio to the day before (NaN on the first day and after a NaN).
+
+    on_zero -- result when the day before is 0:
+               'nan' leave it NaN (the original behaviour)
+               'inf' divide anyway (x/0 gives +/-inf, 0/0 gives NaN)
+    clip    -- optional (lower, upper) bounds applied to every ratio, e.g.
+               on_zero = 'inf' with clip = (0, 10) caps jumps from 0 at 10
+    """
+    if on_zero not in ZERO_POLICIES:
+        raise ValueError('on_zero must be one of {}'.format(ZERO_POLICIES))
+    prev = shift(x, -1)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        ratio = x/prev
+    if on_zero == 'nan':
+        ratio[prev == 0] = np.nan
+    if clip is not None:
+        ratio = np.clip(ratio, clip[0], clip[1])
+    return ratio
+
+
+def window_mean(x, window = 3, center = True, edge = 'nan'):
+    """`window`-day moving average.
+
+    center -- centered window (default) or trailing window ending on the day
+    edge   -- what to do when the window is not complete, i.e. at the first
+              and last dates or when a value in it is NaN:
+              'nan'    leave the result NaN (the original 3-day average)
+              'shrink' average the values that are available
+    """
+    if edge not in EDGE_POLICIES:
+        raise ValueError('edge must be one of {}'.format(EDGE_POLICIES))
+    total = np.zeros(x.shape)
+    count = np.zeros(x.shape)
+    for k in window_offsets(window, center = center):
+        v = shift(x, k)
+        if edge == 'nan':
+            total = total + v
+        else:
+            valid = ~np.isnan(v)
+            total = total + np.where(valid, v, 0)
+            count = count + valid
+    if edge == 'nan':
+        return total/window
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return np.where(count > 0, total/count, np.nan)
+
+
+def reached(x, threshold):
+    """Where x reaches `threshold`: x >= threshold, or the comparison given as
+    (operator, value) with an operator of COMPARISONS. NaN reaches nothing."""
+    op, value = threshold if isinstance(threshold, (tuple, list)) else ('>=', threshold)
+    if op not in COMPARISONS:
+        raise ValueError('a milestone comparison must be one of {}'.format(sorted(COMPARISONS)))
+    with np.errstate(invalid = 'ignore'):
+        return COMPARISONS[op](x, value) & ~np.isnan(x)
+
+
+def first_reached(x, threshold, dates):
+    """First date of every row reaching `threshold` (see reached; NaT if
+    never)."""
+    hit = reached(x, threshold)
+    first = np.asarray(dates.values)[hit.argmax(axis = 1)].copy()
+    first[~hit.any(axis = 1)] = np.datetime64('NaT')
+    return first
+
+
+def days_since(first, dates):
+    """Days from `first` (one date per row) to every date (NaN for NaT)."""
+    return (np.asarray(dates.values)[None, :] - first[:, None])/np.timedelta64(1, 'D')
@@ -0,0 +1,88 @@
+# Entity-partitioned execution of the per-entity work
+#
+# The per-entity steps on a Panel (daily changes, growth, moving averages,
+# milestones) only read the row of their own entity, so blocks of rows can be
+# computed side by side. map_rows() splits the rows into contiguous blocks and
+# runs them in a pool of forked workers, like the parallel stages of the
+# pipeline: the input arrays are inherited from the parent (their pages are
+# shared, nothing is pickled), and every worker writes its results into output
+# arrays in shared memory at the rows of its block, so the results are in
+# entity order without being sent back either.
+
+import mmap
+import multiprocessing
+import os
+
+import numpy as np
+
+
+# Below this many cells (entities x dates) forking costs more than it saves
+MIN_CELLS = 1000000
+
+
+def partitions(n, parts):
+    """(start, stop) of at most `parts` contiguous blocks of n rows, of
+    (nearly) equal size."""
+    bounds = np.linspace(0, n, max(min(parts, n), 1) + 1).round().astype(int)
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def shared_array(shape, dtype):
+    """Zeroed array in shared memory: writes of the processes forked after
+    its creation are seen by the parent."""
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+    # Anonymous maps are shared (MAP_SHARED) on Unix
+    buf = mmap.mmap(-1, max(count*dtype.itemsize, 1))
+    return np.frombuffer(buf, dtype = dtype, count = count).reshape(shape)
+
+
+def map_rows(func, arrays, processes = None, blocks = 4, min_cells = MIN_CELLS):
+    """Run func on blocks of rows and return its results for all rows.
+
+    func      -- function of {name: rows of the array}, returning a list of
+                 (name, array) pairs with one row per input row (numeric or
+                 datetime arrays); any function, it is not pickled
+    arrays    -- {name: array}, first axis = entities
+    processes -- workers (default: number of cores); 1 runs func on all the
+                 rows at once, as do tables under `min_cells` cells
+    blocks    -- blocks per worker (smaller blocks even out the load)
+
+    Return func's list of (name, array), rows in the order of `arrays`.
+    """
+    n = len(next(iter(arrays.values())))
+    cells = sum(int(np.prod(a.shape)) for a in arrays.values())
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes < 2 or n < 2 or cells < min_cells or 'fork' not in multiprocessing.get_all_start_methods():
+        return func(arrays)
+
+    # Names, shapes and types of the results, from the first row
+    sample = func(dict((k, v[:1]) for k, v in arrays.items()))
+    outputs = [(name, shared_array((n,) + np.shape(v)[1:], np.asarray(v).dtype)) for name, v in sample]
+
+    _shared['func'] = func
+    _shared['arrays'] = arrays
+    _shared['outputs'] = outputs
+    try:
+        parts = partitions(n, processes*blocks)
+        pool = multiprocessing.get_context('fork').Pool(min(processes, len(parts)))
+        try:
+            pool.map(_run_block, parts, chunksize = 1)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        _shared.clear()
+    return outputs
+
+
+# Function, inputs and outputs seen by the forked workers (set just before forking)
+_shared = {}
+
+
+def _run_block(part):
+    start, stop = part
+    result = _shared['func'](dict((k, v[start:stop]) for k, v in _shared['arrays'].items()))
+    for (name, out), (_, values) in zip(_shared['outputs'], result):
+        out[start:stop] = values
@@ -0,0 +1,346 @@
+# Stage runner with on-disk memoization
+#
+# The notebook is split into named stages. Each stage is a function of the
+# outputs of the stages it lists as inputs, plus fixed parameters. A stage's
+# cache key is a hash of its name, its code (including the module-level
+# constants it reads), its parameters and the content hashes of its inputs.
+# When the key matches the one stored on disk the cached output is used, so
+# only stages downstream of an actual change run again.
+#
+# Independent stages (the charts) can run in a pool of worker processes. The
+# workers are forked once their inputs are ready, so they read the prepared
+# data inherited from the parent instead of receiving a pickled copy.
+#
+# Every stage that runs is measured (see instrument.py); write_report() saves
+# the measures of the last run, with the files written, as JSON.
+
+import glob
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import pickle
+import time
+import types
+
+import numpy as np
+import pandas as pd
+
+from .instrument import Probe, Profile
+
+
+_CONSTANT_TYPES = (str, bytes, int, float, bool, type(None))
+
+
+def _sha1(*parts):
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(p if isinstance(p, bytes) else str(p).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def content_hash(obj):
+    """Hash of a stage output (DataFrames by value, containers recursively,
+    objects with a cache_key() method by that key, the rest pickled)."""
+    if hasattr(obj, 'cache_key'):
+        return _sha1(type(obj).__name__, obj.cache_key())
+    if isinstance(obj, pd.DataFrame):
+        values = pd.util.hash_pandas_object(obj, index = True).values
+        return _sha1('DataFrame', list(obj.columns), list(map(str, obj.dtypes)), values.tobytes())
+    if isinstance(obj, pd.Series):
+        values = pd.util.hash_pandas_object(obj, index = True).values
+        return _sha1('Series', obj.name, str(obj.dtype), values.tobytes())
+    if isinstance(obj, np.ndarray):
+        return _sha1('ndarray', obj.dtype, obj.shape, np.ascontiguousarray(obj).tobytes())
+    if isinstance(obj, dict):
+        return _sha1('dict', *[_sha1(k, content_hash(v)) for k, v in sorted(obj.items(), key = lambda kv: str(kv[0]))])
+    if isinstance(obj, (list, tuple)):
+        return _sha1(type(obj).__name__, *[content_hash(v) for v in obj])
+    if isinstance(obj, _CONSTANT_TYPES):
+        return _sha1(type(obj).__name__, repr(obj))
+    return _sha1('pickle', pickle.dumps(obj, protocol = 2))
+
+
+def _is_constant(value):
+    if isinstance(value, _CONSTANT_TYPES):
+        return True
+    if isinstance(value, (list, tuple)):
+        return all(_is_constant(v) for v in value)
+    if isinstance(value, dict):
+        return all(_is_constant(k) and _is_constant(v) for k, v in value.items())
+    return False
+
+
+def _global_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _global_names(const)
+    return names
+
+
+def code_hash(func):
+    """Hash of a function's source and of the module-level constants it
+    reads (plotting colors, sizes, ...), so editing either invalidates the
+    stage."""
+    try:
+        source = inspect.getsource(func)
+    except (IOError, OSError, TypeError):
+        source = func.__code__.co_code
+    constants = []
+    for name in sorted(_global_names(func.__code__)):
+        if name in func.__globals__ and _is_constant(func.__globals__[name]):
+            constants.append((name, repr(func.__globals__[name])))
+    return _sha1(source, constants)
+
+
+def package_hash():
+    """Hash of the covid19 package sources; part of every stage key, so a
+    change in a helper invalidates the stages that may use it."""
+    files = sorted(glob.glob(os.path.join(os.path.dirname(__file__), '*.py')))
+    parts = []
+    for path in files:
+        with open(path, 'rb') as f:
+            parts.append(f.read())
+    return _sha1(*parts)
+
+
+class Stage(object):
+
+    def __init__(self, name, func, inputs = (), params = None, cache = True):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = dict(params or {})
+        self.cache = cache
+
+
+class Pipeline(object):
+    """A DAG of named stages.
+
+    cache_dir -- where stage outputs are memoized (None disables the cache)
+    """
+
+    def __init__(self, cache_dir = None):
+        self.cache_dir = cache_dir
+        self.stages = {}
+        self.salt = package_hash()
+        self.ran = []
+        self.timings = {}
+        self.summary = {}
+        self.profiling = None
+
+    def add(self, name, func, inputs = (), params = None, cache = True):
+        # A stage defined again (a notebook cell run again) replaces the
+        # previous definition; its cache key follows the new code
+        self.stages[name] = Stage(name, func, inputs, params, cache)
+        return func
+
+    def stage(self, name, inputs = (), params = None, cache = True):
+        """Decorator form of add(). Stages with cache = False always run
+        (e.g. downloads, timestamps); their output is still hashed so the
+        stages after them are reused when it did not change."""
+        def register(func):
+            return self.add(name, func, inputs, params, cache)
+        return register
+
+    def order(self, targets = None, given = ()):
+        """Stages needed for `targets` (default: all), inputs first."""
+        if targets is None:
+            targets = sorted(self.stages)
+        done, ordered, visiting = set(given), [], set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name not in self.stages:
+                raise KeyError('unknown stage {!r}'.format(name))
+            if name in visiting:
+                raise ValueError('stage {!r} depends on itself'.format(name))
+            visiting.add(name)
+            for i in self.stages[name].inputs:
+                visit(i)
+            visiting.discard(name)
+            done.add(name)
+            ordered.append(name)
+
+        for t in targets:
+            visit(t)
+        return ordered
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name + '.pkl')
+
+    def _load(self, name, key):
+        if self.cache_dir is None or not os.path.exists(self._path(name)):
+            return None
+        with open(self._path(name), 'rb') as f:
+            entry = pickle.load(f)
+        return entry if entry['key'] == key else None
+
+    def _save(self, name, key, digest, output):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        tmp = self._path(name) + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump({'key': key, 'hash': digest, 'output': output}, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(name))
+
+    def profile(self, stage, path, tool = 'cprofile'):
+        """Run `stage` under a profiler in the next runs (never from the
+        cache, never in a worker) and save the profile at `path` (see
+        instrument.Profile). None stops profiling."""
+        self.profiling = Profile(stage, path, tool) if stage else None
+
+    def signature(self, targets, given = ()):
+        """Hash of the code and parameters of the stages needed for `targets`
+        (and of the covid19 package), not of the data they read: it changes
+        when the way the outputs are computed does."""
+        parts = []
+        for name in self.order(targets, given):
+            s = self.stages[name]
+            parts.append(_sha1(name, code_hash(s.func), content_hash(s.params)))
+        return _sha1(self.salt, *parts)
+
+    def key(self, name, hashes):
+        s = self.stages[name]
+        return _sha1(self.salt, name, code_hash(s.func), content_hash(s.params),
+                     *[hashes[i] for i in s.inputs])
+
+    def run(self, targets = None, given = None, parallel = (), processes = None):
+        """Run the stages needed for `targets` and return {name: output}.
+
+        given     -- {name: output} used instead of running those stages (and
+                     the stages only they depend on), e.g. a table loaded from disk
+        parallel  -- stages that may run in worker processes, side by side with
+                     the other parallel stages whose inputs are ready
+        processes -- size of the worker pool (default: number of cores)
+        """
+        probe = Probe()
+        given = dict(given or {})
+        outputs = dict(given)
+        hashes = {name: content_hash(value) for name, value in given.items()}
+        self.ran = []
+        self.timings = {}
+        profiled = self.profiling.stage if self.profiling is not None else None
+        parallel = set(parallel) - set([profiled])
+        if processes is None:
+            processes = os.cpu_count() or 1
+        pending = []
+
+        def finish(name, key, output, measures):
+            digest = content_hash(output)
+            if self.stages[name].cache and self.cache_dir is not None:
+                self._save(name, key, digest, output)
+            outputs[name] = output
+            hashes[name] = digest
+            self.ran.append(name)
+            self.timings[name] = dict(measures, cached = False)
+
+        def flush():
+            for name, key, output, measures in self._run_pool(pending, outputs, processes):
+                finish(name, key, output, measures)
+            del pending[:]
+
+        for name in self.order(targets, given):
+            s = self.stages[name]
+            if any(i == p[0] for i in s.inputs for p in pending):
+                flush()
+            key = self.key(name, hashes)
+            entry = self._load(name, key) if s.cache and name != profiled else None
+            if entry is not None:
+                outputs[name] = entry['output']
+                hashes[name] = entry['hash']
+                self.timings[name] = {'seconds': 0.0, 'cached': True}
+            elif name in parallel:
+                pending.append((name, key))
+            else:
+                profiling = self.profiling if name == profiled else None
+                finish(name, key, *_run_stage(s, outputs, profiling))
+        flush()
+
+        self.summary = probe.stop()
+        self.summary.update(started = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(probe.wall)),
+                            processes = processes,
+                            profile = self.profiling.describe() if profiled in self.timings else None)
+        del self.summary['rows']
+        return outputs
+
+    def _run_pool(self, pending, outputs, processes):
+        # Yields (name, key, output, measures) for the pending stages
+        if not pending:
+            return
+        if processes < 2 or len(pending) < 2 or 'fork' not in multiprocessing.get_all_start_methods():
+            for name, key in pending:
+                yield (name, key) + _run_stage(self.stages[name], outputs)
+            return
+        _shared['stages'] = self.stages
+        _shared['outputs'] = outputs
+        try:
+            pool = multiprocessing.get_context('fork').Pool(min(processes, len(pending)))
+            try:
+                results = pool.map(_run_shared, [name for name, _ in pending], chunksize = 1)
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            _shared.clear()
+        for (name, key), result in zip(pending, results):
+            yield (name, key) + result
+
+    def write_report(self, path, files = None):
+        """Write the report of the last run as JSON: the measures of every
+        stage (see instrument.Probe) or whether it came from the cache, the
+        files each stage wrote ({name: {path: measures}} as returned by
+        write_files) and the totals of the run."""
+        stages = {}
+        for name, timing in self.timings.items():
+            stages[name] = dict(timing)
+            if files is not None and name in files:
+                stages[name]['files'] = files[name]
+        report = dict(self.summary, stages = stages)
+        if files is not None:
+            written = [m for f in files.values() for m in f.values()]
+            report['files'] = {'count': len(written),
+                               'bytes': sum(m['bytes'] for m in written),
+                               'seconds': sum(m['seconds'] for m in written)}
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent = 1, sort_keys = True)
+
+
+# Stages and inputs seen by the forked workers (set just before forking)
+_shared = {}
+
+
+def _run_stage(s, outputs, profiling = None):
+    probe = Probe()
+    args = [outputs[i] for i in s.inputs]
+    if profiling is None:
+        output = s.func(*args, **s.params)
+    else:
+        output = profiling.call(s.func, args, s.params)
+    return output, probe.stop(output)
+
+
+def _run_shared(name):
+    return _run_stage(_shared['stages'][name], _shared['outputs'])
+
+
+def write_files(files):
+    """Write {path: text} as returned by the chart stages and return {path:
+    {'bytes': size, 'seconds': time to write}}."""
+    written = {}
+    for path, text in sorted(files.items()):
+        start = time.time()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path, 'w') as f:
+            f.write(text)
+        written[path] = {'bytes': os.path.getsize(path), 'seconds': time.time() - start}
+    return written
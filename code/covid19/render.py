@@ -0,0 +1,88 @@
+# Render one chart at several sizes
+#
+# The 720px and 320/360px versions of a chart show the same traces with a
+# different layout (size, margins, fonts), sometimes with a few traces left
+# out or restyled. The traces are built and serialized to JSON once; each
+# variant only serializes its layout and the trace properties it changes.
+
+import json
+import uuid
+
+import numpy as np
+import plotly
+
+
+def to_json(obj):
+    return json.dumps(obj, cls = plotly.utils.PlotlyJSONEncoder)
+
+
+def _short_floats(value):
+    # float32 values would be written with the digits of their float64
+    # equivalent (0.1 -> 0.10000000149011612); go through their shortest repr
+    if isinstance(value, np.ndarray) and value.dtype == np.float32:
+        return value.astype(str).astype(np.float64)
+    if isinstance(value, dict):
+        return {k: _short_floats(v) for k, v in value.items()}
+    return value
+
+
+def _plain(trace):
+    trace = trace.to_plotly_json() if hasattr(trace, 'to_plotly_json') else dict(trace)
+    return _short_floats(trace)
+
+
+def _merge(a, b):
+    # Nested dict update, b wins
+    merged = dict(a)
+    for k, v in b.items():
+        if isinstance(v, dict) and isinstance(a.get(k), dict):
+            merged[k] = _merge(a[k], v)
+        else:
+            merged[k] = v
+    return merged
+
+
+def _join(head, body):
+    # Two serialized JSON objects with distinct keys as one
+    if head == '{}':
+        return body
+    if body == '{}':
+        return head
+    return head[:-1] + ', ' + body[1:]
+
+
+def plot_div(data, layout, config = None, div_id = None):
+    """Plotly div for serialized traces (`data`, a JSON list) and a layout,
+    like plotly.offline.plot(..., output_type = 'div')."""
+    div_id = div_id or str(uuid.uuid4())
+    layout = layout.to_plotly_json() if hasattr(layout, 'to_plotly_json') else layout
+    width = '{}px'.format(layout['width']) if 'width' in layout else '100%'
+    height = '{}px'.format(layout['height']) if 'height' in layout else '100%'
+    return ('<div id="{id}" style="height: {height}; width: {width};" class="plotly-graph-div"></div>'
+            '<script type="text/javascript">'
+            'Plotly.newPlot("{id}", {data}, {layout}, {config})'
+            '</script>').format(id = div_id, height = height, width = width, data = data,
+                                layout = to_json(layout), config = to_json(config or {}))
+
+
+def render_variants(data, variants, config = None):
+    """Return {name: div} for the traces in `data` drawn with each variant.
+
+    variants -- {name: dict(layout = ..., traces = ..., style = ...)}
+                layout: the layout of this variant
+                traces: positions of the traces to draw (default: all)
+                style:  trace properties changed in this variant, e.g.
+                        {'line': {'width': 1.5}}
+    """
+    traces = [_plain(t) for t in data]
+    styled = set(k for v in variants.values() for k in (v.get('style') or {}))
+    bodies = [to_json({k: v for k, v in t.items() if k not in styled}) for t in traces]
+
+    divs = {}
+    for name, v in variants.items():
+        parts = []
+        for i in (v.get('traces') or range(len(traces))):
+            own = {k: traces[i][k] for k in styled if k in traces[i]}
+            parts.append(_join(to_json(_merge(own, v.get('style') or {})), bodies[i]))
+        divs[name] = plot_div('[' + ', '.join(parts) + ']', v['layout'], config)
+    return divs
@@ -0,0 +1,159 @@
+# Reshape the JHU CSSE time series tables
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+
+DATE_FORMAT = '%m/%d/%y'
+
+
+def date_columns(df, date_format = DATE_FORMAT):
+    """Return (id_cols, date_cols, dates) for a wide JHU table. Date headers
+    ('1/22/20', ...) are parsed once; every other column is a key column."""
+    cols = df.columns.tolist()
+    parsed = pd.to_datetime(pd.Index(cols, dtype = object), format = date_format, errors = 'coerce')
+    is_date = ~parsed.isna()
+    id_cols = [c for c, d in zip(cols, is_date) if not d]
+    date_cols = [c for c, d in zip(cols, is_date) if d]
+    return id_cols, date_cols, pd.DatetimeIndex(parsed[is_date])
+
+
+def converttable(df, value_name = 'value', date_format = DATE_FORMAT):
+    """Convert a wide table (one column per date) into a long table with one
+    row per key and date: <key columns>, 'dt', value_name.
+
+    Rows come out date by date (all keys of the first date, then the second
+    date, ...). The values are read straight from the NumPy block of the date
+    columns, so the only copy made is the long value column itself.
+    """
+    id_cols, date_cols, dates = date_columns(df, date_format = date_format)
+    n_keys, n_dates = df.shape[0], len(date_cols)
+
+    # Date-major order: column-wise ravel of the (keys x dates) block
+    data = {c: expand(df[c].values, n_dates, tile = True) for c in id_cols}
+    data[value_name] = df[date_cols].values.ravel(order = 'F')
+    data['dt'] = np.repeat(dates.values, n_keys)
+    # Same column layout as the original per-date concat: keys, value, dt
+    return pd.DataFrame(data, columns = id_cols + [value_name, 'dt'])
+
+
+def align_metrics(tables, metrics, keys = ('Province/State', 'Country/Region'),
+                  strict = False, date_format = DATE_FORMAT):
+    """Long table of several wide tables of the same places and dates
+    ({metric: table}, e.g. confirmed and deaths): the key columns of the
+    first metric's table, 'dt' and one column per metric, in the order of
+    `metrics`. Rows come out like converttable's.
+
+    The tables are stacked side by side, without a join. The rows of the
+    other tables are checked against the first one by their `keys`; when
+    they are not in the same order they are matched by key. Places or dates
+    missing from a table get NaN, places only in another table are left out;
+    both are reported with a warning (a ValueError when `strict`).
+    """
+    first = tables[metrics[0]]
+    _, date_cols, _ = date_columns(first, date_format = date_format)
+    df = converttable(first, value_name = metrics[0], date_format = date_format)
+    index = None
+    for m in metrics[1:]:
+        other = tables[m]
+        problems = []
+        missing_dates = [c for c in date_cols if c not in other.columns]
+        if missing_dates:
+            problems.append('no column for {} date(s) from {}'.format(len(missing_dates), missing_dates[0]))
+        block = other.reindex(columns = date_cols).values
+        if not (len(other) == len(first) and all(_same(first[k], other[k]) for k in keys)):
+            if index is None:
+                index = _key_index(first, keys)
+            other_index = _key_index(other, keys)
+            if index.has_duplicates or other_index.has_duplicates:
+                raise ValueError('duplicate {} in {}'.format(' / '.join(keys), m if other_index.has_duplicates else metrics[0]))
+            rows = other_index.get_indexer(index)
+            if (rows < 0).any():
+                problems.append('no row for {}'.format(_names(index[rows < 0])))
+            extra = other_index.difference(index)
+            if len(extra):
+                problems.append('rows left out: {}'.format(_names(extra)))
+            if (rows < 0).any():
+                block = np.vstack([block.astype(float), np.full((1, block.shape[1]), np.nan)])
+            block = block[rows]
+        if problems:
+            message = '{} does not match {}: {}'.format(m, metrics[0], '; '.join(problems))
+            if strict:
+                raise ValueError(message)
+            warnings.warn(message)
+        df[m] = block.ravel(order = 'F')
+    return df
+
+
+def _same(a, b):
+    # Same values in the same order, NaN matching NaN
+    return pd.Series(a.values).equals(pd.Series(b.values))
+
+
+def _key_index(df, keys):
+    # NaN (no province) as '' so that it matches itself
+    return pd.MultiIndex.from_arrays([df[k].fillna('').values for k in keys])
+
+
+def _names(index, most = 5):
+    names = [', '.join(str(v) for v in key if v != '') for key in index[:most]]
+    return '; '.join(names) + (' and {} more'.format(len(index) - most) if len(index) > most else '')
+
+
+def expand(values, n, tile = False):
+    """Every value `n` times in a row (a a b b), or the whole array `n` times
+    over with tile (a b a b). Categoricals are expanded through their
+    integer codes."""
+    how = np.tile if tile else np.repeat
+    if isinstance(values, pd.Categorical):
+        return pd.Categorical.from_codes(how(values.codes, n), dtype = values.dtype)
+    return how(values, n)
+
+
+def rollup_provinces(df, centroids, by = 'Country/Region', order = 'dt',
+                     province = 'Province/State', columns = None):
+    """Aggregate the provinces of every country listed in `centroids` into a
+    single country row per date, in one groupby pass.
+
+    centroids -- table with the columns `by`, 'Lat' and 'Long'; the country
+                 rows get these coordinates and a NaN province
+    columns   -- columns to sum (default: every numeric column but Lat/Long)
+
+    A country that is not listed but has several rows for a date (a new
+    country reported by province) is rolled up too, at the mean Lat/Long of
+    its rows, with a warning. The other countries keep their rows untouched.
+    The rolled up rows are appended after them, in the order of the centroid
+    table, then of the country names. A sum over provinces that all have
+    NaN (e.g. no recovered cases by province) stays NaN.
+    """
+    if columns is None:
+        columns = [c for c in df.select_dtypes(include = [np.number]).columns
+                   if c not in ('Lat', 'Long')]
+
+    centroids = centroids.set_index(by)[['Lat', 'Long']]
+    listed = df[by].isin(centroids.index).values
+    unlisted = df[~listed]
+    extra = sorted(unlisted.loc[unlisted.duplicated([by, order]).values, by].unique())
+    if extra:
+        warn_unlisted(extra)
+        rows = df[by].isin(extra).values
+        centroids = pd.concat([centroids, df[rows].groupby(by)[['Lat', 'Long']].mean().reindex(extra)])
+        listed = listed | rows
+
+    agg = df[listed].groupby(by = [by, order])[columns].sum(min_count = 1)
+    agg.reset_index(inplace = True)
+    position = pd.Series(np.arange(len(centroids)), index = centroids.index)
+    agg = agg.iloc[np.lexsort((agg[order].values, position.reindex(agg[by]).values))]
+    agg['Lat'] = centroids['Lat'].reindex(agg[by]).values
+    agg['Long'] = centroids['Long'].reindex(agg[by]).values
+    agg[province] = np.nan
+
+    return pd.concat([df[~listed], agg], sort = False, ignore_index = True)
+
+
+def warn_unlisted(countries):
+    """Warn that `countries` were rolled up without a centroid."""
+    warnings.warn('No centroid for {} (several rows per date): rolled up at the mean Lat/Long '
+                  'of the provinces; add a row to country_centroids.csv'.format(', '.join(map(str, countries))))
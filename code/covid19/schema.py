@@ -0,0 +1,72 @@
+# Compact column types for the long table
+#
+# After the merges most columns are object strings or float64 (NaN fills
+# turn counts into floats). Countries are stored as categoricals, counts as
+# nullable integers and the derived rates and averages as float32, which
+# keeps ~7 significant digits: plenty for the charts and tables. Coordinates
+# stay float64 (one value per place, nothing to gain).
+
+import numpy as np
+
+
+# Column -> dtype; float64 columns not listed here become FLOAT_DTYPE and
+# the days since a milestone DAYS_DTYPE
+SCHEMA = {'Country/Region': 'category',
+          'Province/State': 'category',
+          'Lat': 'float64',
+          'Long': 'float64',
+          'confirmed': 'Int32',
+          'deaths': 'Int32',
+          'recovered': 'Int32',
+          'active': 'Int32',
+          'population_2018': 'Int64',
+          # US files (see us.py)
+          'UID': 'Int64',
+          'iso2': 'category',
+          'iso3': 'category',
+          'FIPS': 'Int32',
+          'Admin2': 'category',
+          'Province_State': 'category',
+          'Country_Region': 'category',
+          'Long_': 'float64',
+          'Combined_Key': 'category',
+          'Population': 'Int64',
+          'key': 'category',
+          'level': 'category',
+         }
+FLOAT_DTYPE = 'float32'
+DAYS_DTYPE = 'Int16'
+
+
+def memory(df):
+    """Bytes used by df, strings included."""
+    return int(df.memory_usage(index = True, deep = True).sum())
+
+
+def dtypes_for(df, schema = None):
+    """The compact dtype of every column of df that changes."""
+    schema = SCHEMA if schema is None else schema
+    dtypes = {}
+    for c in df.columns:
+        if c in schema:
+            dtype = schema[c]
+        elif c.startswith('days_since_'):
+            dtype = DAYS_DTYPE
+        elif df[c].dtype == np.float64:
+            dtype = FLOAT_DTYPE
+        else:
+            continue
+        if str(df[c].dtype) != dtype:
+            dtypes[c] = dtype
+    return dtypes
+
+
+def compact(df, schema = None):
+    """Return (df with compact dtypes, (bytes before, bytes after)).
+
+    Integer columns must hold whole numbers (NaN becomes <NA>); astype
+    raises otherwise.
+    """
+    before = memory(df)
+    df = df.astype(dtypes_for(df, schema))
+    return df, (before, memory(df))
@@ -0,0 +1,64 @@
+# Cross-sections of the long table by date
+#
+# The summary charts and tables show the latest date (or a few days before).
+# Snapshots splits the table by date once (see groups.py) so a date's rows
+# are a slice, and remembers the aggregates (maximum of a column, ...) asked
+# for on each date, which the charts use many times for reference lines.
+
+import pandas as pd
+
+from .groups import GroupIndex
+
+
+class Snapshot(object):
+    """The rows of one date (`table`, in the order of the long table) and
+    memoized aggregates of its columns."""
+
+    def __init__(self, date, table):
+        self.date = date
+        self.table = table
+        self._aggregates = {}
+
+    def aggregate(self, column, how):
+        """table[column].<how>(), computed once."""
+        key = (column, how)
+        if key not in self._aggregates:
+            self._aggregates[key] = getattr(self.table[column], how)()
+        return self._aggregates[key]
+
+    def max(self, column):
+        return self.aggregate(column, 'max')
+
+    def min(self, column):
+        return self.aggregate(column, 'min')
+
+    def sum(self, column):
+        return self.aggregate(column, 'sum')
+
+
+class Snapshots(object):
+    """Snapshot of the long table at any of its dates.
+
+    snapshots.latest()     -- the last date
+    snapshots.latest(2)    -- two dates before the last one
+    snapshots.at('4/1/20') -- a given date (KeyError if not in the table)
+    """
+
+    def __init__(self, df, order = 'dt'):
+        self.index = GroupIndex(df, by = order)
+        self.dates = pd.DatetimeIndex(sorted(self.index))
+        self._snapshots = {}
+
+    def at(self, date):
+        date = pd.Timestamp(date)
+        if date not in self.index:
+            raise KeyError('no rows on {}'.format(date.date()))
+        if date not in self._snapshots:
+            self._snapshots[date] = Snapshot(date, self.index[date])
+        return self._snapshots[date]
+
+    def latest(self, days_back = 0):
+        return self.at(self.dates[-1 - days_back])
+
+    def cache_key(self):
+        return self.index.cache_key()
@@ -0,0 +1,41 @@
+# Columnar on-disk store for the long table
+#
+# The table is written as Parquet (or Feather / Arrow IPC, chosen by the file
+# extension) with its column types, so the charts can be rendered from disk
+# without running the download and derivation steps first.
+
+import os
+
+import pandas as pd
+
+
+FORMATS = {'.parquet': 'parquet', '.feather': 'feather', '.arrow': 'feather'}
+
+
+def _format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError('unknown table format {!r}, use one of {}'.format(ext, sorted(FORMATS)))
+    return FORMATS[ext]
+
+
+def save_table(df, path):
+    """Write df to `path` (.parquet, .feather or .arrow). The index is not
+    kept; rows are written in their current order."""
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    df = df.reset_index(drop = True)
+    tmp = path + '.tmp'
+    if _format(path) == 'parquet':
+        df.to_parquet(tmp, index = False)
+    else:
+        df.to_feather(tmp)
+    os.replace(tmp, path)
+
+
+def load_table(path, columns = None):
+    """Read a table written by save_table, optionally only some columns."""
+    if _format(path) == 'parquet':
+        return pd.read_parquet(path, columns = columns)
+    return pd.read_feather(path, columns = columns)
@@ -0,0 +1,124 @@
+# JHU-shaped synthetic data for benchmarks and tests
+#
+# Wide tables like time_series_covid19_{confirmed,deaths}_global.csv:
+# Province/State, Country/Region, Lat, Long and one column of cumulative
+# counts per date, at any number of countries, days and provinces. Country
+# names are taken from the population table (so the population join
+# matches) and the countries with centroids get the provinces (so the
+# rollup has work to do); extra countries are numbered.
+#
+# make_us_tables() gives the US files (time_series_covid19_{confirmed,
+# deaths}_US.csv): one row per county, UID to Combined_Key, plus an
+# 'Unassigned' row of no population in every state; 52 states of 63 counties
+# is the ~3,300 rows of the real files.
+
+import numpy as np
+import pandas as pd
+
+
+FIRST_DATE = '2020-01-22'
+
+
+def country_names(n, population = None, centroids = None):
+    """n country names: the centroid countries first, then the countries of
+    the population table, then 'Country 0000', ..."""
+    names = []
+    for table in (centroids, population):
+        if table is not None:
+            names.extend(c for c in table['Country/Region'] if c not in names)
+    names = names[:n]
+    names.extend('Country {:04d}'.format(i) for i in range(n - len(names)))
+    return names
+
+
+def make_tables(countries = 190, days = 300, provinces = 10, population = None,
+                centroids = None, seed = 0):
+    """Return {'confirmed': wide table, 'deaths': wide table}.
+
+    countries  -- number of countries
+    days       -- number of date columns, from FIRST_DATE on
+    provinces  -- provinces of each centroid country (the others have one
+                  row with no province)
+    population -- population table with a 'Country/Region' column, for the
+                  country names
+    centroids  -- centroid table (see rollup_provinces)
+
+    Counts start at a random day and grow exponentially, then linearly;
+    deaths are a fixed fraction of the confirmed cases of each row.
+    """
+    rng = np.random.RandomState(seed)
+    names = country_names(countries, population = population, centroids = centroids)
+    split = set(centroids['Country/Region']) if centroids is not None else set()
+
+    country, province = [], []
+    for name in names:
+        if name in split and provinces > 0:
+            country.extend([name]*provinces)
+            province.extend('{} {:02d}'.format(name, i) for i in range(provinces))
+        else:
+            country.append(name)
+            province.append(np.nan)
+    n = len(country)
+
+    keys = pd.DataFrame({'Province/State': province,
+                         'Country/Region': country,
+                         'Lat': rng.uniform(-60, 70, n).round(4),
+                         'Long': rng.uniform(-180, 180, n).round(4)},
+                        columns = ['Province/State', 'Country/Region', 'Lat', 'Long'])
+    dates = _headers(days)
+    confirmed, deaths = _counts(rng, n, days)
+
+    return {metric: pd.concat([keys, pd.DataFrame(values, columns = dates)], axis = 1)
+            for metric, values in (('confirmed', confirmed), ('deaths', deaths))}
+
+
+def make_us_tables(states = 52, counties = 63, days = 300, seed = 0):
+    """Return {'confirmed': wide table, 'deaths': wide table} shaped like
+    the JHU US files: `counties` counties and an 'Unassigned' row in each of
+    `states` states ('State 00', ...), `days` date columns. Only the deaths
+    table has the Population column, as in the JHU files."""
+    rng = np.random.RandomState(seed)
+    state = np.repeat(['State {:02d}'.format(i) for i in range(states)], counties + 1)
+    number = np.tile(np.arange(counties + 1), states)
+    county = np.where(number < counties, ['County {:03d}'.format(i) for i in number], 'Unassigned')
+    fips = np.repeat(np.arange(1, states + 1), counties + 1)*1000 + number + 1
+    n = len(state)
+
+    keys = pd.DataFrame({'UID': 84000000 + fips,
+                         'iso2': 'US',
+                         'iso3': 'USA',
+                         'code3': 840,
+                         'FIPS': np.where(number < counties, fips, np.nan),
+                         'Admin2': county,
+                         'Province_State': state,
+                         'Country_Region': 'US',
+                         'Lat': rng.uniform(20, 50, n).round(4),
+                         'Long_': rng.uniform(-125, -70, n).round(4)},
+                        columns = ['UID', 'iso2', 'iso3', 'code3', 'FIPS', 'Admin2', 'Province_State',
+                                   'Country_Region', 'Lat', 'Long_'])
+    keys['Combined_Key'] = [', '.join(k) for k in zip(county, state, keys['Country_Region'])]
+    population = np.where(number < counties, rng.randint(1000, 2000000, n), 0)
+
+    dates = _headers(days)
+    confirmed, deaths = _counts(rng, n, days)
+    return {'confirmed': pd.concat([keys, pd.DataFrame(confirmed, columns = dates)], axis = 1),
+            'deaths': pd.concat([keys.assign(Population = population),
+                                 pd.DataFrame(deaths, columns = dates)], axis = 1)}
+
+
+def _headers(days):
+    # JHU headers: 1/22/20
+    return ['{}/{}/{:%y}'.format(d.month, d.day, d) for d in pd.date_range(FIRST_DATE, periods = days)]
+
+
+def _counts(rng, n, days):
+    # (confirmed, deaths) of n rows: from a random day on, exponential then
+    # linear growth; deaths a fixed fraction of each row's confirmed cases
+    t = np.arange(days)[None, :] - rng.randint(0, max(days, 1), n)[:, None]
+    rate = rng.uniform(0.05, 0.2, (n, 1))
+    peak = rng.uniform(20, 50, (n, 1))
+    t = np.clip(t, 0, None)
+    growth = np.exp(rate*np.minimum(t, peak)) + np.exp(rate*peak)*rate*np.maximum(t - peak, 0)
+    confirmed = np.where(t > 0, np.floor(growth*rng.uniform(1, 10, (n, 1))), 0).astype(np.int64)
+    deaths = np.floor(confirmed*rng.uniform(0, 0.08, (n, 1))).astype(np.int64)
+    return confirmed, deaths
@@ -0,0 +1,114 @@
+# JHU CSSE US time series: counties, states and the country
+#
+# The US files have one row per county (plus 'Unassigned', 'Out of <state>',
+# territories and cruise ships), keyed by UID with the Admin2 (county),
+# Province_State and Country_Region names and a Combined_Key such as
+# 'Autauga, Alabama, US'. The deaths file also has the county Population.
+#
+# hierarchy() stacks the counties with their states and the country, summed
+# in one groupby per level, with a `key` column (the Combined_Key: 'Alabama,
+# US' for a state, 'US' for the country). The sums are taken on the wide
+# tables (a few thousand rows, one column per date), before the long table
+# is built. us_panel() keeps them as a Panel (one row per key, one column per
+# date) for the derivation steps, which then run on all levels at once.
+#
+# Throughput target: the US pipeline (reshape, hierarchy, derived columns
+# and compact dtypes) should process at least 1,000,000 county rows (UIDs x
+# dates) per second on one core, i.e. ~3,300 UIDs x 300 days in about one
+# second. There is no per-row or per-group Python loop in these steps.
+
+import numpy as np
+import pandas as pd
+
+from .panel import Panel
+from .reshape import DATE_FORMAT, date_columns
+from .schema import SCHEMA
+
+
+# Levels of the hierarchy, top down: (level, name columns)
+LEVELS = [('country', ['Country_Region']),
+          ('state', ['Country_Region', 'Province_State']),
+          ('county', ['Country_Region', 'Province_State', 'Admin2']),
+         ]
+
+
+def us_panel(confirmed, deaths, levels = LEVELS, date_format = DATE_FORMAT):
+    """The US files as a Panel by `key`: one row per key of every level, in
+    the order of hierarchy(), with confirmed and deaths by date and the key
+    columns and Population as attributes. Its to_long() has the key columns,
+    level, key, Population, confirmed, 'dt' and deaths, one row per key and
+    date, key by key.
+
+    The deaths rows are matched to the confirmed rows by UID.
+    """
+    keys, values, date_cols, dates = _levels(confirmed, deaths, levels, date_format)
+    n = len(date_cols)
+
+    panel = Panel(keys['key'].values, dates, by = 'key')
+    for c in keys.columns:
+        if c != 'key':
+            panel.attributes[c] = keys[c].values
+    panel.attributes['Population'] = values[:, 0]
+    panel.values['confirmed'] = values[:, 1:n + 1]
+    panel.values['deaths'] = values[:, n + 1:]
+    panel.columns = list(keys.columns) + ['Population', 'confirmed', 'dt', 'deaths']
+    return panel
+
+
+def _levels(confirmed, deaths, levels, date_format):
+    # (keys, values, date columns, dates) of all levels; values are the
+    # population, then confirmed and deaths by date
+    id_cols, date_cols, dates = date_columns(confirmed, date_format = date_format)
+    deaths = deaths.set_index('UID').reindex(confirmed['UID'].values)
+
+    # One block for all the sums: population, confirmed and deaths by date
+    values = np.column_stack([deaths['Population'].values,
+                              confirmed[date_cols].values,
+                              deaths[date_cols].values])
+    keys, values = hierarchy(confirmed[id_cols], values, levels = levels)
+
+    # Names as categoricals: only their codes are repeated in the long table
+    keys = keys.astype({c: 'category' for c in keys.columns if SCHEMA.get(c) == 'category'})
+    return keys, values, date_cols, dates
+
+
+def hierarchy(keys, values, levels = LEVELS):
+    """Stack the rows of the lowest level (e.g. counties) with their sums over
+    every higher level.
+
+    keys   -- the key columns of the rows (the name columns of the levels)
+    values -- 2-D array, one row per row of keys, of the values to sum
+              (counts by date, population)
+
+    Return (keys, values) for all levels. The keys get a `level` column,
+    the name columns of the levels (NaN below the row's own level) and a
+    `key` column naming the row ('US', 'Alabama, US', 'Autauga, Alabama,
+    US'). Rows come out level by level, top down, the lowest level in its
+    original order.
+    """
+    keys = keys.reset_index(drop = True)
+    parts, sums = [], []
+    for level, names in levels[:-1]:
+        codes = keys.groupby(by = names, sort = True).ngroup().values
+        sums.append(pd.DataFrame(values).groupby(codes).sum().values)
+        upper = keys[names].drop_duplicates().sort_values(by = names)
+        upper.reset_index(drop = True, inplace = True)
+        upper['key'] = _join_names(upper, names)
+        upper['level'] = level
+        parts.append(upper)
+
+    level, names = levels[-1]
+    lowest = keys.copy()
+    lowest['key'] = lowest['Combined_Key'].values if 'Combined_Key' in lowest else _join_names(lowest, names)
+    lowest['level'] = level
+    parts.append(lowest)
+    sums.append(values)
+    return pd.concat(parts, ignore_index = True, sort = False), np.concatenate(sums)
+
+
+def _join_names(df, names):
+    # 'Autauga, Alabama, US': lowest level first, like the Combined_Key
+    key = df[names[-1]].astype(str)
+    for n in names[-2::-1]:
+        key = key.str.cat(df[n].astype(str), sep = ', ')
+    return key.values
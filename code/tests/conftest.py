@@ -0,0 +1,70 @@
+# Shared fixtures: synthetic JHU tables (see covid19/synthetic.py) and
+# scratch copies of the repository layout to run the notebook in
+#
+# Run from code/:  python -m pytest -q tests
+
+import os
+import shutil
+import sys
+
+import pandas as pd
+import pytest
+
+CODE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, CODE)
+
+import benchmark
+from covid19.reshape import date_columns
+from covid19.synthetic import make_tables
+
+
+DATA_TABLES = os.path.join(CODE, '..', 'data_tables')
+
+
+@pytest.fixture
+def population():
+    df = pd.read_csv(os.path.join(DATA_TABLES, 'world_pop_by_country.csv'))
+    return df.rename(columns = {'Country Name': 'Country/Region'})
+
+
+@pytest.fixture
+def centroids():
+    return pd.read_csv(os.path.join(DATA_TABLES, 'country_centroids.csv'))
+
+
+@pytest.fixture
+def tables(population, centroids):
+    """Wide confirmed and deaths tables: 12 countries (the 7 centroid
+    countries split into 3 provinces), 40 days."""
+    return make_tables(countries = 12, days = 40, provinces = 3,
+                       population = population, centroids = centroids, seed = 1)
+
+
+def first_days(df, days):
+    """The wide table with its first `days` date columns only."""
+    id_cols, date_cols, _ = date_columns(df)
+    return df[id_cols + date_cols[:days]]
+
+
+@pytest.fixture
+def notebook(tmp_path):
+    """notebook(name, tables, data_tables = None, **env) writes `tables`
+    ({metric: wide table}) into the data cache of a scratch layout `name`
+    (created on first use) and `data_tables` ({file name: table}) over its
+    copy of data_tables/, runs the notebook there offline and returns its
+    globals."""
+
+    def run(name, tables, data_tables = None, **env):
+        workdir = str(tmp_path/name)
+        if not os.path.isdir(workdir):
+            os.makedirs(os.path.join(workdir, 'code'))
+            os.makedirs(os.path.join(workdir, 'data_cache'))
+            shutil.copytree(DATA_TABLES, os.path.join(workdir, 'data_tables'))
+        for filename, df in (data_tables or {}).items():
+            df.to_csv(os.path.join(workdir, 'data_tables', filename), index = False)
+        for metric, df in tables.items():
+            path = os.path.join(workdir, 'data_cache', 'time_series_covid19_{}_global.csv'.format(metric))
+            df.to_csv(path, index = False)
+        return benchmark.run_notebook(workdir, env = env)
+
+    return run
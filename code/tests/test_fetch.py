@@ -0,0 +1,85 @@
+# The JHU download through a local HTTP stand-in (what COVID19_DATA_URL
+# points the notebook to)
+
+import functools
+import http.server
+import os
+import threading
+import time
+
+import pytest
+
+from covid19 import CacheMiss, read_jhu
+from covid19.fetch import fetch
+
+
+@pytest.fixture
+def server(tmp_path):
+    """(base URL, served directory, list of the HTTP status codes sent)."""
+    served = tmp_path/'upstream'
+    served.mkdir()
+    codes = []
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def log_request(self, code = '-', size = '-'):
+            codes.append(int(code))
+
+    handler = functools.partial(Handler, directory = str(served))
+    httpd = http.server.HTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target = httpd.serve_forever, daemon = True)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{}/'.format(httpd.server_port), served, codes
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def publish(served, tables):
+    for metric, df in tables.items():
+        df.to_csv(str(served/'time_series_covid19_{}_global.csv'.format(metric)), index = False)
+
+
+def test_download_revalidate_and_change(server, tables, tmp_path):
+    base_url, served, codes = server
+    cache_dir = str(tmp_path/'cache')
+    publish(served, tables)
+
+    df = read_jhu('confirmed_global', cache_dir, base_url = base_url)
+    assert df.shape == tables['confirmed'].shape
+    assert codes == [200]
+
+    # Unchanged upstream: conditional request, answered 304, cached file read
+    path = fetch(base_url + 'time_series_covid19_confirmed_global.csv', cache_dir)
+    assert codes == [200, 304]
+    assert os.path.exists(path + '.meta.json')
+
+    # Changed upstream: downloaded again
+    later = time.time() + 10
+    publish(served, {'confirmed': tables['confirmed'].iloc[:5]})
+    os.utime(str(served/'time_series_covid19_confirmed_global.csv'), (later, later))
+    assert len(read_jhu('confirmed_global', cache_dir, base_url = base_url)) == 5
+    assert codes == [200, 304, 200]
+
+
+def test_offline_reads_the_cache_only(server, tables, tmp_path):
+    base_url, served, codes = server
+    cache_dir = str(tmp_path/'cache')
+    with pytest.raises(CacheMiss):
+        read_jhu('confirmed_global', cache_dir, base_url = base_url, offline = True)
+
+    publish(served, tables)
+    read_jhu('confirmed_global', cache_dir, base_url = base_url)
+    df = read_jhu('confirmed_global', cache_dir, base_url = base_url, offline = True)
+    assert df.shape == tables['confirmed'].shape
+    assert codes == [200]
+
+
+def test_server_down_uses_the_cache(server, tables, tmp_path):
+    base_url, served, codes = server
+    cache_dir = str(tmp_path/'cache')
+    publish(served, tables)
+    read_jhu('confirmed_global', cache_dir, base_url = base_url)
+    with pytest.warns(UserWarning, match = 'Using cached'):
+        df = read_jhu('confirmed_global', cache_dir, base_url = 'http://127.0.0.1:9/')
+    assert df.shape == tables['confirmed'].shape
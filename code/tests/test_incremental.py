@@ -0,0 +1,72 @@
+import pandas as pd
+import pytest
+
+import covid19.derivation
+from conftest import first_days
+from covid19 import plan_update
+
+
+def test_incremental_update_equals_full_rebuild(notebook, tables):
+    g = notebook('incremental', {m: first_days(df, 30) for m, df in tables.items()},
+                 COVID19_INCREMENTAL = '1')
+    assert g['results']['plan'].mode == 'full'
+
+    g = notebook('incremental', {m: first_days(df, 35) for m, df in tables.items()},
+                 COVID19_INCREMENTAL = '1')
+    assert g['results']['plan'].mode == 'incremental'
+    updated = g['df_merged']
+
+    full = notebook('full', {m: first_days(df, 35) for m, df in tables.items()})['df_merged']
+    pd.testing.assert_frame_equal(updated, full)
+
+
+def test_revised_history_rebuilds(notebook, tables):
+    notebook('revised', {m: first_days(df, 30) for m, df in tables.items()}, COVID19_INCREMENTAL = '1')
+    revised = {m: first_days(df, 32).copy() for m, df in tables.items()}
+    revised['deaths'].iloc[0, -10] += 1
+    g = notebook('revised', revised, COVID19_INCREMENTAL = '1')
+    assert g['results']['plan'].mode == 'full'
+    assert 'revised' in g['results']['plan'].reason
+
+
+def test_changed_parameters_rebuild(notebook, tables, tmp_path):
+    notebook('parameters', {m: first_days(df, 30) for m, df in tables.items()}, COVID19_INCREMENTAL = '1')
+    # Revised population of one country
+    path = str(tmp_path/'parameters'/'data_tables'/'world_pop_by_country.csv')
+    population = pd.read_csv(path)
+    population.loc[0, '2018'] += 1000
+    population.to_csv(path, index = False)
+    g = notebook('parameters', {m: first_days(df, 32) for m, df in tables.items()}, COVID19_INCREMENTAL = '1')
+    assert g['results']['plan'].mode == 'full'
+    assert 'parameters' in g['results']['plan'].reason
+
+
+def test_changed_derivation_rebuilds(notebook, tables, tmp_path):
+    g = notebook('derivation', {m: first_days(df, 30) for m, df in tables.items()}, COVID19_INCREMENTAL = '1')
+    config = g['results']['plan'].config
+    state_dir = str(tmp_path/'derivation'/'data_cache')
+    newer = {m: first_days(df, 32) for m, df in tables.items()}
+
+    assert plan_update(state_dir, newer, config = config).mode == 'incremental'
+    assert plan_update(state_dir, newer, config = config + 'x').mode == 'full'
+
+    # A column more (e.g. a new milestone) cannot be spliced onto the old rows
+    plan = plan_update(state_dir, newer, config = config)
+    df = plan.previous.copy()
+    df['first_100confirmed'] = pd.NaT
+    with pytest.raises(ValueError, match = 'columns changed'):
+        plan.combine(df, [])
+
+
+def test_incremental_update_follows_the_windows(notebook, tables, monkeypatch):
+    # A wider growth average reads more days around each date: the update
+    # recomputes more of the previous days, and still equals a full rebuild
+    monkeypatch.setitem(covid19.derivation.WINDOWS, 'growth', 9)
+    notebook('windows', {m: first_days(df, 30) for m, df in tables.items()}, COVID19_INCREMENTAL = '1')
+    g = notebook('windows', {m: first_days(df, 35) for m, df in tables.items()},
+                 COVID19_INCREMENTAL = '1')
+    assert g['results']['plan'].mode == 'incremental'
+    updated = g['df_merged']
+
+    full = notebook('full', {m: first_days(df, 35) for m, df in tables.items()})['df_merged']
+    pd.testing.assert_frame_equal(updated, full)
@@ -0,0 +1,32 @@
+import pandas as pd
+import pytest
+
+from covid19.ingest import read_wide
+
+
+def engines():
+    """The readers installed here."""
+    try:
+        import pyarrow.csv  # noqa: F401
+        return ['c', 'pyarrow']
+    except ImportError:
+        return ['c']
+
+
+@pytest.mark.parametrize('engine', engines())
+def test_counts_with_and_without_empty_cells(tables, tmp_path, engine):
+    path = str(tmp_path/'confirmed.csv')
+    df = tables['confirmed'].copy()
+    df.to_csv(path, index = False)
+    complete = read_wide(path, engine = engine)
+    assert (complete.dtypes.iloc[4:] == 'int64').all()
+    pd.testing.assert_frame_equal(complete, df, check_dtype = False)
+
+    # An empty cell
+    df = df.astype({df.columns[-1]: 'Int64'})
+    df.iloc[0, -1] = pd.NA
+    df.to_csv(path, index = False)
+    missing = read_wide(path, engine = engine)
+    assert missing.dtypes.iloc[-1] == 'float64' and pd.isna(missing.iloc[0, -1])
+    assert (missing.dtypes.iloc[4:-1] == 'int64').all()
+    assert missing.iloc[1:, -1].tolist() == df.iloc[1:, -1].tolist()
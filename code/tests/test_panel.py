@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from covid19.panel import Panel, days_since, first_reached, growth, window_mean
+
+
+DATES = pd.date_range('2020-01-22', periods = 4)
+NaT = np.datetime64('NaT')
+
+
+def test_first_nonzero_count():
+    # A negative correction is a nonzero count; NaN is not
+    x = np.array([[0, -1, 0, 2], [0, 0, 0, 0], [np.nan, 0, 3, 3]])
+    first = first_reached(x, ('!=', 0), DATES)
+    np.testing.assert_array_equal(first, np.array([DATES[1], NaT, DATES[2]], dtype = 'datetime64[ns]'))
+
+    pl = pytest.importorskip('polars')
+    from covid19 import lazy
+    df = pd.DataFrame({'Country/Region': np.repeat(['A', 'B', 'C'], 4), 'dt': np.tile(DATES, 3),
+                       'confirmed': x.ravel()})
+    out = (pl.from_pandas(df).lazy()
+             .with_columns(lazy.milestones([('confirmed', ('!=', 0), 'first_confirmed', 'days')]))
+             .collect().to_pandas())
+    np.testing.assert_array_equal(out.groupby('Country/Region')['first_confirmed'].first().values,
+                                  first)
+
+
+def test_window_mean_matches_the_centered_3_day_average():
+    # The original average: pandas rolling(3, center = True) country by country
+    rng = np.random.RandomState(0)
+    x = rng.poisson(20, size = (5, 30)).astype(float)
+    x[1, 7] = np.nan
+    expected = pd.DataFrame(x.T).rolling(3, center = True).mean().values.T
+    np.testing.assert_allclose(window_mean(x, window = 3, center = True, edge = 'nan'), expected)
+
+
+def test_window_mean_trailing_and_centered():
+    x = np.array([[1., 2., 3., 4., 5.]])
+    np.testing.assert_allclose(window_mean(x, window = 3, center = False), [[np.nan, np.nan, 2, 3, 4]])
+    np.testing.assert_allclose(window_mean(x, window = 3, center = True), [[np.nan, 2, 3, 4, np.nan]])
+    # Even window: one more day before than after
+    np.testing.assert_allclose(window_mean(x, window = 4, center = True), [[np.nan, np.nan, 2.5, 3.5, np.nan]])
+    with pytest.raises(ValueError):
+        window_mean(x, window = 0)
+
+
+def test_window_mean_edge_policies():
+    x = np.array([[1., np.nan, 3., 4.]])
+    np.testing.assert_allclose(window_mean(x, window = 3, edge = 'nan'), [[np.nan, np.nan, np.nan, np.nan]])
+    # The values that are available
+    np.testing.assert_allclose(window_mean(x, window = 3, edge = 'shrink'), [[1, 2, 3.5, 3.5]])
+    np.testing.assert_allclose(window_mean(np.full((1, 3), np.nan), edge = 'shrink'), np.full((1, 3), np.nan))
+    with pytest.raises(ValueError):
+        window_mean(x, edge = 'zero')
+
+
+def test_growth_matches_the_original_loop():
+    # Today / yesterday, NaN when yesterday is 0 (a NaN yesterday gives NaN)
+    rng = np.random.RandomState(1)
+    x = rng.poisson(2, size = (4, 20)).astype(float)
+    x[2, 5] = np.nan
+    expected = np.full(x.shape, np.nan)
+    for r in range(x.shape[0]):
+        for i in range(1, x.shape[1]):
+            if x[r, i - 1] != 0:
+                expected[r, i] = x[r, i]/x[r, i - 1]
+    np.testing.assert_allclose(growth(x, on_zero = 'nan'), expected)
+
+
+def test_growth_zero_policies():
+    x = np.array([[2., 4., 0., 3., 0., 0.]])
+    np.testing.assert_allclose(growth(x, on_zero = 'nan'), [[np.nan, 2, 0, np.nan, 0, np.nan]])
+    # x/0 gives inf, 0/0 NaN
+    np.testing.assert_allclose(growth(x, on_zero = 'inf'), [[np.nan, 2, 0, np.inf, 0, np.nan]])
+    np.testing.assert_allclose(growth(x, on_zero = 'inf', clip = (0, 10)), [[np.nan, 2, 0, 10, 0, np.nan]])
+    np.testing.assert_allclose(growth(x, clip = (0, 1.5)), [[np.nan, 1.5, 0, np.nan, 0, np.nan]])
+    with pytest.raises(ValueError):
+        growth(x, on_zero = 'zero')
+
+
+def test_milestone_never_reached():
+    x = np.array([[10., 60., 80., 90.], [1., 2., 3., 4.]])
+    first = first_reached(x, 50, DATES)
+    # Not the first date, as idxmax gave
+    np.testing.assert_array_equal(first, np.array([DATES[1], NaT], dtype = 'datetime64[ns]'))
+    days = days_since(first, DATES)
+    np.testing.assert_array_equal(days[0], [-1, 0, 1, 2])
+    assert np.isnan(days[1]).all()
+
+
+def test_add_milestones_with_overrides():
+    panel = Panel(['A', 'B'], DATES)
+    panel['confirmed'] = np.array([[0., 5., 60., 70.], [3., 4., 5., 6.]])
+    panel.add_milestones([('confirmed', 50), ('confirmed', 1, 'first_confirmed', 'days_since_1st_conf')],
+                         overrides = {'first_confirmed': {'B': '2019-12-31', 'Atlantis': '2020-01-01'}})
+    assert panel.columns[-4:] == ['first_50confirmed', 'days_since_50_confirmed',
+                                  'first_confirmed', 'days_since_1st_conf']
+    np.testing.assert_array_equal(panel['first_50confirmed'],
+                                  np.array([DATES[2], NaT], dtype = 'datetime64[ns]'))
+    np.testing.assert_array_equal(panel['first_confirmed'],
+                                  np.array([DATES[1], '2019-12-31'], dtype = 'datetime64[ns]'))
+    np.testing.assert_array_equal(panel['days_since_1st_conf'][1], [22, 23, 24, 25])
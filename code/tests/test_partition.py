@@ -0,0 +1,33 @@
+import numpy as np
+
+from covid19 import map_rows, us_panel
+from covid19.derivation import derive_columns
+from covid19.panel import days_since, first_reached
+from covid19.partition import partitions
+from covid19.synthetic import make_us_tables
+
+
+def test_partitions_cover_the_rows():
+    for n, parts in [(10, 3), (3, 8), (1, 4), (0, 2), (100, 16)]:
+        blocks = partitions(n, parts)
+        assert len(blocks) <= parts
+        assert [i for start, stop in blocks for i in range(start, stop)] == list(range(n))
+
+
+def test_processes_give_the_serial_result():
+    tables = make_us_tables(states = 4, counties = 10, days = 30, seed = 3)
+    panel = us_panel(tables['confirmed'], tables['deaths'])
+
+    def derive(rows):
+        # The derivation of the US table: derived columns and a milestone
+        columns = derive_columns(rows['confirmed'], rows['deaths'], rows['Population'])
+        first = first_reached(rows['confirmed'], 50, panel.dates)
+        return columns + [('first_50confirmed', first), ('days_since_50th_conf', days_since(first, panel.dates))]
+
+    inputs = {'confirmed': panel['confirmed'], 'deaths': panel['deaths'], 'Population': panel['Population']}
+    serial = map_rows(derive, inputs, processes = 1)
+    forked = map_rows(derive, inputs, processes = 2, blocks = 3, min_cells = 0)
+    assert [name for name, _ in forked] == [name for name, _ in serial]
+    for (name, expected), (_, values) in zip(serial, forked):
+        assert values.dtype == expected.dtype, name
+        np.testing.assert_array_equal(values, expected, err_msg = name)
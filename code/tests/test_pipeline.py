@@ -0,0 +1,66 @@
+from covid19 import Pipeline
+
+
+def make_pipeline(cache_dir, size, calls):
+    pipeline = Pipeline(cache_dir)
+
+    @pipeline.stage('source', params = {'size': size}, cache = False)
+    def source(size):
+        calls.append('source')
+        return list(range(size))
+
+    @pipeline.stage('total', inputs = ['source'])
+    def total(values):
+        calls.append('total')
+        return sum(values)
+
+    @pipeline.stage('double', inputs = ['total'])
+    def double(value):
+        calls.append('double')
+        return 2*value
+
+    return pipeline
+
+
+def test_stages_are_reused_from_the_cache(tmp_path):
+    calls = []
+    assert make_pipeline(str(tmp_path), 10, calls).run(['double'])['double'] == 90
+    assert calls == ['source', 'total', 'double']
+
+    # Same code, parameters and inputs: only the uncached source runs
+    del calls[:]
+    pipeline = make_pipeline(str(tmp_path), 10, calls)
+    assert pipeline.run(['double'])['double'] == 90
+    assert calls == ['source']
+    assert pipeline.timings['total']['cached'] and pipeline.timings['double']['cached']
+
+
+def test_changed_parameter_invalidates_the_stages_after_it(tmp_path):
+    calls = []
+    make_pipeline(str(tmp_path), 10, calls).run(['double'])
+    del calls[:]
+    assert make_pipeline(str(tmp_path), 11, calls).run(['double'])['double'] == 110
+    assert calls == ['source', 'total', 'double']
+
+
+def test_given_outputs_replace_their_stages(tmp_path):
+    calls = []
+    results = make_pipeline(str(tmp_path), 10, calls).run(['double'], given = {'total': 4})
+    assert results['double'] == 8
+    assert calls == ['double']
+
+
+def test_stage_defined_again_replaces_it(tmp_path):
+    calls = []
+    pipeline = make_pipeline(str(tmp_path), 10, calls)
+    pipeline.run(['double'])
+
+    # The cell of 'double' edited and run again
+    @pipeline.stage('double', inputs = ['total'])
+    def double(value):
+        calls.append('triple')
+        return 3*value
+
+    del calls[:]
+    assert pipeline.run(['double'])['double'] == 135
+    assert calls == ['source', 'triple']
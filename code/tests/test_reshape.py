@@ -0,0 +1,97 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from covid19 import align_metrics, converttable
+from covid19.reshape import date_columns
+
+
+def test_align_metrics_same_rows(tables):
+    df = align_metrics(tables, ['confirmed', 'deaths'])
+    assert list(df.columns) == ['Province/State', 'Country/Region', 'Lat', 'Long', 'confirmed', 'dt', 'deaths']
+    expected = converttable(tables['deaths'], value_name = 'deaths')
+    np.testing.assert_array_equal(df['deaths'].values, expected['deaths'].values)
+
+
+def test_align_metrics_matches_reordered_rows(tables):
+    shuffled = dict(tables, deaths = tables['deaths'].iloc[::-1].reset_index(drop = True))
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        df = align_metrics(shuffled, ['confirmed', 'deaths'])
+    pd.testing.assert_frame_equal(df, align_metrics(tables, ['confirmed', 'deaths']))
+
+
+def test_align_metrics_missing_and_extra_rows(tables):
+    deaths = tables['deaths'].drop(index = 0)
+    extra = deaths.iloc[:1].copy()
+    extra['Country/Region'] = 'Atlantis'
+    deaths = pd.concat([deaths, extra], ignore_index = True)
+
+    with pytest.warns(UserWarning, match = 'Atlantis'):
+        df = align_metrics(dict(tables, deaths = deaths), ['confirmed', 'deaths'])
+    first = tables['confirmed'].iloc[0]
+    rows = (df['Country/Region'] == first['Country/Region']) & (df['Province/State'].fillna('') ==
+                                                                  ('' if pd.isna(first['Province/State'])
+                                                                   else first['Province/State']))
+    assert df.loc[rows, 'deaths'].isna().all()
+    assert df.loc[~rows, 'deaths'].notna().all()
+    assert 'Atlantis' not in set(df['Country/Region'])
+
+    with pytest.raises(ValueError):
+        align_metrics(dict(tables, deaths = deaths), ['confirmed', 'deaths'], strict = True)
+
+
+def test_align_metrics_duplicate_places(tables):
+    deaths = pd.concat([tables['deaths'], tables['deaths'].iloc[:1]], ignore_index = True)
+    with pytest.raises(ValueError, match = 'duplicate'):
+        align_metrics(dict(tables, deaths = deaths), ['confirmed', 'deaths'])
+
+
+def recovered_by_country(tables, country):
+    """A recovered table that has `country` as one row, where confirmed
+    has its provinces (like Canada in the JHU files)."""
+    df = tables['deaths'].copy()
+    provinces = df['Country/Region'] == country
+    assert provinces.sum() > 1
+    whole = df[provinces].iloc[:1].copy()
+    whole['Province/State'] = np.nan
+    return pd.concat([df[~provinces], whole], ignore_index = True)
+
+
+@pytest.mark.parametrize('backend', ['pandas', 'polars'])
+def test_country_reported_whole_in_one_file(notebook, tables, backend):
+    if backend == 'polars':
+        pytest.importorskip('polars')
+    tables = dict(tables, recovered = recovered_by_country(tables, 'Canada'))
+    with pytest.warns(UserWarning, match = 'Canada'):
+        g = notebook('recovered', tables, COVID19_RECOVERED = '1', COVID19_BACKEND = backend,
+                     COVID19_VALIDATE = '1')
+    df = g['df_merged']
+    canada = df['Country/Region'] == 'Canada'
+    assert canada.any()
+    # Unknown, not 0
+    assert df.loc[canada, 'recovered'].isna().all()
+    assert df.loc[canada, 'active'].isna().all()
+    others = df[~canada]
+    assert others['recovered'].notna().all()
+    np.testing.assert_array_equal(others['active'].astype(float).values,
+                                  (others['confirmed'] - others['deaths'] - others['recovered']).astype(float).values)
+
+
+@pytest.mark.parametrize('backend', ['pandas', 'polars'])
+def test_country_by_province_without_centroid(notebook, tables, centroids, backend):
+    if backend == 'polars':
+        pytest.importorskip('polars')
+    provinces = tables['confirmed'][tables['confirmed']['Country/Region'] == 'France']
+    assert len(provinces) > 1
+    with pytest.warns(UserWarning, match = 'No centroid for France'):
+        g = notebook('centroid', tables, COVID19_BACKEND = backend, COVID19_VALIDATE = '1',
+                     data_tables = {'country_centroids.csv': centroids[centroids['Country/Region'] != 'France']})
+    df = g['df_merged']
+    france = df[df['Country/Region'] == 'France']
+    assert not france['dt'].duplicated().any()
+    assert np.allclose(france['Lat'], provinces['Lat'].mean())
+    expected = provinces[date_columns(provinces)[1]].sum().values
+    np.testing.assert_array_equal(france.sort_values('dt')['confirmed'].values, expected)
@@ -0,0 +1,26 @@
+import numpy as np
+
+from covid19 import us_panel
+from covid19.synthetic import make_us_tables
+
+
+def test_levels_sum_up():
+    tables = make_us_tables(states = 3, counties = 4, days = 12, seed = 2)
+    # Deaths are matched to the counties by UID, not by position
+    deaths = tables['deaths'].sample(frac = 1, random_state = 0)
+    panel = us_panel(tables['confirmed'], deaths)
+
+    level = np.asarray(panel['level'])
+    state = np.asarray(panel['Province_State'])
+    assert (level == 'country').sum() == 1 and (level == 'state').sum() == 3 and (level == 'county').sum() == 15
+    assert list(panel.entities[level == 'state']) == ['State 00, US', 'State 01, US', 'State 02, US']
+
+    counties = level == 'county'
+    np.testing.assert_array_equal(panel['confirmed'][counties], tables['confirmed'].iloc[:, 11:].values)
+    np.testing.assert_array_equal(panel['deaths'][counties], tables['deaths'].iloc[:, 12:].values)
+    for metric in ['confirmed', 'deaths', 'Population']:
+        values = panel[metric]
+        for name in ['State 00', 'State 01', 'State 02']:
+            np.testing.assert_array_equal(values[(level == 'state') & (state == name)][0],
+                                          values[counties & (state == name)].sum(axis = 0))
+        np.testing.assert_array_equal(values[level == 'country'][0], values[level == 'state'].sum(axis = 0))